@@ -15,8 +15,24 @@ export default function Home() {
 
   useEffect(() => {
     checkServiceStatus()
-    const interval = setInterval(checkServiceStatus, 3000)
-    return () => clearInterval(interval)
+
+    // Prefer the pushed status stream; fall back to polling if it isn't available
+    let interval: ReturnType<typeof setInterval> | null = null
+    const events = new EventSource(`${API_URL}/events`)
+    events.addEventListener('status', (event) => {
+      const delta = JSON.parse((event as MessageEvent).data)
+      setServiceStatus((prev: any) => ({ ...(prev || {}), ...delta }))
+    })
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED && !interval) {
+        interval = setInterval(checkServiceStatus, 3000)
+      }
+    }
+
+    return () => {
+      events.close()
+      if (interval) clearInterval(interval)
+    }
   }, [])
 
   const checkServiceStatus = async () => {
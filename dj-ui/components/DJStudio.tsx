@@ -16,11 +16,15 @@ export default function DJStudio({ apiUrl }: DJStudioProps) {
 
   const sendCommand = async (command: string) => {
     try {
-      await fetch(`${apiUrl}/command`, {
+      const response = await fetch(`${apiUrl}/command`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ command })
       })
+      if (response.status === 400 || response.status === 429) {
+        const result = await response.json()
+        console.error(result.error)
+      }
     } catch (error) {
       console.error('Error sending command:', error)
     }
@@ -29,11 +29,15 @@ export default function TrackControl({
 
   const sendCommand = async (cmd: string) => {
     try {
-      await fetch(`${apiUrl}/command`, {
+      const response = await fetch(`${apiUrl}/command`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ command: cmd })
       })
+      if (response.status === 400 || response.status === 429) {
+        const result = await response.json()
+        console.error(result.error)
+      }
     } catch (error) {
       console.error('Error:', error)
     }
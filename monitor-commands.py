@@ -3,15 +3,33 @@
 TidalCycles Command Monitor v6 - Uses clipboard paste (most reliable)
 """
 
+import os
 import time
 import subprocess
 from pathlib import Path
 
+from tidal_dj.coalesce import command_key, latest_per_key
+from tidal_dj.ghci import plan_batches
+from tidal_dj.journal import SEGMENT_SUFFIX, DeliveryLog, JournalReader
+from tidal_dj.watcher import make_notifier
+
 PROJECT_DIR = Path(__file__).parent
-COMMAND_FILE = PROJECT_DIR / ".ghci-commands"
+JOURNAL_DIR = Path(os.environ.get('TIDAL_JOURNAL_DIR', PROJECT_DIR / ".ghci-journal"))
+# TIDAL_MONITOR_DRY_RUN=1 skips the clipboard/Terminal step (benchmarks, Linux)
+DRY_RUN = os.environ.get('TIDAL_MONITOR_DRY_RUN') == '1'
+# Lines journaled longer ago than this (seconds) are skipped, not played late; 0 = play everything
+COMMAND_TTL = float(os.environ.get('TIDAL_COMMAND_TTL', '10'))
+
+# Same setting as the service's coalescer: TIDAL_COALESCE_MS=0 pastes every line, superseded or not
+COALESCE = float(os.environ.get('TIDAL_COALESCE_MS') or 1) > 0
+
+# After the first line of a burst arrives, keep collecting this long before pasting
+BURST_WINDOW = 0.02
 
 def send_to_terminal(command):
     """Send command using clipboard paste - most reliable method"""
+    if DRY_RUN:
+        return True
     
     # Step 1: Copy command to clipboard
     try:
@@ -52,12 +70,72 @@ def send_to_terminal(command):
         print(f"   ❌ Error: {e}")
         return False
 
+def collect_burst(reader, notifier):
+    """Read new records, then keep reading while more keep arriving within BURST_WINDOW
+
+    Returns (burst, last_seq); last_seq covers skipped comments too so the cursor moves past them.
+    """
+    burst = []
+    last_seq = None
+    while True:
+        for seq, journaled_at, command in reader.read_records():
+            last_seq = seq
+            line = command.strip()
+            if line and not line.startswith('#'):
+                burst.append((seq, line, time.time(), journaled_at))
+        if last_seq is None or not notifier.wait(timeout=BURST_WINDOW):
+            return burst, last_seq
+
+def skip_superseded(burst, deliveries):
+    """Drop lines a later line in the same burst overwrites (d1 ... d1 ...); returns the rest"""
+    if not COALESCE:
+        return burst
+    burst, superseded = latest_per_key(burst, key=lambda entry: command_key(entry[1]))
+    if superseded:
+        now = time.time()
+        deliveries.record([(seq, picked_up, now, now, 'superseded') for seq, _, picked_up, _ in superseded])
+        print(f"⏭️  Skipped {len(superseded)} superseded update(s)")
+    return burst
+
+def skip_stale(burst, deliveries):
+    """Drop lines older than COMMAND_TTL (journaled while we were stopped or stuck); returns the rest"""
+    if not COMMAND_TTL:
+        return burst
+    now = time.time()
+    stale = [entry for entry in burst if now - entry[3] > COMMAND_TTL]
+    if stale:
+        deliveries.record([(seq, picked_up, now, now, 'expired') for seq, _, picked_up, _ in stale])
+        print(f"⌛ Skipped {len(stale)} command(s) older than {COMMAND_TTL:g}s")
+        burst = [entry for entry in burst if now - entry[3] <= COMMAND_TTL]
+    return burst
+
+def deliver_burst(burst, deliveries):
+    """Paste a burst as few GHCi inputs as possible; report every original line"""
+    # Batches keep the original order, so burst entries line up one-to-one
+    pending = iter(burst)
+    batches = plan_batches([line for _, line, _, _ in burst])
+    for index, (payload, lines) in enumerate(batches):
+        if index:
+            time.sleep(0.5)  # Give Terminal time between pastes
+        started = time.time()
+        ok = send_to_terminal(payload)
+        done = time.time()
+        report = []
+        for line in lines:
+            seq, _, picked_up, _ = next(pending)
+            report.append((seq, picked_up, started, done, ok))
+            print(f"▶️  {line}")
+            print(f"   {'✅' if ok else '❌'} {(done - picked_up) * 1000:.0f} ms"
+                  + (f" (batch of {len(lines)})" if len(lines) > 1 else ""))
+        # Lets the service finish each command's trace (/trace/<id>, /metrics)
+        deliveries.record(report)
+
 def monitor_commands():
     """Monitor command file for new commands"""
     print("=" * 50)
     print("🎵 TidalCycles Command Monitor v6")
     print("=" * 50)
-    print(f"📝 Watching: {COMMAND_FILE}")
+    print(f"📝 Watching: {JOURNAL_DIR}")
     print("")
     print("📋 REQUIREMENTS:")
     print("   1. GHCi running in Terminal.app")
@@ -67,38 +145,33 @@ def monitor_commands():
     print("✅ Ready!")
     print("")
     
-    if not COMMAND_FILE.exists():
-        COMMAND_FILE.touch()
-    
-    last_size = COMMAND_FILE.stat().st_size
-    last_position = last_size
+    # Resumes from the saved cursor, so a restart neither re-sends nor skips
+    reader = JournalReader(JOURNAL_DIR)
+    deliveries = DeliveryLog(JOURNAL_DIR)
+    # Wake on writes instead of stat()-ing every 200 ms
+    notifier = make_notifier(JOURNAL_DIR, suffix=SEGMENT_SUFFIX)
+    print(f"👀 Watcher: {notifier.kind}, resuming after #{reader.cursor}")
     
     try:
         while True:
-            current_size = COMMAND_FILE.stat().st_size
-            
-            if current_size > last_size:
-                with open(COMMAND_FILE, 'r') as f:
-                    f.seek(last_position)
-                    new_commands = f.read()
-                    last_position = f.tell()
-                
-                for line in new_commands.strip().split('\n'):
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        print(f"▶️  {line}")
-                        if send_to_terminal(line):
-                            print("   ✅")
-                        else:
-                            print("   ❌")
-                        time.sleep(0.5)  # More time between commands
-                
-                last_size = current_size
+            burst, last_seq = collect_burst(reader, notifier)
+            # A backlog from while we were away is stale - don't play it late
+            burst = skip_stale(burst, deliveries)
+            # Only the newest update per target is worth pasting
+            burst = skip_superseded(burst, deliveries)
+            if burst:
+                deliver_burst(burst, deliveries)
+            if last_seq is not None:
+                reader.commit(last_seq)
             
-            time.sleep(0.2)
+            # Safety timeout in case an event is ever missed
+            notifier.wait(timeout=30)
             
     except KeyboardInterrupt:
         print("\n👋 Stopped")
+    finally:
+        notifier.close()
+        reader.close()
 
 if __name__ == "__main__":
     monitor_commands()
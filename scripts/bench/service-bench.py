@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark for tidal-service.py (and monitor-commands.py)
+Runs the service against stub backends - stub GHCi REPL, UDP sink on 57120,
+fake Tidal listener on 6010 - drives /command and /status, writes JSON results.
+
+Run as: python3 scripts/bench/service-bench.py --mode pipe --concurrency 8 --duration 10
+Compare: python3 scripts/bench/service-bench.py --compare before.json after.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(PROJECT_DIR))
+
+from tidal_dj.metrics import Histogram  # noqa: E402
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class UdpSink:
+    """Stands in for SuperDirt (57120) or Tidal's listener (6010): binds and counts packets"""
+
+    def __init__(self, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.packets = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sock.recv(65536)
+            except OSError:
+                return
+            self.packets += 1
+
+    def close(self):
+        self.sock.close()
+
+
+def cpu_seconds(pid):
+    """User+system CPU of a process from /proc (None where unavailable)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def wait_for_http(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('localhost', port, timeout=1)
+            conn.request('GET', '/status')
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    conn.request('GET', path)
+    return json.loads(conn.getresponse().read())
+
+
+class Driver:
+    """Closed-loop workers on keep-alive connections, optionally paced to a target rate"""
+
+    def __init__(self, port, method, path, body, concurrency, rate, duration):
+        self.port = port
+        self.method = method
+        self.path = path
+        self.body = body
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.latency = Histogram()
+        self.ok = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _worker(self, index, stop_at):
+        conn = http.client.HTTPConnection('localhost', self.port, timeout=30)
+        interval = self.concurrency / self.rate if self.rate else 0.0
+        next_at = time.monotonic() + interval * index / max(1, self.concurrency)
+        n = 0
+        while time.monotonic() < stop_at:
+            if interval:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_at += interval
+            body = self.body(index, n) if callable(self.body) else self.body
+            started = time.perf_counter()
+            try:
+                conn.request(self.method, self.path, body=body,
+                             headers={'Content-Type': 'application/json'} if body else {})
+                response = conn.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - started
+            except (OSError, http.client.HTTPException):
+                with self._lock:
+                    self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('localhost', self.port, timeout=30)
+                continue
+            self.latency.record(elapsed)
+            with self._lock:
+                if response.status < 400:
+                    self.ok += 1
+                else:
+                    self.errors += 1
+            n += 1
+        conn.close()
+
+    def start(self):
+        stop_at = time.monotonic() + self.duration
+        self.threads = [threading.Thread(target=self._worker, args=(i, stop_at), daemon=True)
+                        for i in range(self.concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def report(self, elapsed):
+        summary = self.latency.summary()
+        return {
+            'requests': self.ok,
+            'errors': self.errors,
+            'throughput_rps': round(self.ok / elapsed, 1) if elapsed else None,
+            'latency_ms': {key: round(summary[key] * 1000, 3) if summary[key] is not None else None
+                           for key in ('p50', 'p99', 'p999', 'mean')},
+        }
+
+
+def stage_summaries(port):
+    """Server-side per-stage latency quantiles from /metrics?format=json"""
+    stages = {}
+    for histogram in get_json(port, '/metrics?format=json')['histograms']:
+        if histogram['name'] == 'tidal_command_stage_seconds':
+            stages[histogram['labels']['stage']] = {
+                key: round(histogram[key] * 1000, 3) if histogram[key] is not None else None
+                for key in ('p50', 'p99', 'p999')
+            }
+            stages[histogram['labels']['stage']]['count'] = histogram['count']
+    return stages
+
+
+def delivery_counts(port):
+    """Commands by final status, how many the coalescer held back, and how many were superseded
+
+    Superseded counts every drop for a newer update: the service's coalescer
+    and scheduler, and (journal mode) the monitor skipping lines in a burst.
+    """
+    statuses = {}
+    superseded = {}
+    for counter in get_json(port, '/metrics?format=json')['counters']:
+        if counter['name'] == 'tidal_commands_total':
+            statuses[counter['labels']['status']] = counter['value']
+        elif counter['name'] == 'tidal_commands_coalesced_total':
+            where = 'monitor' if counter['labels'].get('target') == 'monitor' else 'service'
+            superseded[where] = superseded.get(where, 0) + counter['value']
+    coalesce = get_json(port, '/coalesce')
+    return {'delivered': statuses.get('delivered', 0),
+            'held': coalesce['held'],
+            'superseded': sum(superseded.values()),
+            'superseded_by': superseded,
+            'by_status': statuses}
+
+
+def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix='tidal-bench-'))
+    env = dict(os.environ,
+               TIDAL_SERVICE_PORT=str(args.port),
+               TIDAL_AUTOSTART='0',
+               TIDAL_JOURNAL_DIR=str(workdir / 'journal'),
+               TIDAL_SESSION_DIR=str(workdir / 'sessions'),
+               TIDAL_LOG_DIR=str(workdir / 'logs'),
+               TIDAL_GHCI_MODE=args.mode if args.mode == 'pipe' else 'terminal',
+               TIDAL_GHCI_CMD=f'{sys.executable} {PROJECT_DIR / "scripts" / "stubs" / "stub-ghci.py"}'
+                              f' --eval-delay {args.eval_delay}',
+               TIDAL_MONITOR_DRY_RUN='1',
+               TIDAL_RATE_LIMIT='0',  # One client driving flat out - measure throughput, not the limiter
+               # Workers share channels: coalescing would hold most requests back instead of delivering them
+               TIDAL_COALESCE_MS=str(args.coalesce_ms),
+               SUPERDIRT_PORT=str(args.superdirt_port),
+               PYTHONUNBUFFERED='1')
+    superdirt = UdpSink(args.superdirt_port)
+    tidal = UdpSink(args.tidal_port)
+    children = []
+    log = open(workdir / 'bench.log', 'w')
+    try:
+        service = subprocess.Popen([sys.executable, str(PROJECT_DIR / 'tidal-service.py')],
+                                   env=env, stdout=log, stderr=subprocess.STDOUT)
+        children.append(service)
+        if not wait_for_http(args.port):
+            raise SystemExit('service did not come up - see ' + str(workdir / 'bench.log'))
+        monitor = None
+        if args.mode == 'pipe':
+            job = get_json(args.port, '/start?wait=30')
+            if not job.get('result', {}).get('ghci', {}).get('ready'):
+                raise SystemExit(f'stub GHCi did not become ready: {job}')
+        else:
+            monitor = subprocess.Popen([sys.executable, str(PROJECT_DIR / 'monitor-commands.py')],
+                                       env=env, stdout=subprocess.DEVNULL, stderr=log)
+            children.append(monitor)
+            time.sleep(0.5)
+
+        if args.batch > 1:
+            # A set's worth of lines per request through /commands
+            body = lambda worker, n: json.dumps({'commands': [f'd{line % 9 + 1} $ sound "bd*{(n + line) % 8 + 1}"'
+                                                              for line in range(args.batch)]})
+            path = '/commands'
+        else:
+            body = lambda worker, n: json.dumps({'command': f'd{worker % 9 + 1} $ sound "bd*{n % 8 + 1}"'})
+            path = '/command'
+        drivers = {
+            'command': Driver(args.port, 'POST', path, body, args.concurrency, args.rate, args.duration),
+        }
+        if args.status_concurrency:
+            drivers['status'] = Driver(args.port, 'GET', '/status', None,
+                                       args.status_concurrency, args.status_rate, args.duration)
+
+        cpu_before = {child.pid: cpu_seconds(child.pid) for child in children}
+        started = time.monotonic()
+        for driver in drivers.values():
+            driver.start()
+        for driver in drivers.values():
+            driver.join()
+        elapsed = time.monotonic() - started
+        time.sleep(args.settle)  # Let the monitor finish delivering
+        cpu_after = {child.pid: cpu_seconds(child.pid) for child in children}
+
+        total_requests = sum(driver.ok for driver in drivers.values()) or 1
+        cpu = {}
+        for name, child in (('service', service), ('monitor', monitor)):
+            if child is None or cpu_before.get(child.pid) is None or cpu_after.get(child.pid) is None:
+                continue
+            used = cpu_after[child.pid] - cpu_before[child.pid]
+            cpu[name] = {'seconds': round(used, 3),
+                         'ms_per_request': round(used * 1000 / total_requests, 4)}
+
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                                     capture_output=True, text=True).stdout.strip() or None,
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'elapsed_seconds': round(elapsed, 3),
+            'http': {name: driver.report(elapsed) for name, driver in drivers.items()},
+            'end_to_end_ms': stage_summaries(args.port),
+            'commands': delivery_counts(args.port),
+            'cpu': cpu,
+            'superdirt_packets': superdirt.packets,
+        }
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            try:
+                child.wait(5)
+            except subprocess.TimeoutExpired:
+                child.kill()
+        superdirt.close()
+        tidal.close()
+        log.close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(before_path, after_path):
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    print(f"{'metric':40} {'before':>12} {'after':>12} {'change':>9}")
+
+    def row(label, old, new):
+        if old is None or new is None:
+            return
+        change = f'{(new - old) / old * 100:+.1f}%' if old else ''
+        print(f'{label:40} {old:12.3f} {new:12.3f} {change:>9}')
+
+    for name in after['http']:
+        if name not in before['http']:
+            continue
+        row(f'{name} throughput (req/s)', before['http'][name]['throughput_rps'],
+            after['http'][name]['throughput_rps'])
+        for key in ('p50', 'p99', 'p999'):
+            row(f'{name} {key} (ms)', before['http'][name]['latency_ms'][key],
+                after['http'][name]['latency_ms'][key])
+    for stage in after['end_to_end_ms']:
+        if stage in before['end_to_end_ms']:
+            for key in ('p50', 'p99'):
+                row(f'stage {stage} {key} (ms)', before['end_to_end_ms'][stage][key],
+                    after['end_to_end_ms'][stage][key])
+    if 'commands' in before and 'commands' in after:
+        for key in ('delivered', 'held'):
+            row(f'commands {key}', before['commands'][key], after['commands'][key])
+    for name in after['cpu']:
+        if name in before['cpu']:
+            row(f'{name} CPU ms/request', before['cpu'][name]['ms_per_request'],
+                after['cpu'][name]['ms_per_request'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tidal-service.py against stub backends')
+    parser.add_argument('--mode', choices=('pipe', 'journal'), default='pipe',
+                        help='pipe: headless stub GHCi; journal: journal + monitor (dry run)')
+    parser.add_argument('--concurrency', type=int, default=4, help='/command workers')
+    parser.add_argument('--rate', type=float, default=0, help='/command requests/s in total (0 = flat out)')
+    parser.add_argument('--batch', type=int, default=1, help='commands per request (>1 uses POST /commands)')
+    parser.add_argument('--status-concurrency', type=int, default=2, help='/status workers (0 = none)')
+    parser.add_argument('--status-rate', type=float, default=20, help='/status requests/s in total')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait for delivery afterwards')
+    parser.add_argument('--coalesce-ms', type=float, default=0,
+                        help='coalescing window for the service (0 = off: every request goes to GHCi)')
+    parser.add_argument('--eval-delay', type=float, default=0.0, help='stub GHCi compile time per command')
+    parser.add_argument('--port', type=int, default=9100, help='service port for the run')
+    parser.add_argument('--superdirt-port', type=int, default=57120)
+    parser.add_argument('--tidal-port', type=int, default=6010)
+    parser.add_argument('--output', default='bench-results.json', help='JSON results file')
+    parser.add_argument('--keep', action='store_true', help='keep the temp dir (logs, journal)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(json.dumps(results, indent=2))
+    print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Stub GHCi/Tidal REPL for running the service headless (Linux CI, benchmarks)
+Speaks just enough of GHCi's stdin/stdout protocol: prompts, :set prompt, :script, :{ :}
+Run as: TIDAL_GHCI_MODE=pipe TIDAL_GHCI_CMD="python3 scripts/stubs/stub-ghci.py" python3 tidal-service.py
+"""
+
+import argparse
+import sys
+import time
+
+
+def parse_haskell_string(text):
+    """Decode a Haskell string literal like "tidal> \\n" """
+    text = text.strip()
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        text = text[1:-1]
+    return text.encode('utf-8').decode('unicode_escape')
+
+
+def check_syntax(source):
+    """Very rough stand-in for GHC's parser: balanced quotes and brackets"""
+    if source.count('"') % 2:
+        return 'lexical error in string/character literal at end of input'
+    pairs = {')': '(', ']': '[', '}': '{'}
+    stack = []
+    in_string = False
+    for ch in source:
+        if ch == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif ch in '([{':
+            stack.append(ch)
+        elif ch in pairs:
+            if not stack or stack.pop() != pairs[ch]:
+                return f"parse error on input '{ch}'"
+    if stack:
+        return 'parse error (possibly incorrect indentation or mismatched brackets)'
+    return None
+
+
+def statements(block):
+    """Split a `do` block's (line number, text) pairs into statements: a line indented deeper continues the last"""
+    body = [(number, text) for number, text in block if text.strip() and text.strip() != 'do']
+    if not body:
+        return []
+    indent = min(len(text) - len(text.lstrip()) for _, text in body)
+    found = []
+    for number, text in body:
+        if found and len(text) - len(text.lstrip()) > indent:
+            found[-1][1].append(text)
+        else:
+            found.append((number, [text]))
+    return [(number, '\n'.join(lines)) for number, lines in found]
+
+
+def report(number, text, error):
+    """A GHC 9-style compile error, with the source excerpt under it"""
+    first = text.split('\n')[0]
+    column = len(first) - len(first.lstrip()) + 1
+    gutter = ' ' * len(str(number))
+    return (f'<interactive>:{number}:{column}: error: [GHC-58481]\n'
+            f'    {error}\n'
+            f'{gutter} |\n'
+            f'{number} | {first}\n'
+            f'{gutter} | {" " * (column - 1)}^\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub Tidal REPL')
+    parser.add_argument('--boot-delay', type=float, default=0.0,
+                        help='seconds to pretend :script BootTidal.hs takes')
+    parser.add_argument('--eval-delay', type=float, default=0.0,
+                        help='seconds to pretend each expression takes to compile')
+    args = parser.parse_args()
+
+    prompt = 'ghci> '
+    prompt_cont = 'ghci| '
+    block = None
+    line_no = 0
+
+    def out(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    out('GHCi, version 9.x (stub)\n')
+    out(prompt)
+    for raw in sys.stdin:
+        line = raw.rstrip('\n')
+        line_no += 1
+        if block is not None:
+            if line.strip() == ':}':
+                lines, block = block, None
+                if args.eval_delay:
+                    time.sleep(args.eval_delay)
+                if lines and lines[0][1].strip() == 'do':
+                    # GHC reports each statement that doesn't parse, at its own line
+                    for number, text in statements(lines):
+                        error = check_syntax(text)
+                        if error:
+                            out(report(number, text, error))
+                else:
+                    error = check_syntax('\n'.join(text for _, text in lines))
+                    if error and lines:
+                        out(report(lines[0][0], lines[0][1], error))
+            else:
+                block.append((line_no, line))
+                out(prompt_cont)
+                continue
+        elif line.strip() == ':{':
+            block = []
+            out(prompt_cont)
+            continue
+        elif line.startswith(':set prompt-cont'):
+            prompt_cont = parse_haskell_string(line[len(':set prompt-cont'):])
+        elif line.startswith(':set prompt'):
+            prompt = parse_haskell_string(line[len(':set prompt'):])
+        elif line.startswith(':script'):
+            if args.boot_delay:
+                time.sleep(args.boot_delay)
+            out('Loaded GHCi configuration (stub)\n')
+            out('Connected to SuperDirt.\n')
+            prompt = 'tidal> '
+        elif line.strip() in (':quit', ':q'):
+            out('Leaving GHCi.\n')
+            return
+        elif line.strip():
+            error = check_syntax(line)
+            if args.eval_delay:
+                time.sleep(args.eval_delay)
+            if error:
+                out(report(line_no, line, error))
+        out(prompt)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import time
+
+from tidal_dj.coalesce import Coalescer, behind_held, command_key
+
+
+def entry(command):
+    return {'command': command}
+
+
+def queue_behind_held(coalescer, delivered, incoming):
+    """What the service does for a command that skips the coalescer"""
+    def send(held):
+        first, _ = behind_held(held, incoming)
+        delivered.extend(first + incoming)
+    coalescer.take_before(lambda held: True, send)
+
+
+def test_hush_is_not_overtaken_by_a_held_update():
+    delivered = []
+    coalescer = Coalescer(delivered.extend, {'channel': 0.05}).start()
+    for command in ('d1 $ s "bd*4"', 'd1 $ s "bd*8"'):
+        item = entry(command)
+        if coalescer.submit(command_key(command), item) == 'send':
+            delivered.append(item)
+    queue_behind_held(coalescer, delivered, [entry('hush')])
+    time.sleep(0.15)  # Past the window: nothing held may be released now
+
+    assert [item['command'] for item in delivered] == ['d1 $ s "bd*4"', 'hush']
+
+
+def test_unkeyed_command_goes_after_held_updates():
+    delivered = []
+    coalescer = Coalescer(delivered.extend, {'channel': 0.05}).start()
+    for command in ('d1 $ s "bd*4"', 'd1 $ s "bd*8"', 'd2 $ s "hh"', 'd2 $ s "hh*2"'):
+        item = entry(command)
+        if coalescer.submit(command_key(command), item) == 'send':
+            delivered.append(item)
+    queue_behind_held(coalescer, delivered, [entry('once $ s "cp"')])
+    time.sleep(0.15)
+
+    assert [item['command'] for item in delivered] == [
+        'd1 $ s "bd*4"', 'd2 $ s "hh"', 'd1 $ s "bd*8"', 'd2 $ s "hh*2"', 'once $ s "cp"']
+
+
+def test_newer_update_to_the_same_target_supersedes_the_held_one():
+    held = [entry('d1 $ s "bd*8"'), entry('d2 $ s "hh*2"')]
+    first, superseded = behind_held(held, [entry('d1 $ s "sn"')])
+    assert [item['command'] for item in first] == ['d2 $ s "hh*2"']
+    assert [item['command'] for item in superseded] == ['d1 $ s "bd*8"']
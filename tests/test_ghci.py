@@ -0,0 +1,29 @@
+from tidal_dj.ghci import failed_lines, parse_result, plan_batches
+
+
+def test_error_in_a_batch_is_pinned_on_its_command():
+    lines = ['d1 $ s "bd*4"', 'd2 $ s "hh', 'd3 $ s "cp"']
+    (payload, _), = plan_batches(lines)
+    assert payload.split('\n')[3] == '  d2 $ s "hh'
+    # The input started on line 10: `:{` 10, `do` 11, the commands 12-14
+    result = dict(parse_result([
+        '<interactive>:13:3: error: [GHC-58481]',
+        '    lexical error in string/character literal at end of input',
+        '   |',
+        '13 |   d2 $ s "hh',
+        '   |   ^',
+    ]), first_line=10)
+    assert result['error'] == 'lexical error in string/character literal at end of input'
+    assert failed_lines(result, lines) == {1: result['error']}
+
+
+def test_line_numbers_are_used_without_a_source_excerpt():
+    lines = ['d1 $ s "bd*4"', 'd2 $ s "hh"\n  # speed 2)', 'd3 $ s "cp"']
+    result = dict(parse_result(['<interactive>:14:15: error: parse error on input \')\'']), first_line=10)
+    assert failed_lines(result, lines) == {1: "parse error on input ')'"}
+
+
+def test_exceptions_are_not_pinned_on_a_command():
+    result = dict(parse_result(['*** Exception: divide by zero']), first_line=10)
+    assert result['status'] == 'error'
+    assert failed_lines(result, ['d1 $ s "bd"', 'd2 $ s "hh"']) is None
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from tidal_dj.journal import CommandJournal, list_segments, parse_record
+
+
+def seqs_on_disk(directory):
+    return [parse_record(line)[0] for _, path in list_segments(directory) for line in path.read_text().splitlines()]
+
+
+def test_units_sharing_a_failed_flush_all_fail_while_later_ones_succeed(tmp_path):
+    journal = CommandJournal(tmp_path, sync=False)
+    write = journal._write_batch
+    gates = [threading.Event(), threading.Event()]
+    entered = [threading.Event(), threading.Event()]
+    calls = []
+
+    def flaky(lines, first_seq):
+        call = len(calls)
+        calls.append(first_seq)
+        if call < 2:
+            entered[call].set()
+            gates[call].wait(5)
+        if call == 1:
+            raise OSError('disk full')
+        write(lines, first_seq)
+
+    journal._write_batch = flaky
+    outcomes = {}
+
+    def append(name):
+        try:
+            outcomes[name] = journal.append_many([f'd1 $ s "{name}"'])
+        except OSError as e:
+            outcomes[name] = e
+
+    def spawn(name):
+        thread = threading.Thread(target=append, args=(name,))
+        thread.start()
+        return thread
+
+    threads = [spawn('bd')]
+    entered[0].wait(5)
+    # Both queue behind the first flush, so they share the second one - which fails
+    threads += [spawn('hh'), spawn('sn')]
+    while len(journal._pending) < 2:
+        time.sleep(0.001)
+    gates[0].set()
+    entered[1].wait(5)
+    # Queued during the failing flush: its own flush succeeds and must not vouch for the others
+    threads.append(spawn('cp'))
+    while len(journal._pending) < 1:
+        time.sleep(0.001)
+    gates[1].set()
+    for thread in threads:
+        thread.join(5)
+
+    assert outcomes['bd'] == [1]
+    assert isinstance(outcomes['hh'], OSError) and isinstance(outcomes['sn'], OSError)
+    assert outcomes['cp'] == [4]
+    assert seqs_on_disk(tmp_path) == [1, 4]
+    assert journal.durable_seq == 4
+
+
+def test_journal_keeps_working_after_a_failed_write(tmp_path):
+    journal = CommandJournal(tmp_path, sync=False)
+    write = journal._write_batch
+
+    def broken(lines, first_seq):
+        raise OSError('read-only file system')
+
+    journal._write_batch = broken
+    with pytest.raises(OSError):
+        journal.append_many(['d1 $ s "bd"', 'd2 $ s "hh"'])
+    journal._write_batch = write
+    assert journal.append_many(['d3 $ s "cp"']) == [3]
+    assert seqs_on_disk(tmp_path) == [3]
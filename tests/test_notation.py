@@ -0,0 +1,42 @@
+import pytest
+
+from tidal_dj.notation import NotationError, Sequence, Word, check_command, parse_pattern
+
+
+@pytest.mark.parametrize('command', [
+    'd1 $ sound "bd*2 [sn cp] ~ hh?"',
+    'd2 $ n "0 .. 7" # s "superpiano"',
+    'd3 $ s "<bd sn>(3,8,<0 2>)"',
+    'd4 $ s "{bd sn, hh hh hh}%4"',
+    'd5 $ s "bd! sn:3 . hh hh"',
+    'hush',
+    ':set prompt "tidal> "',
+])
+def test_valid_commands_pass(command):
+    check_command(command)
+
+
+@pytest.mark.parametrize('command, message, column', [
+    ('d1 $ s "bd [sn"', "unclosed '['", 12),
+    ('d1 $ s "bd sn]"', "unexpected ']'", 14),
+    ('d1 $ s "bd $"', "unexpected character '$'", 12),
+    ('d1 $ s "bd,sn|hh"', "can't mix ',' and '|' in one group", 14),
+])
+def test_errors_point_at_the_column_in_the_command(command, message, column):
+    with pytest.raises(NotationError) as error:
+        check_command(command)
+    assert error.value.message.endswith(message)
+    assert error.value.column == column
+
+
+def test_control_bus_references_are_words():
+    assert parse_pattern('^note') == Sequence(((Word('^note'), 1),))
+    check_command('d1 $ n "^note" # s "superpiano"')
+    check_command('d1 $ s "bd*4" # lpf "[^cutoff ^res]"')
+
+
+@pytest.mark.parametrize('pattern', ['^', '^ note', '^1'])
+def test_a_caret_must_start_a_name(pattern):
+    with pytest.raises(NotationError) as error:
+        parse_pattern(pattern)
+    assert error.value.column == 1
@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+from tidal_dj import output
+from tidal_dj.output import OutputCollector, OutputRing
+
+
+def test_a_failed_log_rotation_keeps_the_pipe_drained(tmp_path, monkeypatch):
+    def refuse(src, dst):
+        raise PermissionError(13, 'Permission denied')
+
+    monkeypatch.setattr(output.os, 'replace', refuse)
+    # Far more than a pipe buffer: the child only exits if every line is read
+    child = subprocess.Popen([sys.executable, '-c', 'for i in range(100000): print("line", i)'],
+                             stdout=subprocess.PIPE)
+    ring = OutputRing(capacity=10)
+    collector = OutputCollector(child.stdout, ring, tmp_path / 'child.log', max_bytes=1000).start()
+    assert child.wait(timeout=20) == 0
+    collector._thread.join(5)
+
+    assert ring.total == 100000
+    assert ring.tail(1) == ['line 99999']
+    assert (tmp_path / 'child.log').stat().st_size < 2000
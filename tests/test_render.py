@@ -0,0 +1,37 @@
+import pytest
+
+from tidal_dj.render import HAVE_NUMPY, MAX_EVENTS, PreviewError, render
+
+pytestmark = pytest.mark.skipif(not HAVE_NUMPY, reason='pattern preview needs NumPy')
+
+
+def timeline(expression, start=0.0, end=1.0):
+    return [(event['onset'], event['duration'], event.get('s')) for event in render(expression, start, end)['events']]
+
+
+def test_subdivision_splits_a_step_evenly():
+    # Times come back rounded to 6 places
+    assert timeline('s "bd [hh hh] sn"') == [
+        (0.0, 0.333333, 'bd'), (0.333333, 0.166667, 'hh'), (0.5, 0.166667, 'hh'), (0.666667, 0.333333, 'sn')]
+    assert timeline('s "bd*4"') == [(0.0, 0.25, 'bd'), (0.25, 0.25, 'bd'), (0.5, 0.25, 'bd'), (0.75, 0.25, 'bd')]
+
+
+def test_alternation_picks_one_per_cycle():
+    assert timeline('s "<bd sn cp>"', 0, 4) == [
+        (0.0, 1.0, 'bd'), (1.0, 1.0, 'sn'), (2.0, 1.0, 'cp'), (3.0, 1.0, 'bd')]
+
+
+def test_euclid_spreads_hits_over_steps():
+    assert [onset for onset, _, _ in timeline('s "bd(3,8)"')] == [0.0, 0.375, 0.75]
+    assert [onset for onset, _, _ in timeline('s "bd(3,8,2)"')] == [0.125, 0.5, 0.75]
+
+
+def test_polymeter_layers_share_the_first_layers_step():
+    events = timeline('s "{bd sn, hh hh hh}"', 0, 2)
+    assert [(onset, s) for onset, _, s in events if s == 'hh'] == [(0.0, 'hh'), (0.5, 'hh'), (1.0, 'hh'), (1.5, 'hh')]
+    assert timeline('s "{bd sn hh}%4"') == [(0.0, 0.25, 'bd'), (0.25, 0.25, 'sn'), (0.5, 0.25, 'hh'), (0.75, 0.25, 'bd')]
+
+
+def test_windows_past_the_event_budget_are_refused():
+    with pytest.raises(PreviewError):
+        render(f's "bd*{MAX_EVENTS * 10}"')
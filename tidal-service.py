@@ -8,37 +8,762 @@ Run as: python3 tidal-service.py
 import subprocess
 import time
 import os
-import sys
 import signal
 import json
+import math
+import queue
 import threading
 from pathlib import Path
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-import webbrowser
+
+from tidal_dj.admission import DeliveryQueue, QueueFull, QueueSet, RateLimiter
+from tidal_dj.assets import AssetCache, parse_range, resolve
+from tidal_dj.coalesce import DEFAULT_WINDOWS, Coalescer, behind_held, command_key, latest_per_key
+from tidal_dj.events import EventHub, format_event
+from tidal_dj.ghci import GhciSession, failed_lines, plan_batches
+from tidal_dj.jobs import JobManager
+from tidal_dj.journal import CURSOR_NAME, DELIVERIES_NAME, CommandJournal, parse_delivery, read_cursor
+from tidal_dj.metrics import MetricsRegistry, Tracer
+from tidal_dj.notation import CommandValidator
+from tidal_dj.orchestrator import Component, Orchestrator, wait_until
+from tidal_dj.pool import Deck, DeckRouter, orbit_setup
+from tidal_dj.osc import DirtClient
+from tidal_dj.probe import ProbeEngine, socket_port_check
+from tidal_dj.render import HAVE_NUMPY, PatternRenderer
+from tidal_dj.session import SESSION_SUFFIX, SessionRecorder, SessionReplay, list_sessions, read_session
+from tidal_dj.sets import SET_SUFFIX, SetLoader, SetWatcher, changed_blocks
+from tidal_dj.scheduler import BEATS_PER_CYCLE, CommandScheduler, TempoClock, parse_quantize, parse_setcps
+from tidal_dj.supervisor import Child, Supervisor
+from tidal_dj.tap import OscTap
+from tidal_dj.watcher import FileTailer, make_notifier
 
 # Configuration
 PROJECT_DIR = Path(__file__).parent
-COMMAND_FILE = PROJECT_DIR / ".ghci-commands"
-GHCi_SCRIPT = "/Users/amirhoseintahmasb/.cabal/share/aarch64-osx-ghc-9.14.1-bcbf/tidal-1.10.1/BootTidal.hs"
+JOURNAL_DIR = Path(os.environ.get('TIDAL_JOURNAL_DIR', PROJECT_DIR / ".ghci-journal"))
+SERVICE_PORT = int(os.environ.get('TIDAL_SERVICE_PORT', '9000'))
+# Set TIDAL_AUTOSTART=0 to serve the API without launching SuperCollider/GHCi/etc.
+AUTOSTART = os.environ.get('TIDAL_AUTOSTART', '1') != '0'
+GHCi_SCRIPT = os.environ.get('TIDAL_BOOT_SCRIPT', "/Users/amirhoseintahmasb/.cabal/share/aarch64-osx-ghc-9.14.1-bcbf/tidal-1.10.1/BootTidal.hs")
+# 'terminal' drives GHCi in Terminal.app via the monitor; 'pipe' runs GHCi headless under the service
+GHCI_MODE = os.environ.get('TIDAL_GHCI_MODE', 'terminal')
+GHCI_COMMAND = os.environ.get('TIDAL_GHCI_CMD', 'ghci -XOverloadedStrings')
+SUPERDIRT_HOST = os.environ.get('SUPERDIRT_HOST', '127.0.0.1')
+SUPERDIRT_PORT = int(os.environ.get('SUPERDIRT_PORT', '57120'))
+# Minimum gap between updates to the same target (d1, cps...); newer updates replace held ones
+COALESCE_WINDOWS = ({kind: float(os.environ['TIDAL_COALESCE_MS']) / 1000 for kind in DEFAULT_WINDOWS}
+                    if os.environ.get('TIDAL_COALESCE_MS') else None)
+# Commands waiting for GHCi/the monitor (429 beyond this), and how many may be in flight to it
+QUEUE_DEPTH = int(os.environ.get('TIDAL_QUEUE_DEPTH', '256'))
+QUEUE_WINDOW = int(os.environ.get('TIDAL_QUEUE_WINDOW', '32'))
+# Commands older than this (seconds) are dropped rather than played late; 0 = never
+COMMAND_TTL = float(os.environ.get('TIDAL_COMMAND_TTL', '10'))
+# Per-client /command rate (commands/s, bursts of twice that); 0 = unlimited
+RATE_LIMIT = float(os.environ.get('TIDAL_RATE_LIMIT', '100'))
+# How long /command waits for its command to leave the queue before answering 202
+COMMAND_WAIT = 0.25
+# POST /commands with one of these streams NDJSON in and out
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl')
+# Set TIDAL_VALIDATE=0 to pass commands to GHCi without checking them first
+VALIDATE_COMMANDS = os.environ.get('TIDAL_VALIDATE', '1') != '0'
+# Output of supervised components (sclang, bridge, monitor) goes to <name>.log here
+LOG_DIR = Path(os.environ.get('TIDAL_LOG_DIR', PROJECT_DIR / ".logs"))
+# A component that exits more than this many times in TIDAL_RESTART_WINDOW seconds is left down
+MAX_RESTARTS = int(os.environ.get('TIDAL_MAX_RESTARTS', '5'))
+RESTART_WINDOW = float(os.environ.get('TIDAL_RESTART_WINDOW', '60'))
+# Headless GHCi that leaves commands unanswered this long (seconds) is restarted
+GHCI_STALL_SECONDS = float(os.environ.get('TIDAL_GHCI_STALL', '30'))
+# Set TIDAL_GHCI_STANDBY=1 to keep a second, booted GHCi ready to take over (pipe mode)
+GHCI_STANDBY = os.environ.get('TIDAL_GHCI_STANDBY', '0') != '0'
+# Headless GHCi instances (decks) to run side by side; channels are routed in groups of TIDAL_GHCI_GROUP
+GHCI_INSTANCES = max(1, int(os.environ.get('TIDAL_GHCI_INSTANCES', '1')))
+GHCI_GROUP_SIZE = max(1, int(os.environ.get('TIDAL_GHCI_GROUP', '4')))
+# Accepted commands are recorded to a session log (<timestamp>.tses) here; TIDAL_RECORD=0 turns it off
+SESSION_DIR = Path(os.environ.get('TIDAL_SESSION_DIR', PROJECT_DIR / ".sessions"))
+RECORD_SESSIONS = os.environ.get('TIDAL_RECORD', '1') != '0'
+# Session logs kept, newest first; older ones are deleted as a new one starts (0 = keep them all)
+SESSION_KEEP = max(0, int(os.environ.get('TIDAL_SESSION_KEEP', '50')))
+# Built dj-ui (a static `next build` export) served by the service; the control UI is ui/service-control.html
+UI_DIR = Path(os.environ.get('TIDAL_UI_DIR', PROJECT_DIR / "dj-ui" / "out"))
+CONTROL_UI = PROJECT_DIR / "ui" / "service-control.html"
+# Memory for cached UI files and their compressed copies (MB); bigger files are sent with sendfile()
+ASSET_CACHE_MB = float(os.environ.get('TIDAL_ASSET_CACHE_MB', '32'))
+# UDP port of the OSC tap in front of SuperDirt (point Tidal's target oPort here); 0 = no tap
+OSC_TAP_PORT = int(os.environ.get('TIDAL_OSC_TAP_PORT', '0'))
 SUPERCOLLIDER_SCRIPT = PROJECT_DIR / "scripts" / "boot-superdirt-clean.scd"
 SUPERCOLLIDER_AUTO_SCRIPT = PROJECT_DIR / "scripts" / "boot-superdirt-auto.scd"
 
-# Process tracking
-processes = {
-    'supercollider': None,
-    'ghci': None,
-    'monitor': None,
-    'bridge': None
+# Shared process/port snapshot - /status and start_all_static read from here
+PROBE = ProbeEngine(ttl=1.0)
+
+# Lifecycle operations run here, never on the request threads
+JOBS = JobManager()
+
+def ghci_factory(orbit):
+    """Unstarted headless GHCi for a deck; decks after the first play into their own orbit"""
+    setup = [orbit_setup(orbit)] if orbit else []
+    return lambda: GhciSession(GHCI_COMMAND, boot_script=GHCi_SCRIPT, cwd=str(PROJECT_DIR), setup=setup)
+
+# Headless GHCi instances owned by the service (GHCI_MODE == 'pipe'), each with its own channel
+# state (replayed into a GHCi that replaces a crashed one) and, with TIDAL_GHCI_STANDBY, a warm spare
+DECKS = [Deck(index, ghci_factory(index), standby=GHCI_MODE == 'pipe' and GHCI_STANDBY)
+         for index in range(GHCI_INSTANCES if GHCI_MODE == 'pipe' else 1)]
+# Which deck(s) each command goes to: ?deck=, ?session= or its channel group
+ROUTER = DeckRouter(len(DECKS), GHCI_GROUP_SIZE)
+# Signalled as GHCi answers inputs; /command?wait= sleeps on it for its command's result
+RESULTS = threading.Condition()
+# Longest /command may wait for GHCi's result (seconds); `"wait": true` means RESULT_WAIT
+RESULT_WAIT = 5.0
+MAX_RESULT_WAIT = 30.0
+
+# Commands for the monitor (terminal mode): sequenced, group-committed
+JOURNAL = CommandJournal(JOURNAL_DIR)
+
+# Direct OSC to SuperDirt for one-shot triggers (skips GHCi entirely)
+DIRT = DirtClient(SUPERDIRT_HOST, SUPERDIRT_PORT)
+
+# UI files in memory, pre-compressed, revalidated by mtime on every hit
+ASSETS = AssetCache(max_bytes=int(ASSET_CACHE_MB * (1 << 20)))
+
+# Mini-notation/structure check for /command, memoized per command string
+VALIDATOR = CommandValidator()
+
+# Pattern previews for the UI (/preview), cached per pattern and window
+RENDERER = PatternRenderer()
+
+# Push channel for /events: status deltas, command results, job updates
+EVENTS = EventHub()
+
+def apply_mode_overrides(status):
+    """Adjust raw probe status for the GHCi mode in use"""
+    if GHCI_MODE == 'pipe':
+        # The service delivers to GHCi itself - no monitor process involved
+        status['ghci'] = status['monitor'] = ghci_ready()
+    return status
+
+PROBE.listeners.append(lambda snapshot, status: EVENTS.update_status(apply_mode_overrides(dict(status))))
+JOBS.listeners.append(lambda job: EVENTS.publish('job', job))
+
+# Latency histograms (/metrics) and per-command timelines (/trace/<id>)
+METRICS = MetricsRegistry()
+TRACER = Tracer(METRICS)
+PROBE.listeners.append(lambda snapshot, status: METRICS.histogram(
+    'tidal_probe_seconds', 'Duration of one process/port probe scan').record(snapshot.duration))
+
+def note_tempo(command):
+    """Follow `setcps` commands so the scheduler's clock keeps Tidal's tempo"""
+    cps = parse_setcps(command)
+    if cps:
+        CLOCK.set(cps=cps)
+        SCHEDULER.wake()
+
+def ghci_ready():
+    """Every deck's GHCi is up and answering"""
+    return all(deck.session.is_ready() for deck in DECKS)
+
+def deck_status():
+    """Per-deck GHCi and delivery queue state for /status"""
+    status = []
+    for deck, queue in zip(DECKS, QUEUE.queues):
+        session = deck.session
+        backlog = queue.info()
+        status.append({'deck': deck.index,
+                       'name': deck.name,
+                       'orbit': deck.orbit,
+                       'ready': session.is_ready(),
+                       'pid': session.process.pid if session.is_alive() else None,
+                       'unanswered': session.unanswered(),
+                       'errors': session.errors,
+                       'queue': {key: backlog[key] for key in ('depth', 'in_flight', 'oldest_wait_ms', 'drain_rate',
+                                                               'delivered', 'rejected', 'expired')}})
+    return status
+
+def deck_named(name):
+    return next((deck for deck in DECKS if deck.name == name), None)
+
+def route_entry(entry):
+    """Deck indexes for a queued/scheduled entry: as routed when it came in, else by its command"""
+    return entry.get('decks') or ROUTER.route(entry['command'])
+
+def target_key(entry):
+    """Coalescing key: what the command overwrites, on which deck(s)"""
+    key = command_key(entry['command'])
+    return key + tuple(entry['decks']) if key is not None and entry.get('decks') else key
+
+def send_to_deck(deck, entries):
+    """Write entries to one deck's GHCi, one evaluation per run of statements; returns ok
+
+    Each batch is marked 'delivered' just before it's written: GHCi can
+    answer (and the reader thread mark it 'evaluated') before send() returns.
+    """
+    commands = [entry['command'] for entry in entries]
+    with deck.lock:
+        ok = True
+        position = 0
+        for payload, lines in plan_batches(commands):
+            batch = entries[position:position + len(lines)]
+            position += len(lines)
+            traced = [entry for entry in batch if not entry.get('mirror')]
+            for entry in traced:
+                TRACER.mark(entry['id'], 'delivered')
+            settle = lambda result, batch=batch, session=deck.session, sent=deck.session.sent + 1: \
+                settle_result(deck, batch, result, session, sent)
+            written = deck.session.send(payload, on_result=settle)
+            for entry in traced:
+                TRACER.finish(entry['id'], 'delivered' if written else 'failed')
+            ok = written and ok
+        if ok:
+            for command in commands:
+                deck.channels.note(command)
+    return ok
+
+def split_by_deck(entries):
+    """[(deck, entries)] in deck order: queued entries know their deck, scheduled ones are routed here"""
+    parts = {}
+    for entry in entries:
+        if 'shard' in entry:
+            parts.setdefault(entry['shard'], []).append(entry)
+            continue
+        for n, index in enumerate(route_entry(entry)):
+            parts.setdefault(index, []).append(entry if n == 0 else dict(entry, mirror=True))
+    return [(DECKS[index], parts[index]) for index in sorted(parts)]
+
+def deliver_held(entries):
+    """Deliver a batch from the delivery queue (immediate, scheduled or coalesced commands); returns ok
+
+    Copies of a command for its other decks ('mirror') are sent but not traced
+    or reported - the original speaks for them.
+    """
+    primary = [entry for entry in entries if not entry.get('mirror')]
+    for entry in primary:
+        TRACER.mark(entry['id'], 'received', status='received')
+    if GHCI_MODE == 'pipe':
+        for entry in primary:
+            TRACER.mark(entry['id'], 'delivery_started')
+        ok = True
+        for deck, batch in split_by_deck(entries):
+            ok = send_to_deck(deck, batch) and ok
+        released = [entry['released_at'] for entry in primary if 'released_at' in entry]
+        if ok and released:
+            # Released early by the scheduler - feed back how long queueing and delivery really took
+            SCHEDULER.observe(time.time() - min(released))
+    else:
+        commands = [entry['command'] for entry in entries]
+        try:
+            seqs = JOURNAL.append_many(commands)
+            ok = True
+        except OSError as e:
+            print(f"Error writing held commands: {e}")
+            seqs = [None] * len(entries)
+            ok = False
+        for entry, seq in zip(entries, seqs):
+            if ok:
+                TRACER.mark(entry['id'], 'journaled', status='journaled', seq=seq)
+            else:
+                TRACER.mark(entry['id'], 'failed', status='failed')
+    for entry in primary:
+        if ok:
+            note_tempo(entry['command'])
+        event = {'id': entry['id'], 'command': entry['command'], 'status': 'sent' if ok else 'failed',
+                 'mode': GHCI_MODE, 'at': entry.get('at', time.time())}
+        if 'cycle' in entry:
+            event['cycle'] = entry['cycle']
+        EVENTS.publish('command', event)
+    return ok
+
+def settle_result(deck, entries, result, session=None, sent=None):
+    """A deck's GHCi answered the input these commands went in: its result (compile error or not) is theirs
+
+    When GHCi's errors point at some commands of a `do` batch, only those
+    failed; the block never ran, so the rest are sent again (resend_to_deck).
+    """
+    status = result['status']
+    if status == 'error' and len(entries) > 1 and session is not None:
+        failed = failed_lines(result, [entry['command'] for entry in entries])
+        if failed and len(failed) < len(entries):
+            for index, message in failed.items():
+                settle_result(deck, [entries[index]], dict(result, error=message))
+            rest = [entry for index, entry in enumerate(entries) if index not in failed]
+            culprit = entries[min(failed)]['command']
+            # Not from here: this is GHCi's reader thread, and the resend waits on the deck lock
+            threading.Thread(target=resend_to_deck, args=(deck, rest, session, sent, culprit),
+                             name='ghci-resend', daemon=True).start()
+            return
+    if status == 'error':
+        for entry in entries:
+            deck.channels.discard(entry['command'])
+        METRICS.inc('tidal_ghci_errors_total', help_text='GHCi inputs that failed to compile or threw',
+                    deck=deck.name)
+    entries = [entry for entry in entries if not entry.get('mirror')]
+    for entry in entries:
+        fields = {'error': result['error']} if result['error'] else {}
+        TRACER.mark(entry['id'], 'evaluated' if status != 'lost' else 'lost', result=status, **fields)
+        if status in ('error', 'skipped'):
+            EVENTS.publish('command', {'id': entry['id'], 'command': entry['command'], 'status': status,
+                                       'error': result['error'], 'mode': GHCI_MODE, 'deck': deck.index,
+                                       'at': time.time()})
+    with RESULTS:
+        for entry in entries:
+            entry['result'] = result
+        RESULTS.notify_all()
+
+def resend_to_deck(deck, entries, session, sent, culprit):
+    """Send again the commands of a batch that another command in it kept from compiling
+
+    sent is the session's send count for the failed input. If more went to
+    GHCi since, only commands that still hold their channel go again - an
+    unkeyed one (hush, once) would now land out of order, so it's skipped.
+    """
+    with deck.lock:
+        if deck.session is not session:
+            settle_result(deck, entries, {'status': 'lost', 'output': [],
+                                          'error': 'GHCi was replaced before the batch could be resent'})
+            return
+        quiet = session.sent == sent
+        again = [entry for entry in entries if quiet or deck.channels.holds(entry['command'])]
+        skipped = [entry for entry in entries if entry not in again]
+        if skipped:
+            for entry in skipped:
+                deck.channels.discard(entry['command'])
+            settle_result(deck, skipped, {'status': 'skipped', 'output': [],
+                                          'error': f'not run: {culprit!r} in the same batch failed to compile'})
+        position = 0
+        for payload, lines in plan_batches([entry['command'] for entry in again]):
+            batch = again[position:position + len(lines)]
+            position += len(lines)
+            for entry in batch:
+                if not entry.get('mirror'):
+                    TRACER.mark(entry['id'], 'resent')
+            # No session: a second failure settles the whole input, it doesn't resend again
+            if not session.send(payload, on_result=lambda result, batch=batch: settle_result(deck, batch, result)):
+                settle_result(deck, batch, {'status': 'lost', 'output': [],
+                                            'error': 'GHCi exited before the batch could be resent'})
+
+def wait_result(entry, timeout):
+    """Block up to timeout for GHCi's answer to entry's command; None if it hasn't come"""
+    deadline = time.monotonic() + timeout
+    with RESULTS:
+        while 'result' not in entry:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            RESULTS.wait(remaining)
+        return entry['result']
+
+def parse_wait(value):
+    """Seconds /command should wait for GHCi's result: true, a number, or nothing (ValueError if unusable)"""
+    if value in (None, False, '', '0', 'false'):
+        return 0.0
+    if value is True or value == 'true':
+        return RESULT_WAIT
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'bad wait value {value!r} (use true or a number of seconds)')
+    if not 0 <= seconds <= MAX_RESULT_WAIT:
+        raise ValueError(f'wait must be between 0 and {MAX_RESULT_WAIT:g} seconds')
+    return seconds
+
+def drop_superseded(entry):
+    """A newer update to the same target replaced this one before it was sent"""
+    TRACER.mark(entry['id'], 'dropped', status='dropped')
+    METRICS.inc('tidal_commands_coalesced_total', help_text='Updates dropped for a newer one to the same target',
+                target=entry['target'])
+    EVENTS.publish('command', {'id': entry['id'], 'command': entry['command'], 'status': 'dropped',
+                               'mode': GHCI_MODE, 'at': time.time()})
+
+def release_scheduled(entries):
+    """Hand one cycle boundary's commands on together (scheduler thread)
+
+    They take the immediate commands' path - coalescer, then the delivery
+    queue's depth limit and TTL - so a late release can't land stale or
+    overshoot the queue. A queue too full to take them rejects them.
+    """
+    # Two updates to d1 due on the same boundary - only the later one would be heard
+    entries, superseded = latest_per_key(entries, key=target_key)
+    for entry in superseded:
+        drop_superseded(dict(entry, target=command_key(entry['command'])[1]))
+    now = time.time()
+    batch = []
+    for entry in entries:
+        if COMMAND_TTL and now - entry['at'] > COMMAND_TTL:
+            expire_queued(entry, where='scheduler')  # Its boundary is long gone
+            continue
+        TRACER.mark(entry['id'], 'queued')
+        key = command_key(entry['command'])
+        if key is not None:
+            entry['target'] = key[1]
+            if COALESCER.submit(target_key(entry), entry) == 'held':
+                continue
+        batch.append(entry)
+    if not batch:
+        return
+    try:
+        queue_in_order(batch, together=True)
+    except QueueFull as full:
+        for entry in batch:
+            TRACER.mark(entry['id'], 'rejected', status='rejected', error=str(full))
+            EVENTS.publish('command', {'id': entry['id'], 'command': entry['command'], 'status': 'rejected',
+                                       'error': str(full), 'mode': GHCI_MODE, 'at': time.time()})
+        print(f"   ⚠️  Dropped {len(batch)} scheduled command(s): {full}")
+
+def release_coalesced(entries):
+    """Queue the surviving update for each target whose window closed (coalescer thread)"""
+    if entries:
+        # Already admitted when they arrived - they only replace what was held
+        QUEUE.put(entries, force=True)
+
+def queue_in_order(entries, together=False):
+    """QUEUE.put for commands that don't go through the coalescer (QueueFull as put)
+
+    Updates the coalescer holds for the same deck(s) are queued first, or
+    dropped if these replace them - a held `d1` must not start playing
+    again after a later `hush`.
+    """
+    decks = {index for entry in entries for index in route_entry(entry)}
+
+    def send(held):
+        first, superseded = behind_held(held, entries, key=target_key)
+        try:
+            if first:
+                QUEUE.put(first, force=True)
+            QUEUE.put(entries, together=together)
+        except QueueFull:
+            if superseded:
+                QUEUE.put(superseded, force=True)  # Not replaced after all
+            raise
+        for entry in superseded:
+            drop_superseded(entry)
+
+    COALESCER.take_before(lambda held: not decks.isdisjoint(route_entry(held)), send)
+
+def expire_queued(entry, where='queue'):
+    """Waited in the delivery queue (or past its boundary) beyond the TTL - dropped rather than played late"""
+    if entry.get('mirror'):
+        return
+    TRACER.mark(entry['id'], 'dropped', status='dropped', reason='expired')
+    METRICS.inc('tidal_commands_expired_total', help_text='Commands dropped for being older than the TTL',
+                where=where)
+    EVENTS.publish('command', {'id': entry['id'], 'command': entry['command'], 'status': 'expired',
+                               'mode': GHCI_MODE, 'at': time.time()})
+
+def delivery_backlog():
+    """Commands handed on but not finished with: unanswered GHCi sends, or records the monitor hasn't reported"""
+    return sum(deck.session.unanswered() for deck in DECKS) if GHCI_MODE == 'pipe' else JOURNAL.backlog()
+
+# Tempo clock + cycle-boundary queue for /command?quantize=
+CLOCK = TempoClock()
+SCHEDULER = CommandScheduler(CLOCK, release_scheduled)
+
+# Last-write-wins per target (d1, cps, ...) so slider drags don't build a backlog
+COALESCER = Coalescer(release_coalesced, COALESCE_WINDOWS, on_drop=drop_superseded)
+
+# Bounded queue in front of GHCi/the journal: a stalled consumer means 429s, not a growing backlog.
+# In pipe mode each deck has its own, so a slow compile on one deck doesn't hold up the others.
+QUEUE_WAITS = METRICS.histogram('tidal_command_queue_wait_seconds', 'Time commands spent in the delivery queue')
+if GHCI_MODE == 'pipe':
+    QUEUE = QueueSet([DeliveryQueue(deliver_held, lambda deck=deck: deck.session.unanswered(),
+                                    max_depth=QUEUE_DEPTH, window=QUEUE_WINDOW, ttl=COMMAND_TTL,
+                                    waits=QUEUE_WAITS, on_expire=expire_queued, name=f'delivery-{deck.name}')
+                      for deck in DECKS], route_entry)
+else:
+    QUEUE = DeliveryQueue(deliver_held, delivery_backlog, max_depth=QUEUE_DEPTH, window=QUEUE_WINDOW,
+                          ttl=COMMAND_TTL, waits=QUEUE_WAITS, on_expire=expire_queued)
+METRICS.gauge('tidal_command_queue_depth', QUEUE.depth, 'Commands waiting in the delivery queue')
+METRICS.gauge('tidal_command_in_flight', delivery_backlog, 'Commands handed to GHCi/the monitor but not finished')
+if len(DECKS) > 1:
+    for deck, queue in zip(DECKS, QUEUE.queues):
+        METRICS.gauge('tidal_deck_queue_depth', queue.depth, 'Commands waiting in one deck\'s delivery queue',
+                      deck=deck.name)
+        METRICS.gauge('tidal_deck_in_flight', queue.in_flight, 'Commands sent to one deck\'s GHCi and not answered',
+                      deck=deck.name)
+
+# Token bucket per client address for /command
+LIMITER = RateLimiter(RATE_LIMIT)
+
+# Every accepted command, timestamped, for exact reproduction of a set (POST /replay)
+RECORDER = SessionRecorder(SESSION_DIR, CLOCK, keep=SESSION_KEEP)
+REPLAY = None  # The running/last SessionReplay
+
+# Tidal -> SuperDirt traffic passes through here when TIDAL_OSC_TAP_PORT is set (GET /osc)
+TAP = (OscTap('127.0.0.1', OSC_TAP_PORT, SUPERDIRT_HOST, SUPERDIRT_PORT,
+              lateness=METRICS.histogram('tidal_osc_lateness_seconds',
+                                         'How long after its timetag a late bundle reached the tap'),
+              headroom=METRICS.histogram('tidal_osc_headroom_seconds',
+                                         'How long before its timetag an on-time bundle reached the tap'),
+              jitter=METRICS.histogram('tidal_osc_jitter_seconds',
+                                       'Change in headroom from the same sender\'s previous bundle'))
+       if OSC_TAP_PORT else None)
+if TAP is not None:
+    METRICS.gauge('tidal_osc_events', lambda: TAP.events, '/dirt/play events seen by the OSC tap')
+    METRICS.gauge('tidal_osc_late_bundles', lambda: TAP.late, 'Bundles that reached the tap after their timetag')
+    METRICS.gauge('tidal_osc_dropped_packets', lambda: TAP.dropped,
+                  'Packets lost at the tap (receive buffer overflow or failed forward)')
+
+def record_accepted(commands, grid=None):
+    """Commands just admitted to the queue or scheduler go into the session log (replayed ones aren't)"""
+    if commands:
+        RECORDER.record(commands, grid)
+
+def submit_replayed(replay, record, quantize=True):
+    """Put one recorded command back through the pipeline (replay thread); False if it was rejected
+
+    A full queue is waited out rather than dropped - replaying as fast as
+    possible runs at the speed the far side drains.
+    """
+    error = VALIDATOR.check(record.command) if VALIDATE_COMMANDS else None
+    if error:
+        trace_id = TRACER.start(record.command, mode=GHCI_MODE, replay=replay.name)
+        TRACER.mark(trace_id, 'rejected', status='rejected', error=str(error))
+        return False
+    if quantize and record.grid:
+        trace_id = TRACER.start(record.command, event='scheduled', mode=GHCI_MODE, quantize=record.grid,
+                                replay=replay.name)
+        entry = SCHEDULER.submit(record.command, record.grid, id=trace_id)
+        TRACER.mark(trace_id, 'scheduled', cycle=entry['cycle'])
+        return True
+    key = command_key(record.command)
+    fields = {'target': key[1]} if key else {}
+    trace_id = TRACER.start(record.command, event='queued', mode=GHCI_MODE, replay=replay.name, **fields)
+    entry = dict(fields, id=trace_id, command=record.command)
+    if key is not None and COALESCER.submit(key, entry) == 'held':
+        return True
+    while not replay.stopping():
+        try:
+            queue_in_order([entry])
+            return True
+        except QueueFull as full:
+            METRICS.inc('tidal_replay_throttled_total', help_text='Replayed commands that waited for queue space')
+            time.sleep(min(0.05, full.retry_after))
+    TRACER.mark(trace_id, 'dropped', status='dropped', reason='replay stopped')
+    return False
+
+def spawn_logged(args, cwd=None):
+    """spawn() for a supervised child: its own process group, stderr merged into the stdout it's given"""
+    return lambda stdout: subprocess.Popen(args, cwd=cwd,
+                                           stdin=subprocess.DEVNULL,
+                                           stdout=stdout,
+                                           stderr=subprocess.STDOUT,
+                                           start_new_session=True)
+
+def ghci_label(deck):
+    return 'GHCi' if len(DECKS) == 1 else f'GHCi deck {deck.index}'
+
+def replay_channels(deck, session):
+    """Bring a fresh GHCi up to what the deck's old one was playing; returns how many commands that took"""
+    commands = deck.channels.replay()
+    for payload, _ in plan_batches(commands):
+        session.send(payload)
+    return len(commands)
+
+def spawn_ghci(deck):
+    """spawn() for a deck: headless GHCi keeps its pipes - the service reads its prompts - so it has no log"""
+    def spawn(stdout):
+        session = deck.session
+        session.start()
+        if session.is_ready():
+            with deck.lock:
+                replayed = replay_channels(deck, session)
+            if replayed:
+                print(f"   ♻️  Replayed {replayed} command(s) into the new {ghci_label(deck)}")
+        if deck.standby is not None:
+            deck.standby.prepare()
+        return session.process
+    return spawn
+
+def take_over_ghci(deck):
+    """Swap the deck's warm spare in for its GHCi (crashed, stalled or restarted); its Popen, or None if none is ready"""
+    started = time.monotonic()
+    with deck.lock:
+        spare = deck.standby.take()
+        if spare is None:
+            return None
+        old, deck.session = deck.session, spare
+        if old.is_alive():
+            old.send('hush')  # Silence it now; it can take its time quitting
+            threading.Thread(target=old.stop, name='ghci-retire', daemon=True).start()
+        replayed = replay_channels(deck, spare)
+    elapsed = time.monotonic() - started
+    METRICS.histogram('tidal_ghci_failover_seconds',
+                      'Time to swap the standby GHCi in and replay channel state').record(elapsed)
+    print(f"   ⚡ Standby {ghci_label(deck)} took over in {elapsed * 1000:.0f} ms ({replayed} command(s) replayed)")
+    QUEUE.wake()
+    return spare.process
+
+def note_component(info):
+    """Supervisor state change: publish it, and count exits by reason"""
+    EVENTS.publish('supervisor', info)
+    last_exit = info['last_exit']
+    if last_exit and (info['state'] in ('backoff', 'crash_loop', 'exited') or last_exit.get('takeover')):
+        reason = last_exit['reason']
+        METRICS.inc('tidal_component_exits_total', help_text='Unplanned exits of supervised components',
+                    component=info['name'], reason=reason if reason in ('exited', 'unhealthy') else 'other')
+
+# Children the service launched itself, owned by PID/process group; restarted if they die or stop answering
+SUPERVISOR = Supervisor(LOG_DIR, max_restarts=MAX_RESTARTS, restart_window=RESTART_WINDOW)
+SUPERVISOR.add(Child('supercollider',
+                     spawn_logged(['sclang', str(PROJECT_DIR / "scripts" / "boot-superdirt-via-cli.scd")]),
+                     healthy=lambda: socket_port_check(57120),
+                     grace=30.0))
+SUPERVISOR.add(Child('bridge',
+                     spawn_logged(['npm', 'start'], cwd=str(PROJECT_DIR / "ui")),
+                     healthy=lambda: socket_port_check(8080),
+                     grace=20.0))
+SUPERVISOR.add(Child('monitor', spawn_logged(['python3', '-u', str(PROJECT_DIR / "monitor-commands.py")])))
+if GHCI_MODE == 'pipe':
+    for deck in DECKS:
+        SUPERVISOR.add(Child(deck.name, spawn_ghci(deck),
+                             healthy=lambda deck=deck: not deck.session.stalled(GHCI_STALL_SECONDS),
+                             stop=lambda deck=deck: deck.session.stop(),
+                             takeover=(lambda deck=deck: take_over_ghci(deck)) if deck.standby is not None else None,
+                             grace=5.0,  # spawn_ghci only returns once GHCi has booted
+                             log=False))
+SUPERVISOR.listeners.append(note_component)
+
+# Processes we didn't launch (Terminal GHCi, the SuperCollider app, a hand-started monitor):
+# matched against full command lines, anchored so they can't hit unrelated processes
+STRAY_PATTERNS = {
+    'monitor': r'(^|/)python[\d.]*\s+(-\S+\s+)*\S*monitor-commands\.py(\s|$)',
+    'bridge': r'(^|/)node\s+\S*osc-bridge',
+    'ghci': r'(^|/)ghci(\s|$)|(^|/)ghc(-[\d.]+)?\s.*--interactive',
+    'supercollider': r'(^|/)sclang(\s|$)',
 }
 
+# .tidal sets: parsed block indexes (cached by mtime) and what was last sent from each loaded set
+SETS = SetLoader()
+LOADED_SETS = {}  # path -> {'hashes': {key: hash}, 'watcher': SetWatcher, 'quantize': ..., 'syncs': n}
+SETS_LOCK = threading.Lock()
+
+def resolve_set_path(raw):
+    """Absolute path of a .tidal file, relative to the project dir; ValueError if unusable"""
+    if not isinstance(raw, str) or not raw.strip():
+        raise ValueError('No path provided')
+    path = (PROJECT_DIR / raw).resolve()
+    if path.suffix != SET_SUFFIX:
+        raise ValueError(f'Not a {SET_SUFFIX} file: {raw}')
+    if not path.is_file():
+        raise ValueError(f'No such set: {raw}')
+    return path
+
+def sync_set(path, quantize=None, force=False, wait=0.0):
+    """Send the blocks of a set whose hash changed since they were last sent (all of them on first load)"""
+    blocks = SETS.load(path)
+    with SETS_LOCK:
+        state = LOADED_SETS.setdefault(str(path), {'hashes': {}, 'watcher': None, 'quantize': quantize, 'syncs': 0})
+        changed = changed_blocks({} if force else state['hashes'], blocks)
+        results = []
+        queued = []
+        for block in changed:
+            ack, entry = TidalServiceHandler.ingest(block.text, quantize)
+            results.append(dict(ack, key=block.key, line=block.line))
+            if entry is not None:
+                queued.append((block, entry, results[-1]))
+            elif ack['status'] == 'scheduled':
+                state['hashes'][block.key] = block.hash
+        try:
+            # The changed blocks land together: one journal commit, one GHCi input
+            queue_in_order([entry for _, entry, _ in queued], together=True)
+            record_accepted([entry['command'] for _, entry, _ in queued])
+            for block, _, _ in queued:
+                state['hashes'][block.key] = block.hash
+        except QueueFull as full:
+            # Hashes stay as they were, so the next save tries these blocks again
+            for _, entry, result in queued:
+                TRACER.mark(entry['id'], 'rejected', status='rejected', error=str(full))
+                result['status'] = 'queue_full'
+            queued = []
+        keys = {block.key for block in blocks}
+        removed = [key for key in state['hashes'] if key not in keys]
+        for key in removed:
+            del state['hashes'][key]
+        state['syncs'] += 1
+    deadline = time.monotonic() + wait
+    for _, entry, result in queued:
+        result['status'] = QUEUE.wait(entry, max(0.0, deadline - time.monotonic())) or 'queued'
+    return {'path': str(path),
+            'blocks': len(blocks),
+            'unchanged': len(blocks) - len(changed),
+            'sent': results,
+            'removed': removed}
+
+def reload_set(path):
+    """A watched set was saved: send what changed (set watcher thread)"""
+    with SETS_LOCK:
+        if str(path) not in LOADED_SETS:
+            return  # Unloaded while the change was settling
+        quantize = LOADED_SETS[str(path)]['quantize']
+    summary = sync_set(path, quantize)
+    if summary['sent'] or summary['removed']:
+        print(f"🔁 {path.name}: {len(summary['sent'])} changed block(s) "
+              f"{[result['key'] for result in summary['sent']]}, {summary['unchanged']} unchanged")
+        EVENTS.publish('set', summary)
+
+def set_info(path):
+    with SETS_LOCK:
+        state = LOADED_SETS[path]
+        return {'path': path,
+                'blocks': dict(state['hashes']),
+                'quantize': state['quantize'],
+                'syncs': state['syncs'],
+                'watch': state['watcher'].info() if state['watcher'] else None}
+
+def follow_deliveries():
+    """Finish command traces from the monitor's delivery reports (terminal mode)"""
+    # The cursor too: the monitor can move it without reporting anything (comments, first run)
+    notifier = make_notifier(JOURNAL_DIR, names=[DELIVERIES_NAME, CURSOR_NAME])
+    tailer = FileTailer(JOURNAL_DIR / DELIVERIES_NAME, from_end=True)
+    while True:
+        for line in tailer.read_lines():
+            report = parse_delivery(line)
+            if report is None:
+                continue
+            seq, picked_up, started, done, ok = report
+            JOURNAL.note_consumed(seq)
+            trace_id = TRACER.id_for_seq(seq)
+            if trace_id is None:
+                continue
+            TRACER.mark(trace_id, 'picked_up', at=picked_up)
+            if ok == 'superseded':
+                # The monitor skipped it for a newer update to the same target in its backlog
+                TRACER.mark(trace_id, 'dropped', at=done, status='dropped')
+                METRICS.inc('tidal_commands_coalesced_total', help_text='Updates dropped for a newer one to the same target',
+                            target='monitor')
+                EVENTS.publish('delivery', {'id': trace_id, 'seq': seq, 'ok': None, 'status': 'dropped'})
+                continue
+            if ok == 'expired':
+                # Sat in the journal past the TTL (monitor was stopped) - not played late
+                TRACER.mark(trace_id, 'dropped', at=done, status='dropped', reason='expired')
+                METRICS.inc('tidal_commands_expired_total', help_text='Commands dropped for being older than the TTL',
+                            where='monitor')
+                EVENTS.publish('delivery', {'id': trace_id, 'seq': seq, 'ok': None, 'status': 'expired'})
+                continue
+            TRACER.mark(trace_id, 'delivery_started', at=started)
+            TRACER.mark(trace_id, 'delivered', at=done, status='delivered' if ok else 'failed')
+            trace = TRACER.get(trace_id)
+            if ok and trace and 'scheduled' in trace['events'] and 'queued' in trace['events']:
+                # Released early by the scheduler - feed back how long queueing and delivery really took
+                SCHEDULER.observe(done - trace['events']['queued'])
+            EVENTS.publish('delivery', {'id': trace_id, 'seq': seq, 'ok': ok,
+                                        'latency_ms': round((done - picked_up) * 1000, 3)})
+        # The cursor also moves past lines that get no report (comments)
+        JOURNAL.note_consumed(read_cursor(JOURNAL_DIR))
+        QUEUE.wake()
+        notifier.wait(timeout=30)
+
 class TidalServiceHandler(BaseHTTPRequestHandler):
     """HTTP API for controlling TidalCycles service"""
     
+    # Keep-alive: every response carries a Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes - don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+    
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
         self.send_cors_headers()
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def send_cors_headers(self):
@@ -54,80 +779,371 @@ class TidalServiceHandler(BaseHTTPRequestHandler):
         path = parsed.path
         
         if path == '/status':
-            self.send_json_response(self.get_status())
-        elif path == '/start':
-            self.send_json_response(self.start_all())
-        elif path == '/stop':
-            self.send_json_response(self.stop_all())
-        elif path == '/restart':
-            self.send_json_response(self.restart_all())
+            status = self.get_status()
+            if GHCI_MODE == 'pipe':
+                status['decks'] = deck_status()
+            self.send_json_response(status)
+        elif path == '/events':
+            self.stream_events()
+        elif path in ('/start', '/stop', '/restart'):
+            self.submit_lifecycle_job(path[1:], parse_qs(parsed.query))
+        elif path == '/jobs':
+            self.send_json_response({'jobs': JOBS.list()})
+        elif path.startswith('/jobs/'):
+            job = JOBS.get(path[len('/jobs/'):])
+            if job:
+                self.send_json_response(job)
+            else:
+                self.send_json_response({'error': 'Job not found'}, 404)
+        elif path == '/ghci':
+            # Deck 0 at the top level; the whole pool under 'decks' when there's more than one
+            deck = DECKS[0]
+            info = deck.session.info()
+            info['mode'] = GHCI_MODE
+            info['standby'] = deck.standby.info() if deck.standby is not None else None
+            info['channels'] = deck.channels.info()['keys']
+            info['output'] = deck.session.recent_output()
+            if len(DECKS) > 1:
+                info['decks'] = [deck.info() for deck in DECKS]
+                info['routing'] = ROUTER.info()
+            self.send_json_response(info)
+        elif path == '/trigger':
+            self.send_json_response(DIRT.info())
+        elif path == '/journal':
+            self.send_json_response(JOURNAL.info())
+        elif path == '/metrics':
+            if parse_qs(parsed.query).get('format') == ['json']:
+                self.send_json_response(METRICS.summaries())
+            else:
+                self.send_text_response(METRICS.render(), 'text/plain; version=0.0.4')
+        elif path.startswith('/trace/'):
+            trace_id = path[len('/trace/'):]
+            trace = TRACER.get(int(trace_id)) if trace_id.isdigit() else None
+            if trace:
+                self.send_json_response(trace)
+            else:
+                self.send_json_response({'error': 'Trace not found'}, 404)
         elif path == '/command':
             # Get command from query string
             params = parse_qs(parsed.query)
             cmd = params.get('cmd', [None])[0]
             if cmd:
-                self.send_command(cmd)
-                self.send_json_response({'status': 'sent', 'command': cmd})
+                self.run_command(cmd, params.get('quantize', [None])[0], params.get('wait', [None])[0],
+                                 params.get('deck', [None])[0], params.get('session', [None])[0])
             else:
                 self.send_json_response({'error': 'No command provided'}, 400)
-        elif path == '/control.html' or path == '/':
-            # Serve control UI
-            self.serve_file('ui/service-control.html')
-        else:
+        elif path == '/coalesce':
+            self.send_json_response(COALESCER.info())
+        elif path == '/sets':
+            raw = parse_qs(parsed.query).get('path', [None])[0]
+            if raw:
+                self.show_set(raw)
+            else:
+                self.send_json_response({'sets': [set_info(path) for path in list(LOADED_SETS)],
+                                         'loader': SETS.info()})
+        elif path == '/queue':
+            self.send_json_response(dict(QUEUE.info(), rate_limit=LIMITER.info()))
+        elif path.startswith('/supervisor/'):
+            name = path[len('/supervisor/'):]
+            child = SUPERVISOR.children.get(name)
+            if child is None:
+                self.send_json_response({'error': f'No such component: {name}'}, 404)
+            else:
+                lines = parse_qs(parsed.query).get('lines', ['100'])[0]
+                limit = int(lines) if lines.isdigit() else 100
+                output = child.output.tail(limit) if child.log else deck_named(name).session.recent_output(limit)
+                self.send_json_response(dict(SUPERVISOR.child_info(child), lines=output))
+        elif path == '/supervisor':
+            self.send_json_response({'components': SUPERVISOR.info(), 'log_dir': str(LOG_DIR),
+                                     'max_restarts': MAX_RESTARTS, 'restart_window_seconds': RESTART_WINDOW})
+        elif path == '/clock':
+            self.send_json_response(dict(CLOCK.info(), scheduler=SCHEDULER.info(), pending=SCHEDULER.pending()))
+        elif path == '/sessions':
+            self.send_json_response({'sessions': list_sessions(SESSION_DIR), 'recorder': RECORDER.info(),
+                                     'directory': str(SESSION_DIR)})
+        elif path == '/replay':
+            self.send_json_response(REPLAY.info() if REPLAY else {'state': 'none'})
+        elif path == '/osc':
+            self.send_json_response(TAP.info() if TAP else
+                                    {'running': False, 'hint': 'set TIDAL_OSC_TAP_PORT and point Tidal at it'})
+        elif path == '/preview':
+            params = parse_qs(parsed.query)
+            pattern = params.get('pattern', [None])[0]
+            if pattern:
+                self.preview(pattern, params.get('start', ['0'])[0], params.get('end', ['1'])[0])
+            else:
+                self.send_json_response(RENDERER.info())
+        elif path == '/validate':
+            cmd = parse_qs(parsed.query).get('cmd', [None])[0]
+            if cmd:
+                error = VALIDATOR.check(cmd)
+                self.send_json_response(dict(self.validation_error(cmd, error), valid=False) if error
+                                        else {'valid': True, 'command': cmd})
+            else:
+                self.send_json_response(VALIDATOR.info())
+        elif path == '/assets':
+            self.send_json_response(dict(ASSETS.info(), ui_dir=str(UI_DIR)))
+        elif not self.serve_static(path):
             self.send_json_response({'error': 'Not found'}, 404)
     
-    def serve_file(self, filepath):
-        """Serve static file"""
-        try:
-            file_path = PROJECT_DIR / filepath
-            if file_path.exists():
-                with open(file_path, 'r') as f:
-                    content = f.read()
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/html')
+    def do_HEAD(self):
+        """Headers of a UI file, without the body"""
+        if not self.serve_static(urlparse(self.path).path, head=True):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+    
+    def serve_static(self, path, head=False):
+        """Serve the control UI or a file of the built dj-ui; False if path is neither"""
+        file_path = CONTROL_UI if path in ('/', '/control.html') else resolve(UI_DIR, path)
+        asset = ASSETS.get(file_path) if file_path is not None else None
+        if asset is None:
+            return False
+        
+        # Next.js puts a content hash in these names, so they never change
+        immutable = '/_next/static/' in path
+        encoding = asset.choose_encoding(self.headers.get('Accept-Encoding', ''))
+        span = None
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and (not if_range or if_range.strip() == asset.etag()):
+            try:
+                span = parse_range(range_header, asset.size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{asset.size}')
+                self.send_header('Content-Length', '0')
                 self.end_headers()
-                self.wfile.write(content.encode('utf-8'))
-            else:
-                self.send_json_response({'error': 'File not found'}, 404)
-        except Exception as e:
-            self.send_json_response({'error': str(e)}, 500)
+                return True
+            if span is not None:
+                encoding = None  # Ranges are of the file as stored
+        
+        inm = self.headers.get('If-None-Match')
+        status = 304 if inm and asset.matches(inm) else 206 if span else 200
+        self.send_response(status)
+        self.send_header('ETag', asset.etag(encoding))
+        self.send_header('Last-Modified', formatdate(asset.mtime_ns / 1e9, usegmt=True))
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable' if immutable else 'no-cache')
+        if asset.encoded:
+            self.send_header('Vary', 'Accept-Encoding')
+        if status == 304:
+            self.end_headers()
+            return True
+        
+        body = asset.encoded[encoding] if encoding else asset.body
+        start, end = span or (0, (len(body) if body is not None else asset.size) - 1)
+        length = end - start + 1
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if span:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{asset.size}')
+        self.end_headers()
+        if head or length <= 0:
+            return True
+        if body is not None:
+            self.wfile.write(memoryview(body)[start:end + 1])
+            return True
+        # Too big to cache: zero-copy from the page cache to the socket
+        try:
+            with open(asset.path, 'rb') as f:
+                sent = self.connection.sendfile(f, start, length)
+        except OSError:
+            sent = 0
+        if sent < length:
+            # The file shrank under us; the client can't trust this connection's framing
+            self.close_connection = True
+        return True
     
     def do_POST(self):
         """Handle POST requests"""
         parsed = urlparse(self.path)
         path = parsed.path
         
-        if path == '/command':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+        if path == '/commands':
+            self.run_commands()
+        elif path in ('/sets', '/sets/unload'):
+            data = self.read_json_body()
+            if data is None:
+                return
+            if path == '/sets':
+                self.load_set(data)
+            else:
+                self.unload_set(data)
+        elif path == '/command':
+            data = self.read_json_body()
+            if data is None:
+                return
             cmd = data.get('command')
             if cmd:
-                self.send_command(cmd)
-                self.send_json_response({'status': 'sent', 'command': cmd})
+                self.run_command(cmd, data.get('quantize'), data.get('wait'), data.get('deck'), data.get('session'))
             else:
                 self.send_json_response({'error': 'No command provided'}, 400)
+        elif path == '/trigger':
+            data = self.read_json_body()
+            if data is None:
+                return
+            self.trigger(data)
+        elif path == '/sessions':
+            data = self.read_json_body()
+            if data is None:
+                return
+            self.new_session(data)
+        elif path == '/replay':
+            data = self.read_json_body()
+            if data is None:
+                return
+            self.start_replay(data)
+        elif path == '/replay/stop':
+            if REPLAY is not None:
+                REPLAY.stop()
+            self.send_json_response(REPLAY.info() if REPLAY else {'state': 'none'})
+        elif path == '/clock':
+            data = self.read_json_body()
+            if data is None:
+                return
+            self.set_clock(data)
+        elif path == '/preview':
+            data = self.read_json_body()
+            if data is None:
+                return
+            if data.get('pattern'):
+                self.preview(data['pattern'], data.get('start', 0), data.get('end', 1))
+            else:
+                self.send_json_response({'error': 'No pattern provided'}, 400)
         else:
             self.send_json_response({'error': 'Not found'}, 404)
     
-    def send_json_response(self, data, status=200):
+    def trigger(self, data):
+        """One-shot sound(s) straight to SuperDirt: {"s": "bd", "n": 3} or {"events": [...]}"""
+        latency = data.pop('latency', None)
+        events = data.get('events', [data])
+        if not isinstance(events, list) or not events:
+            self.send_json_response({'error': 'No events provided'}, 400)
+            return
+        normalized = []
+        for event in events:
+            if not isinstance(event, dict):
+                self.send_json_response({'error': 'Events must be objects'}, 400)
+                return
+            event = dict(event)
+            if 'sound' in event:
+                event['s'] = event.pop('sound')
+            if not event.get('s'):
+                self.send_json_response({'error': 'Each event needs a sound ("s")'}, 400)
+                return
+            normalized.append(event)
+        try:
+            at = DIRT.play(normalized, latency)
+        except (ValueError, TypeError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        except OSError as e:
+            self.send_json_response({'error': f'OSC send failed: {e}'}, 502)
+            return
+        self.send_json_response({'status': 'sent', 'events': len(normalized), 'at': at})
+    
+    def preview(self, pattern, start, end):
+        """Events a pattern plays between two cycle positions, without GHCi"""
+        if not HAVE_NUMPY:
+            self.send_json_response({'error': 'Pattern preview needs NumPy: pip install numpy'}, 501)
+            return
+        try:
+            result = RENDERER.render(pattern, float(start), float(end))
+        except (ValueError, TypeError) as e:
+            self.send_json_response({'error': f'Cannot preview: {e}', 'pattern': pattern}, 400)
+            return
+        self.send_json_response(dict(result, pattern=pattern))
+    
+    def read_json_body(self, allow_list=False):
+        """Read and decode a JSON request body (an object, or with allow_list an array too); sends a 400 and returns None if invalid"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            post_data = self.rfile.read(content_length)
+            data = json.loads(post_data.decode('utf-8') or '{}')
+        except (ValueError, UnicodeDecodeError):
+            self.send_json_response({'error': 'Invalid JSON body'}, 400)
+            return None
+        if not isinstance(data, dict) and not (allow_list and isinstance(data, list)):
+            self.send_json_response({'error': 'Expected a JSON array or object' if allow_list else 'Expected a JSON object'}, 400)
+            return None
+        return data
+    
+    def send_text_response(self, text, content_type='text/plain', status=200):
+        """Send plain text response"""
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_json_response(self, data, status=200, headers=None):
         """Send JSON response"""
+        body = json.dumps(data).encode('utf-8')
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_cors_headers()
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        self.wfile.write(body)
     
-    def get_status(self):
-        """Get status of all services"""
-        return {
-            'supercollider': self.is_running('sclang'),
-            'ghci': self.is_running('ghci'),
-            'monitor': self.is_running('monitor-commands.py'),
-            'bridge': self.is_port_open(8080),
-            'superdirt': self.is_port_open(57120),
-            'tidal': self.is_port_open(6010)
+    def submit_lifecycle_job(self, name, params):
+        """Queue /start, /stop or /restart as a background job (202 + job id)"""
+        operations = {
+            'start': TidalServiceHandler.start_all_static,
+            'stop': TidalServiceHandler.stop_all_static,
+            'restart': TidalServiceHandler.restart_all_static,
         }
+        job = JOBS.submit(name, operations[name])
+        wait = params.get('wait', [None])[0]
+        if wait:
+            # Opt-in synchronous mode for scripts: ?wait=<seconds>
+            try:
+                timeout = float(wait)
+            except ValueError:
+                timeout = 60.0
+            job = JOBS.wait(job['id'], timeout)
+        status = 200 if job['state'] in ('done', 'failed') else 202
+        self.send_json_response(job, status, {'Location': f"/jobs/{job['id']}"})
+    
+    def get_status(self):
+        """Get status of all services (cached probe snapshot)"""
+        return apply_mode_overrides(PROBE.status())
+    
+    def stream_events(self):
+        """Server-Sent Events: full status on connect, then only what changes"""
+        subscriber = EVENTS.subscribe()
+        PROBE.hold()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_cors_headers()
+            self.end_headers()
+            # No Content-Length on a stream, so this connection can't be reused
+            self.close_connection = True
+            self.wfile.write(format_event(0, 'status', self.get_status()))
+            self.wfile.flush()
+            while True:
+                item = subscriber.next(timeout=15)
+                if item is None:
+                    self.wfile.write(b': ping\n\n')
+                elif item == 'resync':
+                    self.wfile.write(format_event(0, 'status', self.get_status()))
+                else:
+                    self.wfile.write(format_event(*item))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            EVENTS.unsubscribe(subscriber)
+            PROBE.release()
     
     def start_all(self):
         """Start all services"""
@@ -135,36 +1151,60 @@ class TidalServiceHandler(BaseHTTPRequestHandler):
     
     @staticmethod
     def start_all_static():
-        """Start all services (static method)"""
-        results = {}
-        
-        # Start SuperCollider
-        if not TidalServiceHandler._is_running_static('sclang'):
-            results['supercollider'] = TidalServiceHandler._start_supercollider_static()
-        else:
-            results['supercollider'] = 'already_running'
-        
-        # Start GHCi
-        if not TidalServiceHandler._is_running_static('ghci'):
-            print("   Starting GHCi/TidalCycles...")
-            results['ghci'] = TidalServiceHandler._start_ghci_static()
-            time.sleep(5)  # Wait longer for GHCi to fully start and load Tidal
-        else:
-            results['ghci'] = 'already_running'
-            print("   ✅ GHCi already running")
+        """Start all services (static method)
+
+        Independent components start in parallel; each is considered up only
+        once its readiness probe passes. Returns per-component result and
+        time-to-ready in seconds.
+        """
+        # One fresh scan up front; the "already running?" checks read this snapshot
+        snapshot = PROBE.snapshot(fresh=True)
+        port_ready = lambda port: lambda: PROBE.is_port_open(port, fresh=True)
         
-        # Start Monitor
-        if not TidalServiceHandler._is_running_static('monitor-commands.py'):
-            results['monitor'] = TidalServiceHandler._start_monitor_static()
+        components = [
+            Component('supercollider',
+                      start=TidalServiceHandler._start_supercollider_static,
+                      running=lambda: snapshot.is_running('sclang'),
+                      ready=port_ready(57120),
+                      timeout=30.0),
+            Component('bridge',
+                      start=TidalServiceHandler._start_bridge_static,
+                      running=lambda: snapshot.is_port_open(8080),
+                      ready=port_ready(8080),
+                      timeout=20.0),
+        ]
+        if GHCI_MODE == 'pipe':
+            # Headless GHCi on pipes; ready once it answers with a prompt
+            components.append(Component('ghci',
+                                        start=TidalServiceHandler._start_ghci_pipe_static,
+                                        running=ghci_ready,
+                                        ready=ghci_ready,
+                                        timeout=60.0))
         else:
-            results['monitor'] = 'already_running'
+            components.append(Component('ghci',
+                                        start=TidalServiceHandler._start_ghci_static,
+                                        running=lambda: snapshot.is_running('ghci'),
+                                        ready=port_ready(6010),
+                                        timeout=60.0))
+            # The monitor pastes into GHCi's Terminal, so it waits for GHCi
+            components.append(Component('monitor',
+                                        start=TidalServiceHandler._start_monitor_static,
+                                        running=lambda: snapshot.is_running('monitor-commands.py'),
+                                        ready=lambda: PROBE.is_running('monitor-commands.py', fresh=True),
+                                        requires=('ghci',),
+                                        timeout=5.0))
         
-        # Start Bridge
-        if not TidalServiceHandler._is_port_open_static(8080):
-            results['bridge'] = TidalServiceHandler._start_bridge_static()
-        else:
-            results['bridge'] = 'already_running'
+        results = Orchestrator(components).run()
+        if GHCI_MODE == 'pipe':
+            results['monitor'] = {'result': 'not_needed', 'ready': True, 'time_to_ready': 0.0}
         
+        for name, record in results.items():
+            if isinstance(record, dict):
+                if record['ready']:
+                    print(f"   ✅ {name} ready after {record['time_to_ready']}s ({record['result']})")
+                else:
+                    print(f"   ⚠️  {name} not ready ({record['result']})")
+        PROBE.invalidate()
         return results
     
     def stop_all(self):
@@ -172,45 +1212,26 @@ class TidalServiceHandler(BaseHTTPRequestHandler):
         return self.stop_all_static()
     
     @staticmethod
-    def stop_all_static():
-        """Stop all services (static method)"""
+    def stop_all_static(keep=()):
+        """Stop all services (static method), except those named in keep"""
         results = {}
-        results['monitor'] = TidalServiceHandler._stop_process_static('monitor-commands.py')
-        results['bridge'] = TidalServiceHandler._stop_process_static('node.*osc-bridge')
-        results['ghci'] = TidalServiceHandler._stop_process_static('ghci')
-        results['supercollider'] = TidalServiceHandler._stop_process_static('sclang')
+        for name in ('monitor', 'bridge', 'ghci', 'supercollider'):
+            if name not in keep:
+                results[name] = TidalServiceHandler._stop_process_static(name)
+        PROBE.invalidate()
         return results
     
     @staticmethod
-    def _is_running_static(process_name):
+    def _is_running_static(process_name, fresh=False):
         try:
-            if process_name == 'ghci':
-                # GHCi runs inside Terminal, check multiple ways
-                result1 = subprocess.run(['pgrep', '-f', 'ghci'], 
-                                       capture_output=True, check=False)
-                result2 = subprocess.run(['pgrep', '-f', 'ghc.*tidal'], 
-                                       capture_output=True, check=False)
-                # Check ps output for ghci/tidal
-                result3 = subprocess.run(['ps', 'aux'], 
-                                       capture_output=True, check=False)
-                if result3.returncode == 0:
-                    output = result3.stdout.decode('utf-8', errors='ignore')
-                    if 'ghci' in output.lower() or ('ghc' in output.lower() and 'tidal' in output.lower()):
-                        return True
-                return result1.returncode == 0 or result2.returncode == 0
-            else:
-                result = subprocess.run(['pgrep', '-f', process_name], 
-                                      capture_output=True, check=False)
-                return result.returncode == 0
+            return PROBE.is_running(process_name, fresh)
         except:
             return False
     
     @staticmethod
-    def _is_port_open_static(port):
+    def _is_port_open_static(port, fresh=False):
         try:
-            result = subprocess.run(['lsof', '-i', f':{port}'], 
-                                  capture_output=True, check=False)
-            return result.returncode == 0
+            return PROBE.is_port_open(port, fresh)
         except:
             return False
     
@@ -222,9 +1243,7 @@ class TidalServiceHandler(BaseHTTPRequestHandler):
             boot_script = SUPERCOLLIDER_AUTO_SCRIPT if SUPERCOLLIDER_AUTO_SCRIPT.exists() else SUPERCOLLIDER_SCRIPT
             
             # Check if SuperDirt is already running
-            port_check = subprocess.run(['lsof', '-i', ':57120'], 
-                                      capture_output=True, check=False)
-            if port_check.returncode == 0:
+            if TidalServiceHandler._is_port_open_static(57120):
                 print("   ✅ SuperDirt already running on port 57120")
                 return 'already_running'
             
@@ -234,24 +1253,23 @@ class TidalServiceHandler(BaseHTTPRequestHandler):
                     result = subprocess.run(['which', 'sclang'], 
                                           capture_output=True, check=False)
                     if result.returncode == 0:
-                        # Boot via command line
-                        subprocess.Popen(['sclang', str(cli_script)],
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE)
+                        # Boot via command line, supervised so a crash mid-set restarts it
+                        started = SUPERVISOR.start('supercollider')
+                        if started.startswith('error'):
+                            raise OSError(started)
                         print("   ✅ Starting SuperDirt via command line...")
-                        time.sleep(4)  # Wait for boot
-                        # Check if it started
-                        port_check = subprocess.run(['lsof', '-i', ':57120'], 
-                                                  capture_output=True, check=False)
-                        if port_check.returncode == 0:
+                        # Wait for the port rather than a fixed sleep
+                        booted = wait_until(lambda: TidalServiceHandler._is_port_open_static(57120, fresh=True),
+                                            time.monotonic() + 15)
+                        if booted:
                             print("   ✅ SuperDirt booted successfully!")
                             return 'booted'
                 except Exception as e:
                     print(f"   ⚠️  CLI boot failed: {e}, trying GUI method...")
             
             # Fallback: Open SuperCollider app and try to boot via GUI
+            # The AppleScript below activates the app and waits for it itself
             subprocess.Popen(['open', '-a', 'SuperCollider'])
-            time.sleep(2)  # Wait for app to open
             
             if boot_script.exists():
                 # Use osascript to open and boot the script
@@ -278,7 +1296,6 @@ end tell'''
                                    stdout=subprocess.PIPE,
                                    stderr=subprocess.PIPE)
                     print("   ✅ SuperCollider opened, booting SuperDirt via GUI...")
-                    time.sleep(5)  # Give it more time to boot
                     return 'opened_and_booting'
                 except Exception as e:
                     print(f"   ⚠️  Auto-boot failed: {e}")
@@ -300,7 +1317,6 @@ end tell'''
     activate
     delay 3
     do script ":script {GHCi_SCRIPT}" in newTab
-    delay 2
 end tell'''
         try:
             result = subprocess.run(['osascript', '-e', script], 
@@ -310,18 +1326,8 @@ end tell'''
                                   check=False)
             if result.returncode == 0:
                 print("   ✅ GHCi startup command sent to Terminal")
-                print("   ⏳ Waiting for GHCi to load TidalCycles...")
-                time.sleep(5)  # Give it time to start and load
-                # Check if it's actually running
-                check = subprocess.run(['lsof', '-i', ':6010'], 
-                                     capture_output=True, 
-                                     check=False)
-                if check.returncode == 0:
-                    print("   ✅ GHCi/TidalCycles is running and listening on port 6010")
-                    return 'started'
-                else:
-                    print("   ⚠️  GHCi started but port 6010 not open yet (may need more time)")
-                    return 'started'
+                print("   ⏳ Waiting for GHCi to load TidalCycles (port 6010)...")
+                return 'started'
             else:
                 print(f"   ❌ Error starting GHCi: {result.stderr}")
                 return 'error'
@@ -332,101 +1338,476 @@ end tell'''
             print(f"   ❌ Error: {e}")
             return 'error'
     
+    @staticmethod
+    def _start_ghci_pipe_static():
+        """Boot every deck's GHCi in parallel; 'started' once they're all up"""
+        print(f"   🚀 Starting headless GHCi/TidalCycles ({len(DECKS)} instance{'s' if len(DECKS) > 1 else ''})...")
+        results = {}
+        def start(deck):
+            results[deck.name] = SUPERVISOR.start(deck.name)
+        threads = [threading.Thread(target=start, args=(deck,), name=f'start-{deck.name}', daemon=True)
+                   for deck in DECKS]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for deck in DECKS:
+            result = results[deck.name]
+            if result.startswith('error'):
+                print(f"   ❌ Error starting {ghci_label(deck)}: {result[len('error: '):]}")
+            elif deck.session.is_ready():
+                print(f"   ✅ {ghci_label(deck)} ready in {deck.session.info()['startup_seconds']}s")
+            else:
+                print(f"   ⚠️  {ghci_label(deck)} started but no prompt yet")
+        if any(result.startswith('error') for result in results.values()):
+            return 'error'
+        return 'already_running' if all(result == 'already_running' for result in results.values()) else 'started'
+    
     @staticmethod
     def _start_monitor_static():
-        try:
-            monitor_script = PROJECT_DIR / "monitor-commands.py"
-            process = subprocess.Popen(['python3', str(monitor_script)],
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
-            processes['monitor'] = process
-            return 'started'
-        except Exception as e:
-            return f'error: {e}'
+        return SUPERVISOR.start('monitor')
     
     @staticmethod
     def _start_bridge_static():
-        try:
-            bridge_dir = PROJECT_DIR / "ui"
-            process = subprocess.Popen(['npm', 'start'],
-                                      cwd=str(bridge_dir),
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
-            processes['bridge'] = process
-            return 'started'
-        except Exception as e:
-            return f'error: {e}'
+        return SUPERVISOR.start('bridge')
     
     @staticmethod
-    def _stop_process_static(pattern):
-        try:
-            subprocess.run(['pkill', '-f', pattern], check=False)
+    def _stop_process_static(name):
+        """Stop a component: our own child by process group, else matching PIDs we didn't launch"""
+        if name == 'ghci' and GHCI_MODE == 'pipe':
+            # Headless GHCi is always ours (every deck, spares included); other GHCi sessions aren't
+            stopped = False
+            for deck in DECKS:
+                if deck.standby is not None:
+                    deck.standby.stop()
+                stopped = SUPERVISOR.stop(deck.name) == 'stopped' or stopped
+            return 'stopped' if stopped else 'not_running'
+        if name in SUPERVISOR.children and SUPERVISOR.stop(name) == 'stopped':
             return 'stopped'
-        except:
-            return 'error'
+        pids = PROBE.snapshot(fresh=True).pids(STRAY_PATTERNS[name])
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+        return 'stopped' if pids else 'not_running'
     
     def restart_all(self):
         """Restart all services"""
-        self.stop_all()
+        return self.restart_all_static()
+    
+    @staticmethod
+    def restart_all_static():
+        """Restart all services (static method)
+
+        With a GHCi standby, GHCi isn't stopped: the spare takes over straight
+        away, channel state and all, while the rest restarts.
+        """
+        keep = ()
+        if GHCI_MODE == 'pipe' and GHCI_STANDBY and all(SUPERVISOR.owns(deck.name) for deck in DECKS):
+            for deck in DECKS:
+                print(f"   🔁 {ghci_label(deck)}: {SUPERVISOR.restart(deck.name)}")
+            keep = ('ghci',)
+        TidalServiceHandler.stop_all_static(keep)
         time.sleep(2)
-        return self.start_all()
+        return TidalServiceHandler.start_all_static()
     
-    def send_command(self, command):
-        """Send command to TidalCycles"""
-        COMMAND_FILE.parent.mkdir(exist_ok=True)
+    def run_command(self, command, quantize=None, wait=None, deck=None, session=None):
+        """Validate, admit, then queue (or schedule) and answer a /command request
+
+        wait: seconds to hold the answer for GHCi's result (pipe mode), so a
+        compile error comes back on this request instead of only in GHCi.
+        deck/session: which GHCi of the pool plays it (default: by channel).
+        """
         try:
-            with open(COMMAND_FILE, 'a') as f:
-                f.write(command + '\n')
-                f.flush()  # Ensure it's written immediately
-            os.fsync(f.fileno())  # Force write to disk
-            return True
-        except Exception as e:
-            print(f"Error writing command: {e}")
-            return False
+            wait = parse_wait(wait)
+            decks = ROUTER.route(command, deck, session)
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        error = VALIDATOR.check(command) if VALIDATE_COMMANDS else None
+        if error:
+            trace_id = TRACER.start(command, mode=GHCI_MODE)
+            TRACER.mark(trace_id, 'rejected', status='rejected', error=str(error))
+            self.send_json_response(dict(self.validation_error(command, error), id=trace_id), 400)
+            return
+        retry_after = LIMITER.allow(self.client_address[0])
+        if retry_after:
+            self.send_throttled('rate_limited', f'Rate limit: {LIMITER.rate:g} commands/s per client',
+                                retry_after, command)
+            return
+        if quantize not in (None, ''):
+            self.schedule_command(command, quantize, decks)
+            return
+        key = command_key(command)
+        fields = {'target': key[1]} if key else {}
+        trace_id = TRACER.start(command, event='queued', mode=GHCI_MODE, decks=decks, **fields)
+        entry = dict(fields, id=trace_id, command=command, decks=decks)
+        if key is not None and COALESCER.submit(target_key(entry), entry) == 'held':
+            record_accepted([command])
+            # Sent when the target's window closes, unless a newer update replaces it first
+            self.send_json_response({'status': 'held', 'command': command, 'id': trace_id,
+                                     'target': key[1]}, 202)
+            return
+        try:
+            queue_in_order([entry])
+        except QueueFull as full:
+            TRACER.mark(trace_id, 'rejected', status='rejected', error=str(full))
+            self.send_throttled('queue_full', f'Delivery queue is full ({full.depth} commands waiting)',
+                                full.retry_after, command, id=trace_id)
+            return
+        record_accepted([command])
+        deadline = time.monotonic() + wait
+        outcome = QUEUE.wait(entry, max(COMMAND_WAIT, wait))
+        if outcome is None:
+            # GHCi/the monitor is behind; /events reports when it goes out (or expires)
+            self.send_json_response({'status': 'queued', 'command': command, 'id': trace_id,
+                                     'depth': QUEUE.depth()}, 202)
+            return
+        if outcome == 'sent' and wait and GHCI_MODE == 'pipe':
+            self.send_result(entry, wait_result(entry, max(0.0, deadline - time.monotonic())))
+            return
+        self.send_json_response({'status': outcome, 'command': command, 'id': trace_id},
+                                200 if outcome == 'sent' else 503)
+    
+    def send_result(self, entry, result):
+        """Answer with what GHCi made of the command: 200 ok, 422 compile error (or skipped for one), 503 GHCi died, 202 no answer yet"""
+        body = {'command': entry['command'], 'id': entry['id']}
+        if result is None:
+            self.send_json_response(dict(body, status='sent', result='pending'), 202)
+            return
+        body.update(status=result['status'], output=result['output'])
+        if result['error']:
+            body['error'] = result['error']
+        self.send_json_response(body, {'ok': 200, 'error': 422, 'skipped': 422}.get(result['status'], 503))
+    
+    def send_throttled(self, reason, error, retry_after, command, **fields):
+        """429 with a Retry-After header (whole seconds; the body has the exact figure)"""
+        METRICS.inc('tidal_commands_throttled_total', help_text='Commands turned away with 429', reason=reason)
+        if command is not None:
+            fields['command'] = command
+        self.send_json_response(dict(fields, status=reason, error=error, retry_after=round(retry_after, 3)),
+                                429, {'Retry-After': str(max(1, math.ceil(retry_after)))})
+    
+    def schedule_command(self, command, quantize, decks=None):
+        """Hold a command for the next beat/bar/N-cycle boundary; answers with when it will land"""
+        try:
+            self.send_json_response(self.schedule(command, quantize, decks), 202)
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+    
+    @staticmethod
+    def schedule(command, quantize, decks=None):
+        """Queue a command on the scheduler; its acknowledgement (ValueError if quantize is bad)"""
+        parse_quantize(quantize)
+        decks = decks or ROUTER.route(command)
+        trace_id = TRACER.start(command, event='scheduled', mode=GHCI_MODE, quantize=quantize, decks=decks)
+        entry = SCHEDULER.submit(command, quantize, id=trace_id, decks=decks)
+        record_accepted([command], entry['grid'])
+        TRACER.mark(trace_id, 'scheduled', cycle=entry['cycle'])
+        EVENTS.publish('command', {'id': trace_id,
+                                   'command': command,
+                                   'status': 'scheduled',
+                                   'mode': GHCI_MODE,
+                                   'cycle': entry['cycle'],
+                                   'at': entry['at']})
+        return {'status': 'scheduled',
+                'command': command,
+                'id': trace_id,
+                'cycle': entry['cycle'],
+                'at': entry['at'],
+                'in': round(entry['at'] - time.time(), 6)}
+    
+    def run_commands(self):
+        """POST /commands: [...] or {"commands": [...]} as one batch, or an NDJSON stream acked line by line"""
+        if self.headers.get('Content-Type', '').split(';')[0].strip() in NDJSON_TYPES:
+            self.stream_commands()
+            return
+        data = self.read_json_body(allow_list=True)
+        if data is None:
+            return
+        if isinstance(data, list):
+            data = {'commands': data}  # A bare array: no batch-wide quantize/deck/session
+        items = data.get('commands')
+        if not isinstance(items, list) or not items:
+            self.send_json_response({'error': 'No commands provided (expected [...] or {"commands": [...]})'}, 400)
+            return
+        if len(items) > QUEUE.max_depth:
+            self.send_json_response({'error': f'At most {QUEUE.max_depth} commands per request'}, 400)
+            return
+        retry_after = LIMITER.allow(self.client_address[0], cost=min(len(items), LIMITER.burst))
+        if retry_after:
+            self.send_throttled('rate_limited', f'Rate limit: {LIMITER.rate:g} commands/s per client',
+                                retry_after, None, count=len(items))
+            return
+        results = []
+        entries = []
+        for index, item in enumerate(items):
+            ack, entry = self.ingest(item, data.get('quantize'), data.get('deck'), data.get('session'))
+            results.append(dict(ack, index=index))
+            if entry is not None:
+                entries.append((len(results) - 1, entry))
+        try:
+            # One batch: one journal commit, one GHCi input
+            queue_in_order([entry for _, entry in entries], together=True)
+            record_accepted([entry['command'] for _, entry in entries])
+        except QueueFull as full:
+            for index, entry in entries:
+                TRACER.mark(entry['id'], 'rejected', status='rejected', error=str(full))
+                results[index]['status'] = 'queue_full'
+            self.send_throttled('queue_full', f'Delivery queue is full ({full.depth} commands waiting)',
+                                full.retry_after, None, results=results)
+            return
+        deadline = time.monotonic() + COMMAND_WAIT
+        for index, entry in entries:
+            results[index]['status'] = QUEUE.wait(entry, max(0.0, deadline - time.monotonic())) or 'queued'
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        self.send_json_response({'count': len(results), 'statuses': counts, 'results': results})
+    
+    def stream_commands(self):
+        """NDJSON in, NDJSON out: each line is queued as it arrives and acked (in order) as it goes out"""
+        params = parse_qs(urlparse(self.path).query)
+        quantize = params.get('quantize', [None])[0]
+        deck = params.get('deck', [None])[0]
+        session = params.get('session', [None])[0]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_cors_headers()
+        self.end_headers()
+        # No Content-Length on a stream, so this connection can't be reused
+        self.close_connection = True
+        pending = queue.Queue()
+        writer = threading.Thread(target=self.write_acks, args=(pending,), name='command-acks', daemon=True)
+        writer.start()
+        try:
+            for index, line in enumerate(self.read_body_lines()):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except (ValueError, UnicodeDecodeError):
+                    pending.put(({'index': index, 'status': 'rejected', 'error': 'Invalid JSON line'}, None))
+                    continue
+                retry_after = LIMITER.allow(self.client_address[0])
+                if retry_after:
+                    METRICS.inc('tidal_commands_throttled_total', help_text='Commands turned away with 429',
+                                reason='rate_limited')
+                    pending.put(({'index': index, 'status': 'rate_limited',
+                                  'retry_after': round(retry_after, 3)}, None))
+                    continue
+                ack, entry = self.ingest(item, quantize, deck, session)
+                ack['index'] = index
+                if entry is not None:
+                    try:
+                        queue_in_order([entry])
+                        record_accepted([entry['command']])
+                    except QueueFull as full:
+                        METRICS.inc('tidal_commands_throttled_total', help_text='Commands turned away with 429',
+                                    reason='queue_full')
+                        TRACER.mark(entry['id'], 'rejected', status='rejected', error=str(full))
+                        ack.update(status='queue_full', retry_after=full.retry_after)
+                        entry = None
+                pending.put((ack, entry))
+        except (OSError, ValueError) as e:
+            pending.put(({'status': 'error', 'error': f'Request stream broken: {e}'}, None))
+        finally:
+            pending.put(None)
+            writer.join()
+    
+    def write_acks(self, pending):
+        """Ack writer for stream_commands: waits for each queued command in turn"""
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            ack, entry = item
+            if entry is not None:
+                ack['status'] = QUEUE.wait(entry, COMMAND_WAIT) or 'queued'
+            try:
+                self.wfile.write(json.dumps(ack).encode('utf-8') + b'\n')
+                self.wfile.flush()
+            except OSError:
+                pass  # Client went away; keep draining so the reader can finish
+    
+    def read_body_lines(self):
+        """Request body lines as they arrive (Content-Length or chunked transfer encoding)"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            buffered = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b'', b'\r\n', b'\n'):
+                        pass  # Trailers
+                    break
+                buffered += self.rfile.read(size)
+                self.rfile.readline()
+                *lines, buffered = buffered.split(b'\n')
+                yield from (line.decode('utf-8') for line in lines)
+            if buffered:
+                yield buffered.decode('utf-8')
+            return
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            line = self.rfile.readline(min(remaining, 65536))
+            if not line:
+                break
+            remaining -= len(line)
+            yield line.decode('utf-8')
+    
+    def show_set(self, raw):
+        """GET /sets?path=: the parsed block index, nothing sent"""
+        try:
+            path = resolve_set_path(raw)
+            blocks = SETS.load(path)
+        except (ValueError, OSError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        self.send_json_response({'path': str(path), 'blocks': [block._asdict() for block in blocks]})
+    
+    def load_set(self, data):
+        """POST /sets {"path", "watch", "quantize", "force"}: send a set's changed blocks, then follow the file"""
+        try:
+            path = resolve_set_path(data.get('path'))
+            summary = sync_set(path, data.get('quantize'), bool(data.get('force')), COMMAND_WAIT)
+        except (ValueError, OSError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        with SETS_LOCK:
+            state = LOADED_SETS[str(path)]
+            state['quantize'] = data.get('quantize')
+            if data.get('watch', True) and state['watcher'] is None:
+                state['watcher'] = SetWatcher(path, reload_set).start()
+        self.send_json_response(dict(summary, watch=set_info(str(path))['watch']))
+    
+    def new_session(self, data):
+        """POST /sessions {"name"}: close the current session log and start recording a new one"""
+        try:
+            name = RECORDER.start(data.get('name'))
+        except (ValueError, OSError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        print(f"   ⏺️  Recording session {name}")
+        self.send_json_response(RECORDER.info())
+    
+    def start_replay(self, data):
+        """POST /replay {"session", "speed", "quantize"}: play a recorded session back through the pipeline
+
+        speed: 1 (default) keeps the original timing, N plays N times faster,
+        0 or "max" sends as fast as the queue drains. quantize: false sends
+        commands that were quantized straight away instead of on their grid.
+        """
+        global REPLAY
+        name = data.get('session')
+        speed = data.get('speed', 1)
+        if speed == 'max':
+            speed = 0
+        if not isinstance(name, str) or not name.replace('-', '').replace('_', '').isalnum():
+            self.send_json_response({'error': 'Expected {"session": name} (see GET /sessions)'}, 400)
+            return
+        if isinstance(speed, bool) or not isinstance(speed, (int, float)) or speed < 0:
+            self.send_json_response({'error': f'bad speed {speed!r} (a multiple of real time, or "max")'}, 400)
+            return
+        try:
+            _, records = read_session(SESSION_DIR / f'{name}{SESSION_SUFFIX}')
+        except FileNotFoundError:
+            self.send_json_response({'error': f'No such session: {name}'}, 404)
+            return
+        except (ValueError, OSError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        if REPLAY is not None and REPLAY.state == 'running':
+            self.send_json_response({'error': f'Already replaying {REPLAY.name} (POST /replay/stop)'}, 409)
+            return
+        quantize = data.get('quantize', True) is not False
+        REPLAY = SessionReplay(name, records, lambda replay, record: submit_replayed(replay, record, quantize),
+                               speed=float(speed),
+                               lateness=METRICS.histogram('tidal_replay_lateness_seconds',
+                                                          'How far behind the recorded timing replayed commands went in'))
+        REPLAY.start()
+        print(f"   ▶️  Replaying {name}: {len(records)} commands at {f'{speed:g}x' if speed else 'full speed'}")
+        self.send_json_response(REPLAY.info(), 202)
+    
+    def unload_set(self, data):
+        """POST /sets/unload {"path"}: stop following a set (what it sent keeps playing)"""
+        try:
+            path = str(resolve_set_path(data.get('path')))
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        with SETS_LOCK:
+            state = LOADED_SETS.pop(path, None)
+        if state is None:
+            self.send_json_response({'error': 'Set not loaded'}, 404)
+            return
+        if state['watcher']:
+            state['watcher'].stop()
+        self.send_json_response({'status': 'unloaded', 'path': path})
+    
+    @staticmethod
+    def ingest(item, quantize=None, deck=None, session=None):
+        """Validate one bulk item ("cmd" or {"command", "quantize", "deck", "session"}); (ack, entry to queue or None)"""
+        command = item.get('command') if isinstance(item, dict) else item
+        if isinstance(item, dict):
+            quantize = item.get('quantize', quantize)
+            deck = item.get('deck', deck)
+            session = item.get('session', session)
+        if not isinstance(command, str) or not command.strip():
+            return {'status': 'rejected', 'error': 'No command provided'}, None
+        error = VALIDATOR.check(command) if VALIDATE_COMMANDS else None
+        if error:
+            trace_id = TRACER.start(command, mode=GHCI_MODE)
+            TRACER.mark(trace_id, 'rejected', status='rejected', error=str(error))
+            return dict(TidalServiceHandler.validation_error(command, error), id=trace_id), None
+        try:
+            decks = ROUTER.route(command, deck, session)
+        except ValueError as e:
+            return {'status': 'rejected', 'error': str(e), 'command': command}, None
+        if quantize not in (None, ''):
+            try:
+                return TidalServiceHandler.schedule(command, quantize, decks), None
+            except ValueError as e:
+                return {'status': 'rejected', 'error': str(e), 'command': command}, None
+        trace_id = TRACER.start(command, event='queued', mode=GHCI_MODE, decks=decks)
+        return ({'status': 'queued', 'command': command, 'id': trace_id},
+                {'id': trace_id, 'command': command, 'decks': decks})
+    
+    def set_clock(self, data):
+        """Change tempo ({"cps": 0.6} or {"bpm": 140}) and/or align the cycle count ({"cycle": 0})"""
+        try:
+            cps = data.get('cps')
+            if cps is None and data.get('bpm') is not None:
+                cps = float(data['bpm']) / 60 / BEATS_PER_CYCLE
+            CLOCK.set(cps=float(cps) if cps is not None else None,
+                      cycle=float(data['cycle']) if data.get('cycle') is not None else None)
+        except (TypeError, ValueError) as e:
+            self.send_json_response({'error': f'Invalid clock settings: {e}'}, 400)
+            return
+        SCHEDULER.wake()
+        self.send_json_response(CLOCK.info())
+    
+    @staticmethod
+    def validation_error(command, error):
+        """Response body for a command that failed validation"""
+        line = command.count('\n', 0, error.column - 1) + 1
+        column = error.column - command.rfind('\n', 0, error.column - 1) - 1
+        where = f'line {line}, column {column}' if '\n' in command else f'column {column}'
+        return {'status': 'rejected',
+                'error': f'Invalid command: {error.message} at {where}',
+                'command': command,
+                'line': line,
+                'column': column,
+                'pointer': ' ' * (column - 1) + '^'}
     
     def is_running(self, process_name):
         """Check if process is running"""
-        try:
-            if process_name == 'ghci':
-                # GHCi runs inside Terminal, check for ghci or ghc processes
-                result1 = subprocess.run(['pgrep', '-f', 'ghci'], 
-                                       capture_output=True, check=False)
-                result2 = subprocess.run(['pgrep', '-f', 'ghc.*tidal'], 
-                                       capture_output=True, check=False)
-                # Also check if Terminal has ghci running
-                result3 = subprocess.run(['ps', 'aux'], 
-                                       capture_output=True, check=False)
-                if result3.returncode == 0:
-                    output = result3.stdout.decode('utf-8', errors='ignore')
-                    if 'ghci' in output.lower() or 'tidal' in output.lower():
-                        return True
-                return result1.returncode == 0 or result2.returncode == 0
-            else:
-                result = subprocess.run(['pgrep', '-f', process_name], 
-                                      capture_output=True, check=False)
-                return result.returncode == 0
-        except:
-            return False
+        return self._is_running_static(process_name)
     
     def is_port_open(self, port):
         """Check if port is open"""
-        try:
-            result = subprocess.run(['lsof', '-i', f':{port}'], 
-                                  capture_output=True, check=False)
-            return result.returncode == 0
-        except:
-            return False
-    
-    def get_status(self):
-        """Get status of all services"""
-        return {
-            'supercollider': self.is_running('sclang'),
-            'ghci': self.is_running('ghci'),
-            'monitor': self.is_running('monitor-commands.py'),
-            'bridge': self.is_port_open(8080),
-            'superdirt': self.is_port_open(57120),
-            'tidal': self.is_port_open(6010)
-        }
+        return self._is_port_open_static(port)
     
     def start_supercollider(self):
         """Start SuperCollider (opens app, user runs script manually)"""
@@ -454,57 +1835,65 @@ end tell'''
     
     def start_monitor(self):
         """Start command monitor"""
-        try:
-            monitor_script = PROJECT_DIR / "monitor-commands.py"
-            process = subprocess.Popen(['python3', str(monitor_script)],
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
-            processes['monitor'] = process
-            return 'started'
-        except Exception as e:
-            return f'error: {e}'
+        return self._start_monitor_static()
     
     def start_bridge(self):
         """Start bridge server"""
-        try:
-            bridge_dir = PROJECT_DIR / "ui"
-            process = subprocess.Popen(['npm', 'start'],
-                                      cwd=str(bridge_dir),
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
-            processes['bridge'] = process
-            return 'started'
-        except Exception as e:
-            return f'error: {e}'
+        return self._start_bridge_static()
     
-    def stop_process(self, pattern):
-        """Stop process by pattern"""
-        try:
-            subprocess.run(['pkill', '-f', pattern], check=False)
-            return 'stopped'
-        except:
-            return 'error'
+    def stop_process(self, name):
+        """Stop a component by name"""
+        return self._stop_process_static(name)
     
     def log_message(self, format, *args):
         """Suppress default logging"""
         pass
 
-def start_service(port=9000):
+def start_service(port=SERVICE_PORT):
     """Start the TidalCycles service"""
-    server = HTTPServer(('localhost', port), TidalServiceHandler)
+    server = ThreadingHTTPServer(('localhost', port), TidalServiceHandler)
+    server.daemon_threads = True
     
     print("🎵 TidalCycles Service Manager")
     print(f"📡 API Server: http://localhost:{port}")
     print("")
     print("Available endpoints:")
     print("  GET  /status  - Check service status")
-    print("  GET  /start    - Start all services")
-    print("  GET  /stop     - Stop all services")
-    print("  GET  /restart  - Restart all services")
-    print("  POST /command - Send command to TidalCycles")
+    print("  GET  /events  - Live status/command stream (Server-Sent Events)")
+    print("  GET  /start    - Start all services (background job)")
+    print("  GET  /stop     - Stop all services (background job)")
+    print("  GET  /restart  - Restart all services (background job)")
+    print("  GET  /jobs/<id> - Poll a background job")
+    print("  GET  /ghci    - Headless GHCi state and recent output")
+    print("  GET  /journal - Command journal sequence, cursor and segments")
+    print("  GET  /metrics - Latency histograms (Prometheus text format)")
+    print("  GET  /trace/<id> - Timeline of one command")
+    print("  GET  /validate?cmd= - Check a command without sending it")
+    print("  GET  /preview?pattern=&start=&end= - Events a pattern plays (needs NumPy)")
+    print("  POST /command - Send command to TidalCycles (rejected with 400 if malformed)")
+    print("                  {\"wait\": true} answers with GHCi's result - 422 + the error if it didn't compile")
+    print("                  {\"quantize\": \"bar\"} holds it for the next beat/bar/N cycles")
+    print("                  429 + Retry-After when rate limited or the delivery queue is full")
+    print("                  {\"deck\": N} or {\"session\": id} picks a GHCi deck (TIDAL_GHCI_INSTANCES)")
+    print("  POST /commands - Many commands in one request, one journal commit: {\"commands\": [...]}")
+    print("                  or Content-Type: application/x-ndjson to stream lines in and acks out")
+    print("  POST /sets    - Load a .tidal set and hot-reload changed blocks: {\"path\": \"examples/basic-beats.tidal\"}")
+    print("  GET  /sets    - Loaded sets and block hashes (?path= shows a file's block index)")
+    print("  GET  /queue   - Delivery queue depth, in-flight commands, expiries, rate limits")
+    print("  GET  /supervisor - Uptime, restarts and last exit of each launched component")
+    print("  GET  /supervisor/<name>?lines= - One component's state and recent output")
+    print("  GET  /coalesce - Updates held/dropped by last-write-wins coalescing")
+    print("  GET  /clock   - Tempo clock and scheduled commands (POST to set cps/bpm/cycle)")
+    print("  GET  /sessions - Recorded session logs (POST to start a new one)")
+    print("  POST /replay  - Play a session back at 1x, Nx or full speed (GET for progress, /replay/stop)")
+    print("  POST /trigger - One-shot sound straight to SuperDirt (OSC)")
+    print("  GET  /osc     - Tidal -> SuperDirt timing: lateness, jitter, drops, events/s per orbit")
+    print("  GET  /assets  - UI file cache (files, bytes, hits)")
     print("")
     print("Web UI:")
     print(f"  http://localhost:{port}/control.html")
+    if UI_DIR.is_dir():
+        print(f"  http://localhost:{port}/index.html  (built dj-ui from {UI_DIR})")
     print("")
     print("Example API calls:")
     print(f"  curl http://localhost:{port}/start")
@@ -513,26 +1902,43 @@ def start_service(port=9000):
     print("Press Ctrl+C to stop")
     print("")
     
-    # Auto-start services on startup
-    print("🚀 Auto-starting services...")
-    time.sleep(1)
-    # Create a temporary handler instance to call methods
-    class TempHandler:
-        def start_all(self):
-            return TidalServiceHandler.start_all_static()
-        def stop_all(self):
-            return TidalServiceHandler.stop_all_static()
-    
-    # Start services using static methods
-    TidalServiceHandler.start_all_static()
-    print("✅ Services started!")
-    print("")
+    PROBE.start()
+    SCHEDULER.start()
+    COALESCER.start()
+    QUEUE.start()
+    SUPERVISOR.start_monitoring()
+    if RECORD_SESSIONS:
+        try:
+            print(f"⏺️  Recording accepted commands to {SESSION_DIR / RECORDER.start()}{SESSION_SUFFIX}")
+        except (ValueError, OSError) as e:
+            print(f"⚠️  Session recording off: {e}")
+    if TAP is not None:
+        try:
+            TAP.start()
+            print(f"🔎 OSC tap on udp://127.0.0.1:{OSC_TAP_PORT} -> SuperDirt {SUPERDIRT_HOST}:{SUPERDIRT_PORT}")
+        except OSError as e:
+            print(f"⚠️  OSC tap off: {e}")
+    if GHCI_MODE != 'pipe':
+        threading.Thread(target=follow_deliveries, name='deliveries', daemon=True).start()
+    
+    if AUTOSTART:
+        # Auto-start services on startup
+        print("🚀 Auto-starting services...")
+        time.sleep(1)
+        # Start services in the background so the API answers straight away
+        job = JOBS.submit('start', TidalServiceHandler.start_all_static)
+        print(f"✅ Startup running as job {job['id']}")
+        print("")
     
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n👋 Shutting down service...")
-        TidalServiceHandler.stop_all_static()
+        if AUTOSTART:
+            TidalServiceHandler.stop_all_static()
+        RECORDER.stop()
+        if TAP is not None:
+            TAP.stop()
         server.shutdown()
 
 if __name__ == "__main__":
@@ -0,0 +1,4 @@
+"""
+TidalCycles DJ Studio - backend building blocks
+Shared by tidal-service.py and monitor-commands.py
+"""
@@ -0,0 +1,299 @@
+"""
+Admission control for /command
+A bounded in-memory delivery queue in front of GHCi/the journal, plus a
+per-client token bucket. When GHCi or the monitor stalls, commands wait here
+(and go stale here) instead of piling up in the journal to be replayed later.
+"""
+
+import collections
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """The delivery queue is at its depth limit; retry_after is a hint in seconds"""
+
+    def __init__(self, depth, retry_after):
+        super().__init__(f'delivery queue full ({depth} waiting)')
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per client: `rate` commands/s sustained, bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None, max_clients=1024):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate * 2)
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets = OrderedDict()  # client -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def allow(self, client, cost=1):
+        """0.0 if the client may go ahead, else seconds until it may"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+                self.limited += 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def info(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst,
+                    'clients': len(self._buckets), 'limited': self.limited}
+
+
+class DeliveryQueue:
+    """Bounded FIFO drained by one thread, at most `window` commands in flight
+
+    `in_flight()` says how many delivered commands the far side hasn't
+    finished with yet (GHCi prompts outstanding, journal records the monitor
+    hasn't reported); while that is at `window` nothing more is sent. Entries
+    older than `ttl` seconds are expired rather than played late.
+    """
+
+    def __init__(self, deliver, in_flight=lambda: 0, max_depth=256, window=32, ttl=10.0,
+                 waits=None, on_expire=None, poll=0.05, name='delivery-queue'):
+        self.name = name
+        self.deliver = deliver  # deliver(entries) -> ok, called on the queue thread
+        self.in_flight = in_flight
+        self.max_depth = max_depth
+        self.window = window
+        self.ttl = ttl
+        self.waits = waits  # Histogram for time spent queued
+        self.on_expire = on_expire  # on_expire(entry) for each stale entry
+        self.poll = poll  # Re-check interval while the window is full
+        self.accepted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.delivered = 0
+        self.batches = 0
+        self.drain_rate = None  # entries/s, EWMA over batches
+        self._last_batch = None
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._settled = threading.Condition()
+        self._thread = None
+
+    def put(self, entries, force=False, together=False):
+        """Queue entries (dicts) in order; QueueFull if they don't fit, unless forced
+
+        together: deliver them as one batch even if that overshoots the window
+        (a whole set loaded at once is one journal commit, one GHCi input).
+        """
+        now = time.monotonic()
+        with self._cond:
+            if not force:
+                self._admit(entries, now)
+            self._append(entries, now, together)
+
+    def _admit(self, entries, now):
+        """QueueFull unless entries fit (caller holds _cond)"""
+        if len(self._queue) + len(entries) > self.max_depth:
+            self.rejected += len(entries)
+            raise QueueFull(len(self._queue), self._retry_after(now))
+
+    def _append(self, entries, now, together):
+        group = object() if together and len(entries) > 1 else None
+        for entry in entries:
+            entry['queued_at'] = now
+            if group is not None:
+                entry['group'] = group
+            self._queue.append(entry)
+        self.accepted += len(entries)
+        self._cond.notify()
+
+    def wait(self, entry, timeout):
+        """Block up to timeout for entry's outcome ('sent', 'failed', 'expired'); None if still queued"""
+        deadline = time.monotonic() + timeout
+        with self._settled:
+            while 'outcome' not in entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._settled.wait(remaining)
+            return entry['outcome']
+
+    def wake(self):
+        """Re-check in_flight() now (the far side reported progress)"""
+        with self._cond:
+            self._cond.notify()
+
+    def depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _retry_after(self, now):
+        """Seconds until there is likely room: drain estimate, capped by when the oldest entry expires"""
+        estimates = []
+        if self.drain_rate:
+            # A stalled consumer isn't draining at its old rate
+            rate = min(self.drain_rate, 1 / max(now - self._last_batch, 0.001))
+            estimates.append((len(self._queue) - self.max_depth + 1) / rate)
+        if self.ttl and self._queue:
+            estimates.append(self._queue[0]['queued_at'] + self.ttl - now)
+        return max(1, math.ceil(min(estimates))) if estimates else 1
+
+    def _expire(self, now):
+        expired = []
+        while self.ttl and self._queue and now - self._queue[0]['queued_at'] > self.ttl:
+            expired.append(self._queue.popleft())
+        self.expired += len(expired)
+        return expired
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                expired = self._expire(now)
+                batch = []
+                room = self.window - self.in_flight() if self._queue else 0
+                if room > 0:
+                    while self._queue and (len(batch) < room or self._continues(batch[-1])):
+                        entry = self._queue.popleft()
+                        if self.waits is not None:
+                            self.waits.record(now - entry['queued_at'])
+                        batch.append(entry)
+                elif not expired:
+                    self._cond.wait(self.poll if self._queue else None)
+                    continue
+            for entry in expired:
+                if self.on_expire:
+                    self.on_expire(entry)
+            if expired:
+                self._settle(expired, 'expired')
+            if batch:
+                try:
+                    ok = self.deliver(batch)
+                except Exception as e:
+                    print(f"   ⚠️  Queued delivery failed: {e}")
+                    ok = False
+                self._note_batch(len(batch))
+                self._settle(batch, 'sent' if ok else 'failed')
+
+    def _continues(self, entry):
+        """The next queued entry belongs to the same group as entry"""
+        group = entry.get('group')
+        return group is not None and self._queue[0].get('group') is group
+
+    def _note_batch(self, size):
+        now = time.monotonic()
+        with self._cond:
+            if self._last_batch is not None:
+                rate = size / max(now - self._last_batch, 0.001)
+                self.drain_rate = rate if self.drain_rate is None else self.drain_rate + 0.2 * (rate - self.drain_rate)
+            self._last_batch = now
+            self.delivered += size
+            self.batches += 1
+
+    def _settle(self, entries, outcome):
+        with self._settled:
+            for entry in entries:
+                entry['outcome'] = outcome
+            self._settled.notify_all()
+
+    def info(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'in_flight': self.in_flight(),
+                'window': self.window,
+                'ttl_seconds': self.ttl,
+                'oldest_wait_ms': round((now - self._queue[0]['queued_at']) * 1000, 3) if self._queue else None,
+                'drain_rate': round(self.drain_rate, 1) if self.drain_rate is not None else None,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'delivered': self.delivered,
+                'batches': self.batches,
+            }
+
+
+class QueueSet:
+    """DeliveryQueues side by side, one per consumer (GHCi deck); route(entry) says which one(s) an entry goes to
+
+    An entry routed to several queues is queued on each: the first gets the
+    entry itself (entry['shard'] = its index, and wait() follows it there),
+    the rest get copies marked 'mirror'. A put is all or nothing across the
+    queues it touches, so a batch is never half queued.
+    """
+
+    def __init__(self, queues, route):
+        self.queues = queues
+        self.route = route  # route(entry) -> [queue index, ...], first one primary
+        self.max_depth = min(queue.max_depth for queue in queues)
+
+    def put(self, entries, force=False, together=False):
+        now = time.monotonic()
+        parts = {}
+        for entry in entries:
+            for n, index in enumerate(self.route(entry)):
+                if n == 0:
+                    entry['shard'] = index
+                    parts.setdefault(index, []).append(entry)
+                else:
+                    parts.setdefault(index, []).append(dict(entry, shard=index, mirror=True))
+        # Always in index order, so two puts can't each hold a lock the other wants
+        queues = [(self.queues[index], parts[index]) for index in sorted(parts)]
+        for queue, _ in queues:
+            queue._cond.acquire()
+        try:
+            if not force:
+                for queue, part in queues:
+                    queue._admit(part, now)
+            for queue, part in queues:
+                queue._append(part, now, together)
+        finally:
+            for queue, _ in reversed(queues):
+                queue._cond.release()
+
+    def wait(self, entry, timeout):
+        return self.queues[entry.get('shard', 0)].wait(entry, timeout)
+
+    def wake(self):
+        for queue in self.queues:
+            queue.wake()
+
+    def depth(self):
+        return sum(queue.depth() for queue in self.queues)
+
+    def start(self):
+        for queue in self.queues:
+            queue.start()
+        return self
+
+    def info(self):
+        """Totals across the queues (as DeliveryQueue.info()), plus each queue's own in 'shards'"""
+        shards = [queue.info() for queue in self.queues]
+        total = {key: sum(shard[key] for shard in shards)
+                 for key in ('depth', 'max_depth', 'in_flight', 'window', 'accepted', 'rejected', 'expired',
+                             'delivered', 'batches')}
+        waits = [shard['oldest_wait_ms'] for shard in shards if shard['oldest_wait_ms'] is not None]
+        rates = [shard['drain_rate'] for shard in shards if shard['drain_rate'] is not None]
+        return dict(total,
+                    ttl_seconds=shards[0]['ttl_seconds'],
+                    oldest_wait_ms=max(waits) if waits else None,
+                    drain_rate=round(sum(rates), 1) if rates else None,
+                    shards=shards)
@@ -0,0 +1,199 @@
+"""
+Static asset cache for the control UI and the built dj-ui
+Small files are held in memory with gzip (and brotli, if installed) copies
+made once when the file is loaded, so a page load is a dict lookup and one
+write. Each hit stats the file and reloads it if its mtime or size changed.
+Files too big to hold go out with sendfile() straight from the page cache.
+"""
+
+import gzip
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import unquote
+
+try:
+    import brotli
+except ImportError:  # gzip only; brotli is optional
+    brotli = None
+
+HAVE_BROTLI = brotli is not None
+
+# Compressed copies are only made for these, and only when they come out smaller
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'application/manifest+json',
+                'application/wasm', 'application/xml', 'image/svg+xml')
+# Not worth compressing below this many bytes
+COMPRESS_MIN = 512
+
+# Content types mimetypes gets wrong or doesn't know on some platforms
+_TYPES = {'.js': 'text/javascript', '.mjs': 'text/javascript', '.json': 'application/json',
+          '.map': 'application/json', '.wasm': 'application/wasm', '.svg': 'image/svg+xml',
+          '.webmanifest': 'application/manifest+json', '.woff2': 'font/woff2', '.ico': 'image/x-icon'}
+
+
+def content_type(path):
+    kind = _TYPES.get(path.suffix.lower()) or mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    return f'{kind}; charset=utf-8' if kind.startswith('text/') else kind
+
+
+class Asset:
+    """One file: its validators and, if small enough, its bytes and compressed copies"""
+
+    def __init__(self, path, stat, body=None):
+        self.path = path
+        self.size = stat.st_size if body is None else len(body)
+        self.mtime_ns = stat.st_mtime_ns
+        self.content_type = content_type(path)
+        self.body = body  # None: too big to cache, send from disk
+        self.encoded = {}  # 'br' / 'gzip' -> compressed bytes
+        self.tag = f'{self.size:x}-{self.mtime_ns:x}'
+        if body is not None and len(body) >= COMPRESS_MIN and self.content_type.startswith(COMPRESSIBLE):
+            packed = gzip.compress(body, 9, mtime=0)
+            if len(packed) < len(body):
+                self.encoded['gzip'] = packed
+            if brotli is not None:
+                packed = brotli.compress(body, quality=11)
+                if len(packed) < len(body):
+                    self.encoded['br'] = packed
+
+    @property
+    def cost(self):
+        """Bytes of memory held for this asset"""
+        return len(self.body or b'') + sum(len(data) for data in self.encoded.values())
+
+    def etag(self, encoding=None):
+        # Strong validators: each representation gets its own
+        return f'"{self.tag}-{encoding}"' if encoding else f'"{self.tag}"'
+
+    def matches(self, if_none_match):
+        """If-None-Match holds any representation of this version (weak comparison)"""
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or any(self.etag(encoding) in tags for encoding in (None, 'gzip', 'br'))
+
+    def choose_encoding(self, accept_encoding):
+        """Best stored encoding the client accepts (None = send as is)"""
+        if not self.encoded or not accept_encoding:
+            return None
+        accepted = {}
+        for part in accept_encoding.split(','):
+            name, _, params = part.strip().partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encoded and accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+                return encoding
+        return None
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single `bytes=` range; None to ignore it (ValueError if unsatisfiable)"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None  # Other units and multipart ranges: send the whole file
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if (start is None and end is None) or (start or 0) < 0 or (end or 0) < 0:
+        return None
+    if start is None:
+        # Suffix range: the last `end` bytes
+        if end == 0 or size == 0:
+            raise ValueError('empty suffix range')
+        return max(0, size - end), size - 1
+    if end is not None and start > end:
+        return None
+    if start >= size:
+        raise ValueError(f'range starts past the end ({size} bytes)')
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def resolve(root, url_path):
+    """File under root for a URL path (`/edit` also finds edit.html and edit/index.html), or None"""
+    root = Path(root).resolve()
+    relative = unquote(url_path).lstrip('/')
+    if '\0' in relative:
+        return None
+    base = (root / relative).resolve()
+    candidates = [base / 'index.html'] if base == root or relative.endswith('/') else [
+        base, base.with_name(base.name + '.html'), base / 'index.html']
+    for candidate in candidates:
+        if candidate.is_file() and candidate.is_relative_to(root):
+            return candidate
+    return None
+
+
+class AssetCache:
+    """Path -> Asset, LRU within max_bytes; files over max_file_size are never held in memory"""
+
+    def __init__(self, max_bytes=32 << 20, max_file_size=1 << 20):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self._assets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Current Asset for path (reloaded if the file changed), or None if it doesn't exist"""
+        path = Path(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._forget(path)
+            return None
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.mtime_ns == stat.st_mtime_ns and asset.size == stat.st_size:
+                self._assets.move_to_end(path)
+                self.hits += 1
+                return asset
+        asset = self._load(path, stat)
+        with self._lock:
+            self.loads += 1
+            old = self._assets.pop(path, None)
+            if old is not None:
+                self.bytes -= old.cost
+            if asset.cost <= self.max_bytes:
+                self._assets[path] = asset
+                self.bytes += asset.cost
+                while self.bytes > self.max_bytes:
+                    _, evicted = self._assets.popitem(last=False)
+                    self.bytes -= evicted.cost
+        return asset
+
+    def _load(self, path, stat):
+        if stat.st_size > self.max_file_size:
+            return Asset(path, stat)
+        with open(path, 'rb') as f:
+            body = f.read()
+        return Asset(path, stat, body)
+
+    def _forget(self, path):
+        with self._lock:
+            old = self._assets.pop(path, None)
+            if old is not None:
+                self.bytes -= old.cost
+
+    def info(self):
+        with self._lock:
+            return {'files': len(self._assets),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes,
+                    'max_file_size': self.max_file_size,
+                    'hits': self.hits,
+                    'loads': self.loads,
+                    'brotli': HAVE_BROTLI}
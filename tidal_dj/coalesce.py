@@ -0,0 +1,185 @@
+"""
+Last-write-wins coalescing of same-target updates
+A slider drag fires dozens of `d1 $ ... # gain 0.73` per second; only the
+newest one per target matters. Targets are a channel (d1), the tempo, a
+named state value (setF "name") or `all`.
+
+Updates aren't keyed by (orbit, param): a `dN $ ...` line replaces the
+channel's whole pattern, so `d1 $ ... # gain 0.7` and `d2 $ ... # gain 0.7`
+on the same orbit don't overwrite each other - only a later line for the
+same channel does. Per-parameter control goes through setF "name" state.
+"""
+
+import heapq
+import re
+import threading
+import time
+
+# Seconds between deliveries to the same target, by kind of target
+DEFAULT_WINDOWS = {
+    'channel': 0.05,
+    'tempo': 0.1,
+    'state': 0.05,
+    'all': 0.05,
+}
+
+_CHANNEL = re.compile(r'^\s*(d\d+)(?![\w\'])')
+_TEMPO = re.compile(r'^\s*setcps\b')
+_STATE = re.compile(r'^\s*set[FISBR]\s+"([^"]+)"')
+_ALL = re.compile(r'^\s*all\s*\$')
+_HUSH = re.compile(r'^\s*hush\s*$')
+
+
+def command_key(command):
+    """(kind, target) a command overwrites, or None if it isn't a plain update"""
+    if '\n' in command.strip():
+        return None  # Multi-line blocks may do anything
+    match = _CHANNEL.match(command)
+    if match:
+        return ('channel', match.group(1))
+    if _TEMPO.match(command):
+        return ('tempo', 'cps')
+    match = _STATE.match(command)
+    if match:
+        return ('state', match.group(1))
+    if _ALL.match(command):
+        return ('all', 'all')
+    return None
+
+
+def latest_per_key(items, key=lambda item: command_key(item)):
+    """Split items into (kept, superseded): for each key only the last item survives, in place"""
+    last = {}
+    for index, item in enumerate(items):
+        k = key(item)
+        if k is not None:
+            last[k] = index
+    kept = []
+    superseded = []
+    for index, item in enumerate(items):
+        k = key(item)
+        if k is None or last[k] == index:
+            kept.append(item)
+        else:
+            superseded.append(item)
+    return kept, superseded
+
+
+def behind_held(held, entries, key=lambda entry: command_key(entry['command'])):
+    """Split held updates that entries are about to be queued behind into (send first, superseded)
+
+    A held update must not land after a later command: it goes out first,
+    unless that command replaces it (same target) or hushes everything.
+    """
+    if any(_HUSH.match(entry['command']) for entry in entries):
+        return [], list(held)
+    keys = {key(entry) for entry in entries} - {None}
+    first = [entry for entry in held if key(entry) not in keys]
+    superseded = [entry for entry in held if key(entry) in keys]
+    return first, superseded
+
+
+class Coalescer:
+    """Per-target throttle with last-write-wins
+
+    The first update to an idle target goes straight through. Updates that
+    follow within the target's window are held; each new one replaces (drops)
+    the one being held, and the survivor is delivered when the window closes.
+    """
+
+    def __init__(self, deliver, windows=None, on_drop=None):
+        self.deliver = deliver  # deliver(entries), called on the coalescer thread
+        self.on_drop = on_drop  # on_drop(entry) for each superseded entry
+        self.windows = dict(DEFAULT_WINDOWS, **(windows or {}))
+        self.held = 0
+        self.dropped = 0
+        self.dropped_by_target = {}
+        self._slots = {}  # key -> {'last_sent': t, 'pending': entry or None, 'due': t}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()  # Held updates go out under it, so nothing queued overtakes them
+        self._thread = None
+
+    def window(self, key):
+        return self.windows.get(key[0], 0.0)
+
+    def submit(self, key, entry):
+        """'send' if the caller should deliver entry now, else 'held'"""
+        window = self.window(key)
+        now = time.monotonic()
+        dropped = None
+        with self._cond:
+            slot = self._slots.get(key)
+            if slot is None or (slot['pending'] is None and now - slot['last_sent'] >= window):
+                self._slots[key] = {'last_sent': now, 'pending': None, 'due': None}
+                return 'send'
+            if slot['pending'] is not None:
+                dropped = slot['pending']
+                self.dropped += 1
+                self.dropped_by_target[key[1]] = self.dropped_by_target.get(key[1], 0) + 1
+            else:
+                slot['due'] = slot['last_sent'] + window
+                heapq.heappush(self._heap, (slot['due'], key))
+                self._cond.notify()
+            slot['pending'] = entry
+            self.held += 1
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+        return 'held'
+
+    def take_before(self, covers, send):
+        """Take the held updates covers(entry) picks out of their slots and return send(taken)
+
+        send queues them (or not) together with whatever must come after
+        them; it runs in order with this coalescer's own releases, so none
+        of them is released later behind it.
+        """
+        with self._send_lock:
+            now = time.monotonic()
+            taken = []
+            with self._cond:
+                for slot in self._slots.values():
+                    if slot['pending'] is not None and covers(slot['pending']):
+                        taken.append(slot['pending'])
+                        slot['pending'] = None
+                        slot['last_sent'] = now
+            return send(taken)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='coalescer', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+            with self._send_lock:
+                with self._cond:
+                    now = time.monotonic()
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now:
+                        _, key = heapq.heappop(self._heap)
+                        slot = self._slots[key]
+                        if slot['pending'] is not None:
+                            batch.append(slot['pending'])
+                            slot['pending'] = None
+                            slot['last_sent'] = now
+                if not batch:
+                    continue
+                try:
+                    self.deliver(batch)
+                except Exception as e:
+                    print(f"   ⚠️  Coalesced delivery failed: {e}")
+
+    def info(self):
+        with self._cond:
+            return {
+                'windows_ms': {kind: round(window * 1000, 3) for kind, window in self.windows.items()},
+                'pending': sum(1 for slot in self._slots.values() if slot['pending'] is not None),
+                'held': self.held,
+                'dropped': self.dropped,
+                'dropped_by_target': dict(self.dropped_by_target),
+            }
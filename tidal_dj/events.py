@@ -0,0 +1,96 @@
+"""
+Server-Sent Events hub
+One probe loop feeds every connected UI; only changed status keys are pushed
+"""
+
+import collections
+import itertools
+import json
+import threading
+
+
+class Subscriber:
+    """Per-connection event buffer; falls back to a full resync if the client lags"""
+
+    def __init__(self, max_pending=256):
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        self.resync = False
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def push(self, item):
+        with self._cond:
+            if len(self.pending) >= self.max_pending:
+                # Too far behind for deltas to make sense - start again from a snapshot
+                self.pending.clear()
+                self.resync = True
+            self.pending.append(item)
+            self._cond.notify()
+
+    def next(self, timeout):
+        """Wait for the next (id, event, data); None on timeout, 'resync' if we lagged"""
+        with self._cond:
+            if not self.pending and not self.resync and not self.closed:
+                self._cond.wait(timeout)
+            if self.resync:
+                self.resync = False
+                return 'resync'
+            if self.pending:
+                return self.pending.popleft()
+            return None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class EventHub:
+    """Fan-out of status deltas, command results and job updates"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.status = {}
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data):
+        item = (next(self._ids), event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.push(item)
+
+    def update_status(self, status):
+        """Publish only the keys that changed since the last status"""
+        with self._lock:
+            delta = {key: value for key, value in status.items() if self.status.get(key) != value}
+            if not delta:
+                return
+            self.status = dict(status)
+        self.publish('status', delta)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.status)
+
+
+def format_event(event_id, event, data):
+    """Encode one SSE frame"""
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
@@ -0,0 +1,347 @@
+"""
+Supervised GHCi session
+The service owns the GHCi process and writes commands straight to its stdin pipe.
+Each input is answered by exactly one prompt, so the output printed before that
+prompt - compile errors included - belongs to that input.
+"""
+
+import collections
+import re
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+from tidal_dj.output import OutputRing, read_lines
+
+# Unique prompt so prompts can be told apart from pattern output
+PROMPT_MARKER = '<<tidal-ready>>'
+# Marker prompts answered during start(): one per :set line
+BOOT_PROMPTS = 2
+# Output lines kept per answered input
+RESULT_LINES = 50
+
+_ERROR = re.compile(r'^<interactive>:\(?(\d+)[\d:(),-]*:\s*error\b:?\s*(?:\[[\w-]+\])?\s*(.*)$')
+_EXCEPTION = re.compile(r'^\*\*\* Exception:\s*(.*)$')
+# GHC 8.2+ quotes the offending source under the message: `12 |   d1 $ s "bd`
+_SOURCE = re.compile(r'^\s*(\d+)\s*\|\s?(.*)$')
+_GUTTER = re.compile(r'^\s*\|')
+
+
+def parse_result(lines):
+    """What GHCi made of one input: {'status': 'ok' | 'error', 'error': message or None, 'output': lines}
+
+    Compile errors also come as 'errors': [{'line', 'source', 'message'}], one
+    per error GHCi reported - the input line it points at and that line's text.
+    """
+    errors = []
+    exception = None
+    for index, line in enumerate(lines):
+        match = _ERROR.match(line)
+        if not match:
+            if exception is None and not errors:
+                found = _EXCEPTION.match(line)
+                exception = found.group(1).strip() if found else None
+            continue
+        # GHC puts the message on the indented lines that follow the header, then the source excerpt
+        parts = [match.group(2).strip()]
+        source = None
+        for follow in lines[index + 1:index + 8]:
+            if not follow[:1].isspace():
+                break
+            quoted = _SOURCE.match(follow)
+            if quoted:
+                source = quoted.group(2)
+                break
+            if not _GUTTER.match(follow) and len(parts) < 4:
+                parts.append(follow.strip().lstrip('• '))
+        message = ' '.join(part for part in parts if part)[:300] or 'error'
+        errors.append({'line': int(match.group(1)), 'source': source, 'message': message})
+    if errors:
+        return {'status': 'error', 'error': errors[0]['message'], 'errors': errors, 'output': lines}
+    if exception is not None:
+        return {'status': 'error', 'error': exception[:300] or 'error', 'output': lines}
+    return {'status': 'ok', 'error': None, 'output': lines}
+
+
+class GhciSession:
+    """GHCi (or a stub REPL) running headless on pipes"""
+
+    def __init__(self, command, boot_script=None, cwd=None, history=500, setup=()):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.boot_script = boot_script
+        self.setup = list(setup)  # Lines evaluated after BootTidal, before the session counts as ready
+        self.cwd = cwd
+        self.process = None
+        self.output = OutputRing(history)
+        self.errors = 0
+        self.prompts = 0
+        self.sent = 0
+        self.started_at = None
+        self.ready_at = None
+        self.last_prompt_at = None
+        self._write_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._reader = None
+        self._waiting = collections.deque()  # (on_result or None, first input line) per unanswered send
+        self._line = 0  # Input lines written since start - GHCi numbers `<interactive>:N:` errors by them
+        self._current = []  # Output since the last prompt
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_ready(self):
+        return self.is_alive() and self.ready_at is not None
+
+    def start(self, timeout=60.0):
+        """Launch the REPL, load BootTidal and wait for the first prompt"""
+        if self.is_alive():
+            return 'already_running'
+        self.process = subprocess.Popen(self.command,
+                                        cwd=self.cwd,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        bufsize=0,
+                                        start_new_session=True)
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        self.last_prompt_at = None
+        with self._cond:
+            self.prompts = 0
+            self.sent = 0
+            self._waiting.clear()
+            self._current = []
+            self._line = 0
+        self._reader = threading.Thread(target=self._read_output, name='ghci-reader', daemon=True)
+        self._reader.start()
+
+        boot = []
+        if self.boot_script:
+            boot.append(f':script {self.boot_script}')
+        boot.extend(self.setup)
+        # After :script - BootTidal sets its own "tidal> " prompt
+        boot.append(f':set prompt "{PROMPT_MARKER}\\n"')
+        boot.append(':set prompt-cont ""')
+        self._write(''.join(line + '\n' for line in boot))
+        self._line = len(boot)  # :script runs with its own numbering, then GHCi's carries on
+        # Both :set lines are answered with our marker prompt
+        if not self.wait_for_prompts(BOOT_PROMPTS, timeout):
+            return 'started' if self.is_alive() else 'error'
+        self.ready_at = time.monotonic()
+        return 'started'
+
+    def stop(self, timeout=3.0):
+        """Ask GHCi to quit, then terminate it if it doesn't"""
+        if not self.is_alive():
+            return 'not_running'
+        try:
+            self._write(':quit\n')
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            # GHCi runs in its own process group - take down anything it spawned too
+            self._signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._signal(signal.SIGKILL)
+                self.process.wait()
+        self.ready_at = None
+        return 'stopped'
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def send(self, command, on_result=None):
+        """Write one input to GHCi's stdin; returns True if it was delivered
+
+        on_result(result) is called with parse_result() of the output GHCi
+        prints before answering it - or {'status': 'lost'} if GHCi exits first.
+        The result's 'first_line' is the input line number command started on.
+        """
+        if not self.is_alive():
+            return False
+        payload = command.rstrip('\n') + '\n'
+        with self._write_lock:
+            # Registered before writing: the answer can arrive before write() returns
+            with self._cond:
+                self._waiting.append((on_result, self._line + 1))
+                self.sent += 1
+            try:
+                self._write(payload)
+                self._line += payload.count('\n')
+                return True
+            except OSError as e:
+                with self._cond:
+                    self._waiting.pop()
+                    self.sent -= 1
+                print(f"   ❌ GHCi pipe error: {e}")
+                return False
+
+    def wait_for_prompts(self, count, timeout=None):
+        """Block until `count` prompts have been seen since start"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.prompts < count:
+                if not self.is_alive():
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+            return True
+
+    def unanswered(self):
+        """Sends GHCi hasn't answered with a prompt yet (each send - line or :{ :} block - gets one)"""
+        if not self.is_ready():
+            return 0
+        with self._cond:
+            return max(0, self.sent - (self.prompts - BOOT_PROMPTS))
+
+    def stalled(self, seconds):
+        """True if sends have gone unanswered and GHCi hasn't prompted for `seconds`"""
+        if not self.unanswered():
+            return False
+        last = self.last_prompt_at or self.ready_at
+        return last is not None and time.monotonic() - last > seconds
+
+    def recent_output(self, limit=50):
+        return self.output.tail(limit)
+
+    def info(self):
+        return {
+            'running': self.is_alive(),
+            'ready': self.is_ready(),
+            'pid': self.process.pid if self.process else None,
+            'command': ' '.join(self.command),
+            'sent': self.sent,
+            'prompts': self.prompts,
+            'unanswered': self.unanswered(),
+            'errors': self.errors,
+            'output': self.output.info(),
+            'startup_seconds': (round(self.ready_at - self.started_at, 3)
+                                if self.ready_at and self.started_at else None),
+        }
+
+    def _write(self, data):
+        self.process.stdin.write(data.encode('utf-8'))
+        self.process.stdin.flush()
+
+    def _read_output(self):
+        for line in read_lines(self.process.stdout.fileno()):
+            self._handle_line(line)
+        with self._cond:
+            waiting = list(self._waiting)
+            self._waiting.clear()
+            self._cond.notify_all()
+        for on_result, _ in waiting:
+            if on_result:
+                on_result({'status': 'lost', 'error': 'GHCi exited before answering', 'output': []})
+
+    def _handle_line(self, line):
+        # Prompts can share a line with output that had no trailing newline
+        prompt = line.endswith(PROMPT_MARKER)
+        if prompt:
+            line = line[:-len(PROMPT_MARKER)]
+        if line.strip():
+            self.output.append(line)
+            if len(self._current) < RESULT_LINES:
+                self._current.append(line)
+        if not prompt:
+            return
+        on_result = None
+        with self._cond:
+            self.prompts += 1
+            self.last_prompt_at = time.monotonic()
+            lines, self._current = self._current, []
+            answered = self.prompts > BOOT_PROMPTS and bool(self._waiting)
+            if answered:
+                on_result, first_line = self._waiting.popleft()
+            self._cond.notify_all()
+        if answered:
+            result = dict(parse_result(lines), first_line=first_line)
+            if result['status'] == 'error':
+                self.errors += 1
+            if on_result:
+                on_result(result)
+
+
+def failed_lines(result, lines):
+    """{index: message} for the lines of one plan_batches() input that GHCi's compile errors point at
+
+    lines are the input's original lines; in a `:{ do ... :}` block only the
+    ones GHCi complained about failed, and none of them ran. None if an error
+    can't be pinned on a line (a runtime exception, or numbering we can't follow).
+    """
+    errors = result.get('errors')
+    if not errors:
+        return None
+    if len(lines) == 1:
+        return {0: result['error']}
+    # Input line numbers of each original line: `:{` and `do` come first
+    spans = []
+    number = result.get('first_line', 0) + 2
+    for line in lines:
+        height = line.count('\n') + 1
+        spans.append((number, number + height))
+        number += height
+    failed = {}
+    for error in errors:
+        index = None
+        if error['source'] is not None:
+            # The quoted source is exact, whatever the numbering
+            text = error['source'].strip()
+            matches = [i for i, line in enumerate(lines)
+                       if text and any(part.strip() == text for part in line.split('\n'))]
+            index = matches[0] if len(matches) == 1 else None
+        if index is None and result.get('first_line'):
+            index = next((i for i, (low, high) in enumerate(spans) if low <= error['line'] < high), None)
+        if index is None:
+            return None
+        failed.setdefault(index, error['message'])
+    return failed
+
+
+# Lines that can't live inside a `do` block: GHCi commands, imports, definitions
+_STANDALONE = re.compile(r"^(:|import\s|let\s|data\s|type\s|newtype\s|instance\s|class\s|[a-z_][\w']*(\s+[\w']+)*\s*(::|=(?![=>])))")
+
+
+def is_statement(line):
+    """True if the line is a plain IO statement (d1 $ ..., hush, once $ ...)"""
+    return bool(line.strip()) and not _STANDALONE.match(line.strip())
+
+
+def plan_batches(lines):
+    """Group lines into as few GHCi inputs as possible
+
+    Runs of plain statements become one `:{ do ... :}` block so a whole set
+    lands in the same evaluation; everything else goes through on its own.
+    A "line" may be a multi-line block (continuation lines indented, as in
+    a .tidal file); GHCi only takes those inside `:{ :}`.
+    Returns (payload, original_lines) pairs in delivery order.
+    """
+    batches = []
+    run = []
+
+    def flush():
+        if len(run) == 1 and '\n' not in run[0]:
+            batches.append((run[0], list(run)))
+        elif run:
+            body = '\n'.join('  ' + line.replace('\n', '\n  ') for line in run)
+            batches.append((f':{{\ndo\n{body}\n:}}', list(run)))
+        del run[:]
+
+    for line in lines:
+        if is_statement(line):
+            run.append(line)
+        else:
+            flush()
+            multi_line = '\n' in line.strip() and not line.lstrip().startswith(':{')
+            batches.append((f':{{\n{line}\n:}}' if multi_line else line, [line]))
+    flush()
+    return batches
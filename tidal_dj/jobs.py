@@ -0,0 +1,103 @@
+"""
+Background jobs for long lifecycle operations (/start, /stop, /restart)
+Jobs run one at a time on their own worker so HTTP threads never wait on them
+"""
+
+import itertools
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+class JobManager:
+    """Serial background job runner with pollable job records"""
+
+    def __init__(self, history=50):
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._thread = None
+        self.listeners = []
+
+    def submit(self, name, func, *args, **kwargs):
+        """Queue func to run in the background; returns the job record"""
+        job_id = f'{name}-{next(self._ids)}'
+        job = {
+            'id': job_id,
+            'name': name,
+            'state': 'queued',
+            'result': None,
+            'error': None,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+        }
+        with self._lock:
+            # Same operation already waiting - hand back that job instead of queueing twice
+            for existing in self._jobs.values():
+                if existing['name'] == name and existing['state'] == 'queued':
+                    return dict(existing)
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.history:
+                oldest = next(iter(self._jobs))
+                if self._jobs[oldest]['state'] in ('queued', 'running'):
+                    break
+                self._jobs.popitem(last=False)
+        self._ensure_worker()
+        self._queue.put((job_id, func, args, kwargs))
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes (or timeout); returns the job record"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['state'] in ('done', 'failed'):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(0.05)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='job-worker', daemon=True)
+                self._thread.start()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            snapshot = dict(job)
+        for listener in list(self.listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"   ⚠️  Job listener error: {e}")
+        return snapshot
+
+    def _run(self):
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            self._update(job_id, state='running', started=time.time())
+            try:
+                result = func(*args, **kwargs)
+                self._update(job_id, state='done', result=result, finished=time.time())
+            except Exception as e:
+                traceback.print_exc()
+                self._update(job_id, state='failed', error=str(e), finished=time.time())
@@ -0,0 +1,355 @@
+"""
+Sequenced command journal
+The service appends with group commit (one fsync per burst), the monitor reads
+from a persistent cursor so it resumes exactly where it stopped.
+
+Layout: <dir>/<first seq, 20 digits>.log segments of "seq<TAB>time<TAB>json command" lines,
+plus <dir>/cursor holding the last seq the consumer delivered.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from tidal_dj.watcher import FileTailer
+
+SEGMENT_SUFFIX = '.log'
+CURSOR_NAME = 'cursor'
+
+_sync = getattr(os, 'fdatasync', os.fsync)
+
+
+def segment_name(first_seq):
+    return f'{first_seq:020d}{SEGMENT_SUFFIX}'
+
+
+def list_segments(directory):
+    """(first_seq, path) for every segment, oldest first"""
+    segments = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return segments
+    for name in names:
+        stem = name[:-len(SEGMENT_SUFFIX)]
+        if name.endswith(SEGMENT_SUFFIX) and stem.isdigit():
+            segments.append((int(stem), Path(directory) / name))
+    segments.sort()
+    return segments
+
+
+def parse_record(line):
+    """(seq, time, command) from one journal line, or None if it's damaged"""
+    try:
+        seq, at, payload = line.split('\t', 2)
+        return int(seq), float(at), json.loads(payload)
+    except ValueError:
+        return None
+
+
+def read_cursor(directory):
+    try:
+        return int((Path(directory) / CURSOR_NAME).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def write_cursor(directory, seq):
+    """Atomically persist the consumer cursor"""
+    path = Path(directory) / CURSOR_NAME
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        f.write(f'{seq}\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class CommandJournal:
+    """Append side: sequence numbers, group commit, segment rotation and compaction"""
+
+    def __init__(self, directory, segment_bytes=1 << 20, keep_consumed=1, max_segments=64, sync=True):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.keep_consumed = keep_consumed
+        self.max_segments = max_segments
+        self.sync = sync
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending = []  # Units ({'first', 'lines', 'done', 'error'}) waiting for the next flush
+        self._flushing = False
+        self.durable_seq = 0
+        self.commits = 0
+        self.records = 0
+
+        self._fd = None
+        self._segment_size = 0
+        self.next_seq = self._recover() + 1
+        self.durable_seq = self.next_seq - 1
+        # How far the consumer has got, as far as we've heard (cursor, delivery reports)
+        cursor = read_cursor(self.directory)
+        self.consumed_seq = self.durable_seq if cursor is None else min(cursor, self.durable_seq)
+
+    def _recover(self):
+        """Find the last durable seq and drop a torn final line from a crash"""
+        last_seq = read_cursor(self.directory) or 0
+        segments = list_segments(self.directory)
+        if not segments:
+            return last_seq
+        first_seq, path = segments[-1]
+        with open(path, 'rb') as f:
+            data = f.read()
+        good = data.rfind(b'\n') + 1
+        if good < len(data):
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+        for line in reversed(data[:good].decode('utf-8', errors='replace').splitlines()):
+            record = parse_record(line)
+            if record:
+                return max(last_seq, record[0])
+        return max(last_seq, first_seq - 1)
+
+    def _open_segment(self, first_seq):
+        rotating = self._fd is not None
+        if rotating:
+            os.close(self._fd)
+            self._fd = None
+        segments = list_segments(self.directory)
+        if segments and not rotating and segments[-1][1].stat().st_size < self.segment_bytes:
+            # Reopen the newest segment after a restart instead of starting a tiny new one
+            path = segments[-1][1]
+        else:
+            path = self.directory / segment_name(first_seq)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._segment_size = os.fstat(self._fd).st_size
+
+    def append(self, command):
+        """Durably append one command; returns its sequence number"""
+        return self.append_many([command])[0]
+
+    def append_many(self, commands):
+        """Durably append commands as one unit; returns their sequence numbers (OSError if they weren't written)"""
+        if not commands:
+            return []
+        with self._cond:
+            first = self.next_seq
+            now = time.time()
+            lines = []
+            for command in commands:
+                lines.append(f'{self.next_seq}\t{now:.6f}\t{json.dumps(command)}\n')
+                self.next_seq += 1
+            unit = {'first': first, 'lines': lines, 'done': False, 'error': None}
+            self._pending.append(unit)
+            # Group commit: whoever finds no flush in progress writes everyone's records,
+            # then hands each unit its own outcome - a later flush can't vouch for this one
+            while not unit['done']:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                batch, self._pending = self._pending, []
+                self._flushing = True
+                self._cond.release()
+                written = False
+                error = None
+                try:
+                    self._write_batch([line for pending in batch for line in pending['lines']], batch[0]['first'])
+                    written = True
+                except OSError as e:
+                    error = e  # Everyone in this batch gets the error; seqs are never reused
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    for pending in batch:
+                        pending['done'] = True
+                        pending['error'] = None if written else (error or 'write interrupted')
+                    if written:
+                        last = batch[-1]
+                        self.durable_seq = last['first'] + len(last['lines']) - 1
+                        self.commits += 1
+                        self.records += sum(len(pending['lines']) for pending in batch)
+                    self._cond.notify_all()
+            if unit['error'] is not None:
+                raise OSError(f'journal write failed: {unit["error"]}')
+            return list(range(first, first + len(lines)))
+
+    def _write_batch(self, lines, first_seq):
+        if self._fd is None or self._segment_size >= self.segment_bytes:
+            self._open_segment(first_seq)
+            self.compact()
+        data = ''.join(lines).encode('utf-8')
+        os.write(self._fd, data)
+        self._segment_size += len(data)
+        if self.sync:
+            _sync(self._fd)
+
+    def compact(self):
+        """Delete segments the consumer has fully delivered (keeping a little history)"""
+        cursor = read_cursor(self.directory) or 0
+        segments = list_segments(self.directory)
+        consumed = []
+        for (first_seq, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 <= cursor:
+                consumed.append(path)
+        removable = consumed[:max(0, len(consumed) - self.keep_consumed)]
+        # Hard cap so a consumer that never comes back can't fill the disk
+        overflow = len(segments) - len(removable) - self.max_segments
+        if overflow > 0:
+            removable += [path for _, path in segments[:-1] if path not in removable][:overflow]
+        for path in removable:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        return len(removable)
+
+    def note_consumed(self, seq):
+        """The consumer has finished with everything up to seq"""
+        if seq is not None and seq > self.consumed_seq:
+            self.consumed_seq = seq
+
+    def backlog(self):
+        """Durable records the consumer hasn't finished with yet"""
+        return max(0, self.durable_seq - self.consumed_seq)
+
+    def info(self):
+        return {
+            'directory': str(self.directory),
+            'last_seq': self.durable_seq,
+            'cursor': read_cursor(self.directory),
+            'backlog': self.backlog(),
+            'segments': len(list_segments(self.directory)),
+            'records': self.records,
+            'commits': self.commits,
+        }
+
+    def close(self):
+        with self._cond:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class JournalReader:
+    """Consumer side: reads records after the cursor, following segment rotation"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        cursor = read_cursor(self.directory)
+        if cursor is None:
+            # First run: don't replay history, start from what's there now
+            cursor = self._last_seq_on_disk()
+            write_cursor(self.directory, cursor)
+        self.cursor = cursor
+        self.read_seq = cursor
+        self._tailer = None
+        self._segment_first = None
+
+    def _last_seq_on_disk(self):
+        last = 0
+        for _, path in list_segments(self.directory):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    record = parse_record(line.rstrip('\n'))
+                    if record and line.endswith('\n'):
+                        last = max(last, record[0])
+        return last
+
+    def _segment_for(self, seq):
+        """The segment that holds seq (the last one starting at or before it)"""
+        chosen = None
+        for first_seq, path in list_segments(self.directory):
+            if first_seq <= seq:
+                chosen = (first_seq, path)
+            elif chosen is None:
+                chosen = (first_seq, path)  # Older segments were compacted away
+                break
+            else:
+                break
+        return chosen
+
+    def read_records(self):
+        """New complete records since the last call, as (seq, time, command)"""
+        records = []
+        while True:
+            if self._tailer is None:
+                found = self._segment_for(self.read_seq + 1)
+                if found is None:
+                    return records
+                self._segment_first, path = found
+                self._tailer = FileTailer(path, from_end=False)
+            for line in self._tailer.read_lines():
+                record = parse_record(line)
+                if record and record[0] > self.read_seq:
+                    records.append(record)
+                    self.read_seq = record[0]
+            # Move on only once a newer segment exists (the writer has rotated past us)
+            later = [first for first, _ in list_segments(self.directory) if first > self._segment_first]
+            if not later:
+                return records
+            # Anything written to this segment before the rotation is on disk by now
+            for line in self._tailer.read_lines():
+                record = parse_record(line)
+                if record and record[0] > self.read_seq:
+                    records.append(record)
+                    self.read_seq = record[0]
+            self._tailer.close()
+            self._tailer = None
+
+    def commit(self, seq):
+        """Record that everything up to seq has been delivered"""
+        if seq > self.cursor:
+            write_cursor(self.directory, seq)
+            self.cursor = seq
+
+    def close(self):
+        if self._tailer is not None:
+            self._tailer.close()
+            self._tailer = None
+
+
+DELIVERIES_NAME = 'deliveries.tsv'
+
+
+# Delivery report outcomes: ok, failed, skipped for a newer update to the same target,
+# or skipped because it was older than the TTL when picked up
+OUTCOMES = {True: '1', False: '0', 'superseded': 's', 'expired': 'x'}
+
+
+class DeliveryLog:
+    """Monitor -> service delivery reports: seq, pickup, start, done, outcome
+
+    Telemetry only, so no fsync; rotated by rename so a reader following
+    it with FileTailer drains the old file before switching.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 20):
+        self.path = Path(directory) / DELIVERIES_NAME
+        self.max_bytes = max_bytes
+
+    def record(self, entries):
+        """entries: (seq, picked_up, delivery_started, delivered, ok) tuples; ok is a key of OUTCOMES"""
+        if not entries:
+            return
+        data = ''.join(f'{seq}\t{pickup:.6f}\t{start:.6f}\t{done:.6f}\t{OUTCOMES[ok]}\n'
+                       for seq, pickup, start, done, ok in entries)
+        try:
+            if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                os.replace(self.path, self.path.with_name(DELIVERIES_NAME + '.1'))
+            with open(self.path, 'a') as f:
+                f.write(data)
+        except OSError as e:
+            print(f"   ⚠️  Could not write delivery report: {e}")
+
+
+def parse_delivery(line):
+    """(seq, picked_up, delivery_started, delivered, ok) or None; ok is 'superseded'/'expired' if skipped"""
+    try:
+        seq, pickup, start, done, outcome = line.split('\t')
+        ok = {code: ok for ok, code in OUTCOMES.items()}[outcome.strip()]
+        return int(seq), float(pickup), float(start), float(done), ok
+    except (ValueError, KeyError):
+        return None
@@ -0,0 +1,283 @@
+"""
+Latency histograms, counters and per-command traces
+Exposed by the service at /metrics (Prometheus text format) and /trace/<id>
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# HDR-style log-linear buckets: 2**SUB_BITS sub-buckets per power of two (~3% precision)
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+BUCKETS = 1024
+# Histogram shards; threads share them by thread id
+SHARDS = 8
+
+# Cumulative "le" bounds (seconds) exported to Prometheus
+EXPORT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGES = (
+    ('hold', 'scheduled', 'received'),
+    ('wait', 'queued', 'received'),
+    ('journal', 'received', 'journaled'),
+    ('pickup', 'journaled', 'picked_up'),
+    ('queue', 'picked_up', 'delivery_started'),
+    ('delivery', 'delivery_started', 'delivered'),
+    ('end_to_end', 'received', 'delivered'),
+    ('total', 'queued', 'delivered'),
+    ('evaluation', 'delivered', 'evaluated'),
+)
+
+# Statuses that end a command's trace; only these are counted
+FINAL_STATUSES = ('delivered', 'failed', 'dropped', 'rejected')
+
+
+def bucket_index(micros):
+    if micros < SUB_COUNT:
+        return max(0, micros)
+    shift = micros.bit_length() - SUB_BITS
+    return min(BUCKETS - 1, shift * HALF_COUNT + (micros >> shift))
+
+
+def bucket_upper(index):
+    """Largest value (in microseconds) that lands in bucket index"""
+    if index < SUB_COUNT:
+        return index
+    shift = (index - HALF_COUNT) // HALF_COUNT
+    sub = index - shift * HALF_COUNT
+    return ((sub + 1) << shift) - 1
+
+
+class Histogram:
+    """Log-linear latency histogram with a fixed set of locked shards
+
+    Threads are spread over SHARDS shards by thread id, so concurrent
+    recorders rarely share a lock and the shard count never grows with the
+    number of threads that ever recorded; readers merge the shards.
+    """
+
+    def __init__(self):
+        self._shards = [{'counts': None, 'sum': 0.0, 'count': 0, 'lock': threading.Lock()}
+                        for _ in range(SHARDS)]
+
+    def record(self, seconds):
+        shard = self._shards[threading.get_native_id() % SHARDS]
+        with shard['lock']:
+            if shard['counts'] is None:
+                shard['counts'] = [0] * BUCKETS  # Allocated on first use: most histograms see few threads
+            shard['counts'][bucket_index(int(seconds * 1e6))] += 1
+            shard['sum'] += seconds
+            shard['count'] += 1
+
+    def merged(self):
+        counts = [0] * BUCKETS
+        total = 0.0
+        count = 0
+        for shard in self._shards:
+            with shard['lock']:
+                if shard['counts'] is None:
+                    continue
+                for i, value in enumerate(shard['counts']):
+                    if value:
+                        counts[i] += value
+                total += shard['sum']
+                count += shard['count']
+        return counts, total, count
+
+    def quantile(self, q, merged=None):
+        counts, _, count = merged or self.merged()
+        if not count:
+            return None
+        target = q * count
+        seen = 0
+        for i, value in enumerate(counts):
+            seen += value
+            if seen >= target:
+                return bucket_upper(i) / 1e6
+        return bucket_upper(BUCKETS - 1) / 1e6
+
+    def summary(self):
+        merged = self.merged()
+        _, total, count = merged
+        return {
+            'count': count,
+            'mean': total / count if count else None,
+            'p50': self.quantile(0.5, merged),
+            'p99': self.quantile(0.99, merged),
+            'p999': self.quantile(0.999, merged),
+        }
+
+
+class MetricsRegistry:
+    """Named histograms, counters and gauges with Prometheus text rendering"""
+
+    def __init__(self):
+        self._histograms = OrderedDict()
+        self._counters = OrderedDict()
+        self._gauges = OrderedDict()
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+                self._help.setdefault(name, help_text)
+            return self._histograms[key]
+
+    def inc(self, name, amount=1, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._help.setdefault(name, help_text)
+
+    def gauge(self, name, read, help_text='', **labels):
+        """A value sampled when scraped: read() is called on every render"""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = read
+            self._help.setdefault(name, help_text)
+
+    def _sample_gauges(self, gauges):
+        samples = []
+        for key, read in gauges:
+            try:
+                samples.append((key, read()))
+            except Exception:
+                continue
+        return samples
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def summaries(self):
+        """JSON-friendly counters and histogram quantiles (for scripts and benchmarks)"""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in counters],
+            'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in self._sample_gauges(gauges)],
+            'histograms': [dict(histogram.summary(), name=name, labels=dict(labels))
+                           for (name, labels), histogram in histograms],
+        }
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        seen = set()
+        for kind, samples in (('counter', counters), ('gauge', self._sample_gauges(gauges))):
+            for (name, labels), value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# HELP {name} {self._help.get(name, "")}')
+                    lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name}{_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# HELP {name} {self._help.get(name, "")}')
+                lines.append(f'# TYPE {name} histogram')
+            counts, total, count = histogram.merged()
+            cumulative = 0
+            index = 0
+            for bound in EXPORT_BOUNDS:
+                limit = bound * 1e6
+                while index < BUCKETS and bucket_upper(index) <= limit:
+                    cumulative += counts[index]
+                    index += 1
+                lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class Tracer:
+    """Per-command timelines; stage durations feed the registry's histograms"""
+
+    def __init__(self, registry, capacity=1000):
+        self.registry = registry
+        self.capacity = capacity
+        self._traces = OrderedDict()
+        self._by_seq = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, command, event='received', **fields):
+        """New trace; scheduled commands start at 'scheduled' and are 'received' on release"""
+        trace_id = next(self._ids)
+        trace = {'id': trace_id, 'command': command, 'status': event,
+                 'events': {event: time.time()}}
+        trace.update(fields)
+        with self._lock:
+            self._traces[trace_id] = trace
+            while len(self._traces) > self.capacity:
+                _, old = self._traces.popitem(last=False)
+                self._by_seq.pop(old.get('seq'), None)
+        return trace_id
+
+    def mark(self, trace_id, event, at=None, status=None, **fields):
+        """Timestamp an event on a trace; records any stage it completes"""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return
+            trace['events'][event] = at if at is not None else time.time()
+            if status:
+                trace['status'] = status
+            trace.update(fields)
+            if 'seq' in fields:
+                self._by_seq[fields['seq']] = trace_id
+            events = dict(trace['events'])
+        for stage, begin, end in STAGES:
+            if end == event and begin in events:
+                self.registry.histogram('tidal_command_stage_seconds',
+                                        'Command latency by pipeline stage',
+                                        stage=stage).record(max(0.0, events[end] - events[begin]))
+        if status in FINAL_STATUSES:
+            self.registry.inc('tidal_commands_total', help_text='Commands by final status', status=status)
+
+    def finish(self, trace_id, status):
+        """Set a trace's status without an event (its timestamp was marked earlier); counts final statuses"""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return
+            trace['status'] = status
+        if status in FINAL_STATUSES:
+            self.registry.inc('tidal_commands_total', help_text='Commands by final status', status=status)
+
+    def id_for_seq(self, seq):
+        with self._lock:
+            return self._by_seq.get(seq)
+
+    def get(self, trace_id):
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return None
+            trace = dict(trace, events=dict(trace['events']))
+        events = trace['events']
+        trace['stages_ms'] = {stage: round((events[end] - events[begin]) * 1000, 3)
+                              for stage, begin, end in STAGES
+                              if begin in events and end in events}
+        return trace
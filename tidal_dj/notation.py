@@ -0,0 +1,418 @@
+"""
+Tidal mini-notation parser and command checker
+Catches malformed patterns in the service before they reach GHCi, where a
+parse error can leave the REPL half-way through the next paste.
+"""
+
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# Pattern tree. Sequence steps are (node, weight) pairs; factors and counts are nodes too
+# so `bd*<2 3>` parses, but only plain numbers are checked as numbers.
+Word = namedtuple('Word', 'value')
+Rest = namedtuple('Rest', '')
+Sequence = namedtuple('Sequence', 'steps')
+Stack = namedtuple('Stack', 'layers')
+RandomChoice = namedtuple('RandomChoice', 'layers')
+Alternate = namedtuple('Alternate', 'layers')
+Polymeter = namedtuple('Polymeter', 'layers steps')
+Fast = namedtuple('Fast', 'node factor')
+Slow = namedtuple('Slow', 'node factor')
+Degrade = namedtuple('Degrade', 'node amount')
+Euclid = namedtuple('Euclid', 'node hits steps rotation')
+Range = namedtuple('Range', 'start end')
+
+# Tidal defines d1 .. d16
+CHANNELS = 16
+
+# Functions whose string arguments aren't patterns
+PLAIN_STRING_FUNCTIONS = {'putStrLn', 'putStr', 'print', 'error', 'show', 'import', 'trace'}
+
+# `^name` reads a control bus (e.g. a MIDI CC set with cF), and is a word like any other
+_WORD_START = re.compile(r"[A-Za-z0-9#]|-(?=[A-Za-z0-9.])|\^(?=[A-Za-z_])")
+_WORD_CHAR = re.compile(r"[A-Za-z0-9#:'_\-]")
+_SYMBOLS = '[]<>{}(),|*/!@?%~_.'
+_CLOSERS = {'[': ']', '<': '>', '{': '}', '(': ')'}
+_CHANNEL = re.compile(r'd(\d+)(?![\w\'])')
+_IDENTIFIER = re.compile(r"[A-Za-z_][\w']*$")
+
+
+class NotationError(ValueError):
+    """A parse error with the 1-based column it was found at"""
+
+    def __init__(self, message, column):
+        super().__init__(f'{message} at column {column}')
+        self.message = message
+        self.column = column
+
+
+class _Token:
+    __slots__ = ('kind', 'value', 'column', 'spaced')
+
+    def __init__(self, kind, value, column, spaced):
+        self.kind = kind
+        self.value = value
+        self.column = column
+        self.spaced = spaced  # Whitespace before it (`bd!` repeats, `bd !` is a step of its own)
+
+
+def tokenize(text):
+    tokens = []
+    i = 0
+    spaced = True
+    while i < len(text):
+        char = text[i]
+        if char.isspace():
+            i += 1
+            spaced = True
+            continue
+        if _WORD_START.match(text, i):
+            start = i
+            i += 1
+            while i < len(text):
+                if _WORD_CHAR.match(text, i):
+                    i += 1
+                elif text[i] == '.' and i + 1 < len(text) and text[i + 1].isalnum():
+                    i += 1  # 0.25, but not the `..` of a range
+                else:
+                    break
+            tokens.append(_Token('word', text[start:i], start + 1, spaced))
+        elif text.startswith('..', i):
+            tokens.append(_Token('..', '..', i + 1, spaced))
+            i += 2
+        elif char in _SYMBOLS:
+            tokens.append(_Token(char, char, i + 1, spaced))
+            i += 1
+        else:
+            raise NotationError(f"unexpected character {char!r}", i + 1)
+        spaced = False
+    tokens.append(_Token('end', '', len(text) + 1, spaced))
+    return tokens
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.index = 0
+
+    @property
+    def token(self):
+        return self.tokens[self.index]
+
+    def advance(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def unexpected(self, closer=None, opened=None):
+        token = self.token
+        if token.kind == 'end':
+            if closer:
+                return NotationError(f'unclosed {opened.value!r}', opened.column)
+            return NotationError('unexpected end of pattern', token.column)
+        return NotationError(f'unexpected {token.value!r}', token.column)
+
+    def parse(self):
+        layers, separator = self.parse_layers(None)
+        if self.token.kind != 'end':
+            raise self.unexpected()
+        return _group(layers, separator)
+
+    def parse_layers(self, closer, opened=None):
+        """Sequences separated by `,` (stack) or `|` (random choice) up to closer"""
+        layers = [self.parse_sequence(closer, opened)]
+        separator = None
+        while self.token.kind in (',', '|'):
+            if separator and self.token.kind != separator:
+                raise NotationError("can't mix ',' and '|' in one group", self.token.column)
+            separator = self.advance().kind
+            layers.append(self.parse_sequence(closer, opened))
+        return layers, separator
+
+    def parse_sequence(self, closer, opened):
+        feet = []
+        steps = []
+        while True:
+            token = self.token
+            if token.kind in (',', '|') or token.kind == closer:
+                break
+            if token.kind == 'end':
+                if closer:
+                    raise self.unexpected(closer, opened)
+                break
+            if token.kind == '.':
+                if not steps:
+                    raise NotationError("'.' needs steps before it", token.column)
+                self.advance()
+                feet.append(Sequence(tuple(steps)))
+                steps = []
+            elif token.kind == '_':
+                if not steps:
+                    raise NotationError("'_' needs a step before it", token.column)
+                self.advance()
+                node, weight = steps[-1]
+                steps[-1] = (node, weight + 1)
+            elif token.kind == '!' and token.spaced:
+                if not steps:
+                    raise NotationError("'!' needs a step before it", token.column)
+                self.advance()
+                steps.append(steps[-1])
+            elif token.kind == '..':
+                self.advance()
+                start = steps.pop()[0] if steps else None
+                end = self.parse_term()
+                if not (isinstance(start, Word) and isinstance(end, Word)
+                        and _is_number(start.value) and _is_number(end.value)):
+                    raise NotationError("'..' needs a number on each side", token.column)
+                steps.append((Range(start.value, end.value), 1))
+            else:
+                steps.extend(self.parse_step())
+        if feet:
+            if not steps:
+                raise NotationError("'.' needs steps after it", self.token.column)
+            feet.append(Sequence(tuple(steps)))
+            return Sequence(tuple((foot, 1) for foot in feet))
+        return Sequence(tuple(steps))
+
+    def parse_step(self):
+        """One term and its modifiers; `!n` makes several steps"""
+        node = self.parse_term()
+        weight = 1
+        repeat = 1
+        while True:
+            token = self.token
+            if token.kind == '*':
+                self.advance()
+                node = Fast(node, self.parse_factor('*'))
+            elif token.kind == '/':
+                self.advance()
+                node = Slow(node, self.parse_factor('/'))
+            elif token.kind == '@':
+                self.advance()
+                weight = float(self.parse_number('@'))
+            elif token.kind == '!' and not token.spaced:
+                self.advance()
+                if self.token.kind == 'word' and not self.token.spaced:
+                    count = self.parse_number('!')
+                    if not count.isdigit() or int(count) < 1:
+                        raise NotationError("'!' needs a whole number", token.column + 1)
+                    repeat += int(count) - 1
+                else:
+                    repeat += 1
+            elif token.kind == '?' and not token.spaced:
+                self.advance()
+                amount = 0.5
+                if self.token.kind == 'word' and not self.token.spaced:
+                    amount = float(self.parse_number('?'))
+                node = Degrade(node, amount)
+            elif token.kind == '(' and not token.spaced:
+                node = self.parse_euclid(node)
+            else:
+                break
+        return [(node, weight)] * repeat
+
+    def parse_term(self):
+        token = self.token
+        if token.kind == 'word':
+            self.advance()
+            return Word(token.value)
+        if token.kind == '~':
+            self.advance()
+            return Rest()
+        if token.kind in ('[', '<', '{'):
+            self.advance()
+            closer = _CLOSERS[token.kind]
+            layers, separator = self.parse_layers(closer, token)
+            self.advance()
+            if token.kind == '<':
+                if separator == '|':
+                    raise NotationError("'|' isn't allowed inside '<>'", token.column)
+                alternations = [Alternate(tuple(step for step, _ in layer.steps)) for layer in layers]
+                return alternations[0] if len(alternations) == 1 else Stack(tuple(alternations))
+            if token.kind == '{':
+                if separator == '|':
+                    raise NotationError("'|' isn't allowed inside '{}'", token.column)
+                steps = None
+                if self.token.kind == '%':
+                    self.advance()
+                    steps = self.parse_factor('%')
+                return Polymeter(tuple(layers), steps)
+            return _group(layers, separator)
+        raise self.unexpected()
+
+    def parse_factor(self, symbol):
+        token = self.token
+        if token.kind == 'word':
+            if not _is_number(token.value):
+                raise NotationError(f"expected a number after {symbol!r}, got {token.value!r}", token.column)
+            self.advance()
+            return Word(token.value)
+        if token.kind in ('[', '<'):
+            return self.parse_term()
+        raise NotationError(f"expected a number after {symbol!r}", token.column)
+
+    def parse_number(self, symbol):
+        token = self.token
+        if token.kind != 'word' or not _is_number(token.value):
+            raise NotationError(f"expected a number after {symbol!r}", token.column)
+        self.advance()
+        return token.value
+
+    def parse_euclid(self, node):
+        opened = self.advance()
+        layers, separator = self.parse_layers(')', opened)
+        self.advance()
+        if separator == '|' or not 2 <= len(layers) <= 3:
+            raise NotationError('euclid needs (hits,steps) or (hits,steps,rotation)', opened.column)
+        for layer in layers:
+            if not layer.steps:
+                raise NotationError('empty euclid argument', opened.column)
+        args = [layer.steps[0][0] if len(layer.steps) == 1 else layer for layer in layers]
+        return Euclid(node, args[0], args[1], args[2] if len(args) == 3 else None)
+
+
+def _group(layers, separator):
+    if len(layers) == 1:
+        return layers[0]
+    return (RandomChoice if separator == '|' else Stack)(tuple(layers))
+
+
+def parse_pattern(text):
+    """Parse a mini-notation string (the inside of `sound "..."`) into a pattern tree"""
+    return _Parser(text).parse()
+
+
+def _string_literals(command):
+    """Yield (start offset of the contents, contents, preceding identifier) for each string,
+    checking brackets and quotes outside them along the way"""
+    stack = []
+    i = 0
+    length = len(command)
+    while i < length:
+        char = command[i]
+        if command.startswith('--', i) and not re.match(r'[!#$%&*+./<=>?@\\^|~:-]', command[i + 2:i + 3] or ' '):
+            end = command.find('\n', i)
+            i = length if end < 0 else end
+            continue
+        if command.startswith('{-', i):
+            end = command.find('-}', i + 2)
+            if end < 0:
+                raise NotationError("unclosed '{-' comment", i + 1)
+            i = end + 2
+            continue
+        if char == '"':
+            start = i + 1
+            i = start
+            chars = []
+            while i < length and command[i] != '"':
+                if command[i] == '\n':
+                    break
+                if command[i] == '\\' and i + 1 < length:
+                    i += 1
+                chars.append(command[i])
+                i += 1
+            if i >= length or command[i] != '"':
+                raise NotationError('unterminated string', start)
+            before = command[:start - 1].rstrip()
+            match = _IDENTIFIER.search(before)
+            yield start, ''.join(chars), match.group(0) if match else None
+            i += 1
+            continue
+        if char in '([{':
+            stack.append((char, i + 1))
+        elif char in ')]}':
+            if not stack:
+                raise NotationError(f'unmatched {char!r}', i + 1)
+            opener, _ = stack.pop()
+            if _CLOSERS[opener] != char:
+                raise NotationError(f'unmatched {char!r} (expected {_CLOSERS[opener]!r})', i + 1)
+        i += 1
+    if stack:
+        opener, column = stack[-1]
+        raise NotationError(f'unclosed {opener!r}', column)
+
+
+def check_command(command):
+    """Raise NotationError if a command is clearly malformed
+
+    Checks brackets and quotes, the `dN $ ...` structure and every pattern
+    string. GHCi directives (`:set`, `:script`, ...) are passed through.
+    """
+    text = command.strip()
+    if not text:
+        raise NotationError('empty command', 1)
+    if text.startswith(':'):
+        return
+    offset = len(command) - len(command.lstrip())
+    for start, contents, function in _string_literals(command):
+        if function in PLAIN_STRING_FUNCTIONS:
+            continue
+        try:
+            parse_pattern(contents)
+        except NotationError as e:
+            raise NotationError(f'in "{contents}": {e.message}', start + e.column) from None
+
+    match = _CHANNEL.match(text)
+    if match:
+        channel = int(match.group(1))
+        if not 1 <= channel <= CHANNELS:
+            raise NotationError(f'no channel d{channel} (use d1 .. d{CHANNELS})', offset + 1)
+        rest = text[match.end():].lstrip()
+        column = offset + len(text) - len(rest) + 1
+        if not rest:
+            raise NotationError(f"d{channel} needs a pattern (d{channel} $ ... or d{channel} silence)", column)
+        if rest.startswith('$') and not rest[1:].strip():
+            raise NotationError(f"nothing after 'd{channel} $'", column)
+
+
+class CommandValidator:
+    """check_command behind a bounded LRU - the UI re-sends the same few patterns constantly"""
+
+    def __init__(self, cache_size=512):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rejected = 0
+
+    def check(self, command):
+        """The NotationError for command, or None if it looks fine"""
+        with self._lock:
+            if command in self._cache:
+                self._cache.move_to_end(command)
+                self.cache_hits += 1
+                error = self._cache[command]
+                if error is not None:
+                    self.rejected += 1
+                return error
+        try:
+            check_command(command)
+            error = None
+        except NotationError as e:
+            error = e
+        with self._lock:
+            self.cache_misses += 1
+            if error is not None:
+                self.rejected += 1
+            self._cache[command] = error
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return error
+
+    def info(self):
+        return {
+            'cache_size': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'rejected': self.rejected,
+        }
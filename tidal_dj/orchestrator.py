@@ -0,0 +1,90 @@
+"""
+Dependency-aware startup orchestrator
+Starts independent components in parallel and waits on real readiness probes, not fixed sleeps
+"""
+
+import threading
+import time
+
+
+def wait_until(probe, deadline, initial=0.05, factor=1.6, max_interval=0.5):
+    """Poll probe() with exponential backoff until it's true or the deadline passes"""
+    interval = initial
+    while True:
+        try:
+            if probe():
+                return True
+        except Exception:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * factor, max_interval)
+
+
+class Component:
+    """One thing to start: how to start it, how to tell it's up, and what it needs first"""
+
+    def __init__(self, name, start, ready, running=None, requires=(), timeout=30.0):
+        self.name = name
+        self.start = start
+        self.ready = ready
+        # Checked before starting; defaults to the readiness probe
+        self.running = running or ready
+        self.requires = tuple(requires)
+        self.timeout = timeout
+
+
+class Orchestrator:
+    """Runs components concurrently, each one as soon as its requirements are ready"""
+
+    def __init__(self, components):
+        self.components = {component.name: component for component in components}
+        for component in components:
+            for name in component.requires:
+                if name not in self.components:
+                    raise ValueError(f'{component.name} requires unknown component {name}')
+
+    def run(self):
+        """Start everything; returns per-component result and time-to-ready"""
+        began = time.monotonic()
+        # Set when a component has finished (ready or not) so dependents don't wait out a failure
+        done_events = {name: threading.Event() for name in self.components}
+        results = {}
+        lock = threading.Lock()
+
+        def launch(component):
+            record = {'result': None, 'ready': False, 'time_to_ready': None}
+            try:
+                for name in component.requires:
+                    done_events[name].wait()
+                    if not results[name]['ready']:
+                        record['result'] = f'blocked: {name} not ready'
+                        return
+                if component.running():
+                    record['result'] = 'already_running'
+                else:
+                    record['result'] = component.start()
+                    if str(record['result']).startswith('error'):
+                        return  # Nothing to wait for
+                deadline = time.monotonic() + component.timeout
+                if wait_until(component.ready, deadline):
+                    record['ready'] = True
+                    record['time_to_ready'] = round(time.monotonic() - began, 3)
+            except Exception as e:
+                record['result'] = f'error: {e}'
+            finally:
+                with lock:
+                    results[component.name] = record
+                done_events[component.name].set()
+
+        threads = [threading.Thread(target=launch, args=(component,), name=f'start-{name}', daemon=True)
+                   for name, component in self.components.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        results['total_seconds'] = round(time.monotonic() - began, 3)
+        return results
@@ -0,0 +1,228 @@
+"""
+Minimal OSC 1.0 encoder/decoder and a direct SuperDirt client
+One-shot triggers go straight to SuperDirt over UDP instead of through GHCi
+"""
+
+import math
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_DELTA = 2208988800
+# Timetag 1 means "immediately" in OSC
+IMMEDIATELY = struct.pack('>Q', 1)
+BUNDLE_TAG = b'#bundle\0'
+
+# SuperDirt reads these as integers; every other number goes out as float like Tidal sends it
+INT_PARAMS = {'orbit', 'cut', 'channel', 'coarse'}
+
+# What fits in OSC's 32-bit 'i' and 'f' arguments
+INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+FLOAT32_MAX = 3.4028234663852886e38
+# Longest a bundle may be scheduled ahead (seconds)
+MAX_LATENCY = 60.0
+
+
+def _pad(data):
+    return data + b'\0' * (4 - len(data) % 4)
+
+
+def encode_string(value):
+    return _pad(value.encode('utf-8'))
+
+
+def encode_message(address, args):
+    """Encode an OSC message; args are (typetag, value) pairs"""
+    tags = ','
+    payload = []
+    for tag, value in args:
+        tags += tag
+        if tag == 'i':
+            payload.append(struct.pack('>i', value))
+        elif tag == 'f':
+            payload.append(struct.pack('>f', value))
+        elif tag == 's':
+            payload.append(encode_string(value))
+        elif tag == 'b':
+            payload.append(struct.pack('>i', len(value)) + value + b'\0' * (-len(value) % 4))
+        else:
+            raise ValueError(f'Unsupported OSC type tag: {tag}')
+    return encode_string(address) + encode_string(tags) + b''.join(payload)
+
+
+def timetag(unix_time):
+    """64-bit NTP timetag for a Unix timestamp"""
+    seconds = int(unix_time) + NTP_DELTA
+    fraction = int((unix_time % 1) * (1 << 32)) & 0xFFFFFFFF
+    return struct.pack('>II', seconds, fraction)
+
+
+def timetag_to_unix(tag):
+    seconds, fraction = struct.unpack('>II', tag)
+    return seconds - NTP_DELTA + fraction / (1 << 32)
+
+
+def encode_bundle(tag, messages):
+    """Wrap already-encoded messages in a bundle with the given 8-byte timetag"""
+    parts = [BUNDLE_TAG, tag]
+    for message in messages:
+        parts.append(struct.pack('>i', len(message)))
+        parts.append(message)
+    return b''.join(parts)
+
+
+def _read_string(data, pos):
+    end = data.find(b'\0', pos)
+    if end < 0:
+        raise ValueError('truncated OSC string')
+    return data[pos:end].decode('utf-8', 'replace'), (end + 4) & ~3
+
+
+# Fixed-size argument types: struct format per type tag
+_FIXED = {'i': '>i', 'f': '>f', 'h': '>q', 'd': '>d', 'c': '>I', 'r': '>I', 'm': '>4s', 't': '>8s'}
+# Types with no data in the argument list
+_IMPLIED = {'T': True, 'F': False, 'N': None, 'I': float('inf')}
+
+
+def decode_message(data):
+    """(address, [args]) for an encoded OSC message (ValueError if it's malformed)"""
+    try:
+        address, pos = _read_string(data, 0)
+        if not address.startswith('/'):
+            raise ValueError(f'not an OSC address: {address!r}')
+        if pos >= len(data):
+            return address, []
+        tags, pos = _read_string(data, pos)
+        if not tags.startswith(','):
+            raise ValueError(f'bad OSC type tags: {tags!r}')
+        args = []
+        for tag in tags[1:]:
+            if tag in _FIXED:
+                fmt = struct.Struct(_FIXED[tag])
+                args.append(fmt.unpack_from(data, pos)[0])
+                pos += fmt.size
+            elif tag in ('s', 'S'):
+                value, pos = _read_string(data, pos)
+                args.append(value)
+            elif tag == 'b':
+                size, = struct.unpack_from('>i', data, pos)
+                args.append(data[pos + 4:pos + 4 + size])
+                pos += 4 + size + (-size % 4)
+            elif tag in _IMPLIED:
+                args.append(_IMPLIED[tag])
+            else:
+                raise ValueError(f'unsupported OSC type tag: {tag}')
+        if pos > len(data):
+            raise ValueError('truncated OSC message')
+        return address, args
+    except struct.error as e:
+        raise ValueError(f'truncated OSC message: {e}')
+
+
+def decode_packet(data, tag=None):
+    """Yield (unix time or None for "immediately", address, args) for each message in a packet"""
+    if not data.startswith(BUNDLE_TAG):
+        address, args = decode_message(data)
+        yield tag, address, args
+        return
+    if len(data) < 16:
+        raise ValueError('truncated OSC bundle')
+    raw = data[8:16]
+    inner = None if raw == IMMEDIATELY else timetag_to_unix(raw)
+    pos = 16
+    while pos < len(data):
+        if pos + 4 > len(data):
+            raise ValueError('truncated OSC bundle element')
+        size, = struct.unpack_from('>i', data, pos)
+        if size <= 0 or pos + 4 + size > len(data):
+            raise ValueError('bad OSC bundle element size')
+        yield from decode_packet(data[pos + 4:pos + 4 + size], inner)
+        pos += 4 + size
+
+
+def dirt_args(params):
+    """Turn {'s': 'bd', 'n': 3} into /dirt/play key/value OSC args"""
+    args = []
+    for key, value in params.items():
+        args.append(('s', key))
+        if isinstance(value, str):
+            args.append(('s', value))
+            continue
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(f'Unsupported value for {key}: {value!r}')
+        if not math.isfinite(value):
+            raise ValueError(f'{key} must be a finite number, got {value!r}')
+        if key in INT_PARAMS:
+            if not INT32_RANGE[0] <= value <= INT32_RANGE[1]:
+                raise ValueError(f'{key} out of range: {value!r}')
+            args.append(('i', int(value)))
+        else:
+            if abs(value) > FLOAT32_MAX:
+                raise ValueError(f'{key} out of range: {value!r}')
+            args.append(('f', float(value)))
+    return args
+
+
+class DirtClient:
+    """Sends timestamped /dirt/play bundles to SuperDirt"""
+
+    def __init__(self, host='127.0.0.1', port=57120, latency=0.05, cache_size=256):
+        self.address = (host, port)
+        self.latency = latency
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sent = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def message(self, params):
+        """Encoded /dirt/play message for params, from the cache when we've seen them before"""
+        key = tuple(sorted(params.items()))
+        with self._lock:
+            message = self._cache.get(key)
+            if message is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return message
+        message = encode_message('/dirt/play', dirt_args(params))
+        with self._lock:
+            self.cache_misses += 1
+            self._cache[key] = message
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return message
+
+    def play(self, events, latency=None):
+        """Send one bundle holding every event; returns the scheduled Unix time"""
+        if isinstance(events, dict):
+            events = [events]
+        messages = [self.message(params) for params in events]
+        latency = self.latency if latency is None else latency
+        if not isinstance(latency, (int, float)) or isinstance(latency, bool) or not math.isfinite(latency):
+            raise ValueError(f'latency must be a number of seconds, got {latency!r}')
+        if not 0 <= latency <= MAX_LATENCY:
+            raise ValueError(f'latency must be between 0 and {MAX_LATENCY:g} seconds')
+        at = time.time() + latency
+        tag = timetag(at) if latency > 0 else IMMEDIATELY
+        self._sock.sendto(encode_bundle(tag, messages), self.address)
+        self.sent += len(messages)
+        return at
+
+    def info(self):
+        return {
+            'host': self.address[0],
+            'port': self.address[1],
+            'latency': self.latency,
+            'sent': self.sent,
+            'cache_size': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,131 @@
+"""
+Bounded capture of child process output
+A reader thread per pipe drains it as fast as the child writes - a full pipe
+would block the child mid-set - into a fixed-size ring of recent lines, and
+optionally appends it to a size-capped log file.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+# Longer lines are cut; also the most a reader buffers while waiting for a newline
+MAX_LINE = 4096
+
+
+def read_lines(fd):
+    """Yield decoded lines from a pipe until EOF, never holding more than MAX_LINE of a partial line"""
+    pending = b''
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError:
+            break
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        if len(pending) > MAX_LINE:
+            lines.append(pending)
+            pending = b''
+        for raw in lines:
+            yield raw.decode('utf-8', errors='replace').rstrip('\r')
+    if pending:
+        yield pending.decode('utf-8', errors='replace').rstrip('\r')
+
+
+class OutputRing:
+    """The last `capacity` lines with timestamps; `total` counts every line ever added"""
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self.total = 0
+        self.truncated = 0
+        self._lines = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def append(self, line):
+        if len(line) > MAX_LINE:
+            line = line[:MAX_LINE] + '…'
+            self.truncated += 1
+        with self._lock:
+            self._lines.append((time.time(), line))
+            self.total += 1
+
+    def tail(self, limit=50):
+        with self._lock:
+            lines = list(self._lines)
+        return [line for _, line in lines[-limit:]] if limit else []
+
+    def since(self, index):
+        """(lines added after the first `index`, new index) - lines that fell out of the ring are skipped"""
+        with self._lock:
+            missed = max(0, self.total - index)
+            lines = list(self._lines)[-missed:] if missed else []
+            return [line for _, line in lines], self.total
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+
+    def info(self):
+        with self._lock:
+            return {'lines': len(self._lines), 'capacity': self.capacity,
+                    'total': self.total, 'truncated': self.truncated}
+
+
+class OutputCollector:
+    """Drains a child's stdout into a ring (and a log file, rotated at max_bytes) on its own thread"""
+
+    def __init__(self, stream, ring, log_path=None, max_bytes=5 * 1024 * 1024, name='output'):
+        self.stream = stream
+        self.ring = ring
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.name = name
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'output:{self.name}', daemon=True)
+            self._thread.start()
+        return self
+
+    def _open_log(self):
+        if self.log_path is None:
+            return None, 0
+        try:
+            log = open(self.log_path, 'a', encoding='utf-8', buffering=1)
+        except OSError as e:
+            print(f"   ⚠️  Can't write {self.log_path}: {e}")
+            return None, 0
+        return log, log.tell()
+
+    def _run(self):
+        log, size = self._open_log()
+        try:
+            for line in read_lines(self.stream.fileno()):
+                self.ring.append(line)
+                if log is None:
+                    continue
+                try:
+                    log.write(line + '\n')
+                except OSError:
+                    continue
+                size += len(line) + 1
+                if size > self.max_bytes:
+                    # Keep one previous file; a long set can't fill the disk
+                    try:
+                        log.close()
+                        os.replace(self.log_path, f'{self.log_path}.1')
+                    except OSError as e:
+                        # Stop logging rather than grow the file - but keep draining, or the child blocks
+                        print(f"   ⚠️  Can't rotate {self.log_path}, no longer logging {self.name}: {e}")
+                        log = None
+                        continue
+                    log, size = self._open_log()
+        finally:
+            if log is not None:
+                log.close()
+            self.stream.close()
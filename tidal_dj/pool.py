@@ -0,0 +1,117 @@
+"""
+Pool of headless GHCi instances ("decks")
+With one GHCi, a pattern that is slow to compile holds up every channel. The
+pool runs several side by side - each with its own delivery queue, channel
+state and SuperDirt orbit - and routes each command to one of them: by the
+deck it names, by the client session it belongs to (sticky), or by channel
+group (d1-d4, d5-d8, ...). Tempo goes to every deck, as do definitions and
+hush unless the command is addressed to one deck.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from tidal_dj.standby import ChannelState, GhciStandby, state_key
+
+# Channels BootTidal defines (d1 .. d16); a deck re-points all of them at its orbit
+CHANNELS_PER_DECK = 16
+
+_HUSH = re.compile(r'^\s*hush\s*$')
+
+
+def orbit_setup(orbit, channels=CHANNELS_PER_DECK):
+    """GHCi line that sends d1..dN to `orbit` (BootTidal's own definitions use orbit 0)"""
+    bindings = '; '.join(f'd{n} = p {n} . (|< orbit {orbit})' for n in range(1, channels + 1))
+    return f'let {{ {bindings} }}'
+
+
+class Deck:
+    """One GHCi of the pool: its session, what its channels play, its spare and its send lock"""
+
+    def __init__(self, index, factory, standby=False):
+        self.index = index
+        self.name = 'ghci' if index == 0 else f'ghci-{index}'  # Supervised component name
+        self.orbit = index
+        self.factory = factory  # () -> unstarted GhciSession for this deck
+        self.session = factory()  # Replaced when the standby takes over
+        self.channels = ChannelState()
+        self.standby = GhciStandby(factory) if standby else None
+        self.lock = threading.Lock()  # One writer at a time, so batches and replays go in whole
+
+    def info(self):
+        info = self.session.info()
+        info.update(deck=self.index, name=self.name, orbit=self.orbit,
+                    channels=self.channels.info()['keys'],
+                    standby=self.standby.info() if self.standby is not None else None)
+        return info
+
+
+class DeckRouter:
+    """Picks the deck(s) each command goes to"""
+
+    def __init__(self, decks, group_size=4, max_sessions=1024):
+        self.decks = decks  # How many
+        self.group_size = group_size  # Channels per group: d1..d4 -> deck 0, d5..d8 -> deck 1, ...
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # client session id -> deck, least recently used first
+        self._lock = threading.Lock()
+
+    def deck(self, value):
+        """Validate an explicit deck number (ValueError if there's no such deck)"""
+        if isinstance(value, bool):
+            raise ValueError(f'bad deck {value!r}')
+        try:
+            deck = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'bad deck {value!r} (a number from 0 to {self.decks - 1})')
+        if not 0 <= deck < self.decks:
+            raise ValueError(f'no deck {deck} (there are {self.decks})')
+        return deck
+
+    def session_deck(self, session):
+        """Sticky deck for a client session: the one with fewest sessions when first seen"""
+        session = str(session)
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.move_to_end(session)
+                return self._sessions[session]
+            counts = [0] * self.decks
+            for deck in self._sessions.values():
+                counts[deck] += 1
+            deck = counts.index(min(counts))
+            self._sessions[session] = deck
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return deck
+
+    def route(self, command, deck=None, session=None):
+        """Deck indexes for command, the one it's addressed to first (ValueError for a bad deck)"""
+        if deck not in (None, ''):
+            addressed = self.deck(deck)
+        elif session not in (None, ''):
+            addressed = self.session_deck(session)
+        else:
+            addressed = None
+        everywhere = list(range(self.decks))
+        key = ('all', 'hush') if _HUSH.match(command) else state_key(command)
+        if key is not None and key[0] == 'tempo':
+            # One tempo for the whole pool, or the decks drift apart
+            return [addressed] + [i for i in everywhere if i != addressed] if addressed is not None else everywhere
+        if addressed is not None:
+            return [addressed]
+        if key is None:
+            return [0]
+        if key[0] == 'channel':
+            number = int(key[1][1:])
+            return [max(0, number - 1) // self.group_size % self.decks]
+        # Definitions, state values, `all` and hush apply to every deck
+        return everywhere
+
+    def info(self):
+        with self._lock:
+            sessions = dict(self._sessions)
+        return {'decks': self.decks,
+                'group_size': self.group_size,
+                'sessions': len(sessions),
+                'sessions_per_deck': [list(sessions.values()).count(deck) for deck in range(self.decks)]}
@@ -0,0 +1,246 @@
+"""
+Process/port probe engine
+One /proc scan (or one `ps` call off Linux) per refresh, cached with a short TTL
+"""
+
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+PROC_DIR = Path('/proc')
+
+# /proc/net/tcp state code for LISTEN
+TCP_LISTEN = '0A'
+
+# Patterns are matched against full command lines, like `pgrep -f`
+PROCESS_PATTERNS = {
+    'ghci': [re.compile(r'ghci'), re.compile(r'ghc.*tidal')],
+}
+
+STATUS_PROCESSES = {
+    'supercollider': 'sclang',
+    'ghci': 'ghci',
+    'monitor': 'monitor-commands.py',
+}
+
+STATUS_PORTS = {
+    'bridge': 8080,
+    'superdirt': 57120,
+    'tidal': 6010,
+}
+
+
+def scan_processes():
+    """Return (pid, cmdline) for every process, reading /proc or a single ps call"""
+    if PROC_DIR.is_dir():
+        result = []
+        own_pid = os.getpid()
+        for entry in os.listdir(PROC_DIR):
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            if pid == own_pid:
+                continue
+            try:
+                with open(PROC_DIR / entry / 'cmdline', 'rb') as f:
+                    raw = f.read()
+            except OSError:
+                continue  # Process exited while we were scanning
+            if raw:
+                result.append((pid, raw.replace(b'\0', b' ').decode('utf-8', errors='ignore').strip()))
+        return result
+
+    # No /proc (macOS): one ps fork replaces the old pgrep/ps/pgrep chain
+    try:
+        output = subprocess.run(['ps', '-axo', 'pid=,command='],
+                                capture_output=True, check=False).stdout
+    except OSError:
+        return []
+    result = []
+    own_pid = os.getpid()
+    for line in output.decode('utf-8', errors='ignore').splitlines():
+        parts = line.strip().split(None, 1)
+        if len(parts) == 2 and parts[0].isdigit() and int(parts[0]) != own_pid:
+            result.append((int(parts[0]), parts[1]))
+    return result
+
+
+def _parse_proc_net(path, listen_only):
+    ports = set()
+    try:
+        with open(path, 'r') as f:
+            next(f, None)  # Header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                if listen_only and fields[3] != TCP_LISTEN:
+                    continue
+                ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+    except OSError:
+        pass
+    return ports
+
+
+def scan_ports():
+    """Return the set of bound local ports from /proc/net, or None when unavailable"""
+    net_dir = PROC_DIR / 'net'
+    if not (net_dir / 'tcp').exists():
+        return None
+    ports = set()
+    for name in ('tcp', 'tcp6'):
+        ports |= _parse_proc_net(net_dir / name, listen_only=True)
+    for name in ('udp', 'udp6'):
+        ports |= _parse_proc_net(net_dir / name, listen_only=False)
+    return ports
+
+
+def socket_port_check(port, host='127.0.0.1'):
+    """Check a port in-process: TCP connect first, then a UDP bind probe"""
+    try:
+        with socket.create_connection((host, port), timeout=0.05):
+            return True
+    except OSError:
+        pass
+    # SuperDirt (57120) and Tidal (6010) are UDP - if we can't bind, someone else has it
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind((host, port))
+        return False
+    except OSError:
+        return True
+    finally:
+        sock.close()
+
+
+class ProbeSnapshot:
+    """Immutable view of the process table and bound ports at one instant"""
+
+    def __init__(self, processes, ports, taken_at, duration):
+        self.processes = processes
+        self.ports = ports
+        self.taken_at = taken_at
+        self.duration = duration
+        self._port_cache = {}
+
+    def is_running(self, process_name):
+        patterns = PROCESS_PATTERNS.get(process_name) or [re.compile(process_name)]
+        for _, cmdline in self.processes:
+            for pattern in patterns:
+                if pattern.search(cmdline):
+                    return True
+        return False
+
+    def is_port_open(self, port):
+        if self.ports is not None:
+            return port in self.ports
+        if port not in self._port_cache:
+            self._port_cache[port] = socket_port_check(port)
+        return self._port_cache[port]
+
+    def pids(self, process_name):
+        pattern = re.compile(process_name)
+        return [pid for pid, cmdline in self.processes if pattern.search(cmdline)]
+
+    def status(self):
+        status = {key: self.is_running(name) for key, name in STATUS_PROCESSES.items()}
+        status.update({key: self.is_port_open(port) for key, port in STATUS_PORTS.items()})
+        return status
+
+
+class ProbeEngine:
+    """Caches probe snapshots and refreshes them in the background"""
+
+    def __init__(self, ttl=1.0, idle_after=30.0):
+        self.ttl = ttl
+        self.idle_after = idle_after
+        self._snapshot = None
+        self._status = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_read = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+        self._holds = 0
+        self.listeners = []
+
+    def refresh(self):
+        """Take a new snapshot now"""
+        with self._refresh_lock:
+            started = time.monotonic()
+            processes = scan_processes()
+            ports = scan_ports()
+            snapshot = ProbeSnapshot(processes, ports, time.monotonic(), 0.0)
+            status = snapshot.status()
+            snapshot.duration = time.monotonic() - started
+            with self._lock:
+                self._snapshot = snapshot
+                self._status = status
+        for listener in list(self.listeners):
+            try:
+                listener(snapshot, status)
+            except Exception as e:
+                print(f"   ⚠️  Probe listener error: {e}")
+        return snapshot
+
+    def snapshot(self, fresh=False):
+        """Return the cached snapshot, refreshing if it's missing, stale or fresh=True"""
+        self._last_read = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshot
+        if fresh or snapshot is None or time.monotonic() - snapshot.taken_at > self.ttl * 3:
+            snapshot = self.refresh()
+        return snapshot
+
+    def status(self):
+        """Status dict for GET /status - a memory read while the refresher is running"""
+        snapshot = self.snapshot()
+        with self._lock:
+            if self._snapshot is snapshot and self._status is not None:
+                return dict(self._status)
+        return snapshot.status()
+
+    def is_running(self, process_name, fresh=False):
+        return self.snapshot(fresh).is_running(process_name)
+
+    def is_port_open(self, port, fresh=False):
+        return self.snapshot(fresh).is_port_open(port)
+
+    def invalidate(self):
+        """Force the next read to rescan (e.g. after starting or stopping something)"""
+        with self._lock:
+            self._snapshot = None
+        self._wake.set()
+
+    def hold(self):
+        """Keep refreshing even without readers (e.g. while a stream is connected)"""
+        with self._lock:
+            self._holds += 1
+        self._wake.set()
+
+    def release(self):
+        with self._lock:
+            self._holds = max(0, self._holds - 1)
+
+    def start(self):
+        """Start the background refresher"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='probe-refresh', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.ttl)
+            self._wake.clear()
+            # Nobody is polling - don't keep scanning the process table
+            if time.monotonic() - self._last_read > self.idle_after and not self._holds:
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"   ⚠️  Probe refresh failed: {e}")
@@ -0,0 +1,549 @@
+"""
+Pattern preview renderer
+Expands a pattern expression (`sound "bd*2 <sn cp>" # gain 0.8`, `every 4 (rev) $ ...`)
+into the events it plays over a window of cycles, without a running GHCi.
+
+Queries are batched: every node takes arrays of arcs and returns arrays of
+events, so a window of 1,000 cycles costs a handful of NumPy operations per
+node instead of 1,000 recursive walks. Events are onset-based (each event
+whose onset falls in the window, with its whole duration).
+"""
+
+import math
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # Preview is optional; the rest of the service doesn't need NumPy
+    np = None
+
+from tidal_dj.notation import (Alternate, Degrade, Euclid, Fast, NotationError, Polymeter, RandomChoice,
+                               Range, Rest, Sequence, Slow, Stack, Word, parse_pattern)
+
+# Pattern-level transforms (from `every 4 (rev) $ ...`), alongside the mini-notation nodes
+Rev = namedtuple('Rev', 'node')
+Every = namedtuple('Every', 'period applied node')
+
+HAVE_NUMPY = np is not None
+
+MAX_CYCLES = 1000
+# Most events (or cycle slices) one preview may produce; checked before the arrays are allocated
+MAX_EVENTS = 200_000
+
+SCALES = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'ionian': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+    'aeolian': (0, 2, 3, 5, 7, 8, 10),
+    'dorian': (0, 2, 3, 5, 7, 9, 10),
+    'phrygian': (0, 1, 3, 5, 7, 8, 10),
+    'lydian': (0, 2, 4, 6, 7, 9, 11),
+    'mixolydian': (0, 2, 4, 5, 7, 9, 10),
+    'locrian': (0, 1, 3, 5, 6, 8, 10),
+    'pentatonic': (0, 2, 4, 7, 9),
+    'majPent': (0, 2, 4, 7, 9),
+    'minPent': (0, 3, 5, 7, 10),
+    'harmonicMinor': (0, 2, 3, 5, 7, 8, 11),
+    'melodicMinor': (0, 2, 3, 5, 7, 9, 11),
+    'whole': (0, 2, 4, 6, 8, 10),
+    'chromatic': tuple(range(12)),
+}
+
+NOTE_NAMES = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+_NOTE = re.compile(r'([a-g])((?:s|f|#|n)*)(-?\d+)?$')
+_NOTE_PARAMS = {'n', 'note', 'up'}
+_SOUND_PARAMS = {'s', 'sound'}
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?$')
+_PREFIX = re.compile(r'^\s*(?:d\d+|once)\s*\$')
+
+# Arc arithmetic is floating point; a boundary that's off by this much is still the boundary
+EPSILON = 1e-9
+
+
+class PreviewError(ValueError):
+    """The expression can't be previewed"""
+
+
+def bjorklund(hits, steps):
+    """Euclidean rhythm as a list of booleans (same ordering as Tidal)"""
+    if steps <= 0:
+        return []
+    hits = max(0, min(hits, steps))
+    a = [[True]] * hits
+    b = [[False]] * (steps - hits)
+    while len(b) > 1 and a:
+        m = min(len(a), len(b))
+        a, b = [a[i] + b[i] for i in range(m)], a[m:] + b[m:]
+    return [x for group in a + b for x in group]
+
+
+def _whole(text):
+    """Integer value of a numeric word (PreviewError if it has none)"""
+    try:
+        return int(float(text))
+    except (ValueError, OverflowError):
+        raise PreviewError(f'{text!r} is not a usable number') from None
+
+
+def _split_top(text, separator):
+    """Split on separator outside parentheses, brackets and strings"""
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    for i, char in enumerate(text):
+        if char == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == separator and depth == 0:
+            # `#` on its own, not part of an operator like `|#` or `#|`
+            if separator != '#' or (text[i - 1:i] not in ('|', '+', '-', '*', '/', '<', '>')
+                                    and text[i + 1:i + 2] not in ('|', '+', '-', '*', '/', '<', '>')):
+                parts.append(text[start:i])
+                start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _unwrap(text):
+    """Strip parentheses that wrap the whole expression"""
+    text = text.strip()
+    while text.startswith('(') and text.endswith(')'):
+        inner = text[1:-1]
+        depth = 0
+        for char in inner:
+            depth += char == '('
+            depth -= char == ')'
+            if depth < 0:
+                return text  # (a) (b) - the outer pair doesn't match
+        text = inner.strip()
+    return text
+
+
+def _string_arg(text):
+    """Contents of a single string literal, or None"""
+    text = text.strip()
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"' and '"' not in text[1:-1]:
+        return text[1:-1]
+    return None
+
+
+def _parse_value(text):
+    """A control value: a number, a "pattern" or (scale "name" "pattern") -> (node, scale)"""
+    text = _unwrap(text)
+    if _NUMBER.match(text):
+        return Word(text), None
+    pattern = _string_arg(text)
+    if pattern is not None:
+        try:
+            return parse_pattern(pattern), None
+        except NotationError as e:
+            raise PreviewError(f'in "{pattern}": {e}') from None
+    match = re.match(r'scale\s+"([^"]*)"\s+(.*)$', text)
+    if match:
+        if match.group(1) not in SCALES:
+            raise PreviewError(f'unknown scale {match.group(1)!r}')
+        node, _ = _parse_value(match.group(2))
+        return node, match.group(1)
+    raise PreviewError(f"can't preview {text!r}")
+
+
+def _apply_transform(text, node, ignored):
+    """Wrap node in the transform described by text (`fast 2`, `rev`, `every 4 (rev)`)"""
+    text = _unwrap(text)
+    words = text.split(None, 1)
+    name = words[0] if words else ''
+    arg = words[1].strip() if len(words) > 1 else ''
+    if name == 'rev' and not arg:
+        return Rev(node)
+    if name in ('fast', 'density', 'slow', 'sparsity') and arg:
+        factor, _ = _parse_value(arg)
+        return Fast(node, factor) if name in ('fast', 'density') else Slow(node, factor)
+    if name == 'degrade' and not arg:
+        return Degrade(node, 0.5)
+    if name == 'degradeBy' and _NUMBER.match(arg):
+        return Degrade(node, float(arg))
+    if name == 'every':
+        period, _, function = arg.partition(' ')
+        if period.isdigit() and function.strip():
+            applied = _apply_transform(function, node, [])
+            if applied is not node:
+                return Every(int(period), applied, node)
+    ignored.append(text)
+    return node
+
+
+def parse_expression(text):
+    """(structure node, structure control, scale, [(control, node, scale)], ignored transforms)"""
+    text = _PREFIX.sub('', text, count=1).strip()
+    if _string_arg(text) is not None:
+        text = f'sound {text}'
+    segments = _split_top(text, '$')
+    ignored = []
+    parts = _split_top(segments[-1], '#')
+    structure = _unwrap(parts[0])
+    name, _, arg = structure.partition(' ')
+    if not re.match(r'[a-zA-Z]\w*$', name) or not arg.strip():
+        raise PreviewError(f"can't preview {structure!r} - expected e.g. sound \"bd sn\"")
+    node, scale = _parse_value(arg)
+    controls = []
+    for part in parts[1:]:
+        control, _, value = part.strip().partition(' ')
+        try:
+            value_node, value_scale = _parse_value(value)
+        except PreviewError:
+            ignored.append(f'# {part.strip()}')
+            continue
+        controls.append((control, value_node, value_scale))
+    for segment in reversed(segments[:-1]):
+        node = _apply_transform(segment, node, ignored)
+    return node, name, scale, controls, ignored
+
+
+def _random(times):
+    """Deterministic pseudo-random [0, 1) per time, so previews are repeatable"""
+    x = np.sin(times * 12.9898 + 78.233) * 43758.5453
+    return x - np.floor(x)
+
+
+def _empty():
+    return (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64))
+
+
+def _concat(results):
+    results = [r for r in results if len(r[0])]
+    if not results:
+        return _empty()
+    if len(results) == 1:
+        return results[0]
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+
+def _counts(first, qe):
+    """Whole steps from first to each arc end, refusing more than MAX_EVENTS in total"""
+    counts = np.maximum(np.ceil(qe - EPSILON) - first, 0)
+    total = counts.sum()
+    if not np.isfinite(total) or total > MAX_EVENTS:
+        raise PreviewError(f'too many events to preview (more than {MAX_EVENTS:,}) - try a shorter window')
+    return counts.astype(np.int64)
+
+
+def _split_cycles(qs, qe):
+    """Cut arcs at cycle boundaries: (source arc index, cycle, start, end)"""
+    first = np.floor(qs + EPSILON)
+    counts = _counts(first, qe)
+    source = np.repeat(np.arange(len(qs)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cycle = first[source] + within
+    start = np.maximum(qs[source], cycle)
+    end = np.minimum(qe[source], cycle + 1)
+    keep = end - start > EPSILON
+    return source[keep], cycle[keep], start[keep], end[keep]
+
+
+class _Query:
+    """Batched queries over one pattern tree; values are interned as integer ids"""
+
+    def __init__(self):
+        self.values = []
+        self.events = 0  # Leaf events produced so far, against MAX_EVENTS
+        self._ids = {}
+        self._numbers = None
+
+    def value_id(self, value):
+        if value not in self._ids:
+            self._ids[value] = len(self.values)
+            self.values.append(value)
+        return self._ids[value]
+
+    def numbers(self, ids):
+        """Numeric value of each id (NaN for words that aren't numbers)"""
+        if self._numbers is None or len(self._numbers) < len(self.values):
+            self._numbers = np.array([float(v) if _NUMBER.match(v) else math.nan for v in self.values])
+        return self._numbers[ids]
+
+    def query(self, node, qs, qe):
+        """Events with onsets in each arc: (arc index, onset, duration, value id) arrays"""
+        if not len(qs):
+            return _empty()
+        kind = type(node)
+        if kind is Word:
+            first = np.ceil(qs - EPSILON)
+            counts = _counts(first, qe)
+            self.events += int(counts.sum())
+            if self.events > MAX_EVENTS:
+                raise PreviewError(f'too many events to preview (more than {MAX_EVENTS:,}) - try a shorter window')
+            index = np.repeat(np.arange(len(qs)), counts)
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            onset = first[index] + within
+            return index, onset, np.ones(len(onset)), np.full(len(onset), self.value_id(node.value))
+        if kind is Rest:
+            return _empty()
+        if kind is Sequence:
+            return self.sequence(node, qs, qe)
+        if kind is Stack:
+            return _concat([self.query(layer, qs, qe) for layer in node.layers])
+        if kind is RandomChoice:
+            source, cycle, start, end = _split_cycles(qs, qe)
+            choice = (_random(cycle) * len(node.layers)).astype(np.int64)
+            return self._by_mask(node.layers, choice, source, start, end)
+        if kind is Alternate:
+            return self.alternate(node, qs, qe)
+        if kind is Fast or kind is Slow:
+            return self.fast(node, qs, qe)
+        if kind is Polymeter:
+            return self.polymeter(node, qs, qe)
+        if kind is Degrade:
+            index, onset, duration, values = self.query(node.node, qs, qe)
+            keep = _random(onset) >= node.amount
+            return index[keep], onset[keep], duration[keep], values[keep]
+        if kind is Euclid:
+            return self.query(self.euclid(node), qs, qe)
+        if kind is Range:
+            low, high = _whole(node.start), _whole(node.end)
+            if abs(high - low) >= MAX_EVENTS:
+                raise PreviewError(f'range {low} .. {high} is too wide to preview')
+            step = 1 if high >= low else -1
+            words = [(Word(str(v)), 1) for v in range(low, high + step, step)]
+            return self.sequence(Sequence(tuple(words)), qs, qe)
+        if kind is Rev:
+            return self.rev(node, qs, qe)
+        if kind is Every:
+            source, cycle, start, end = _split_cycles(qs, qe)
+            applied = (np.mod(cycle, node.period) == 0) if node.period > 0 else np.zeros(len(cycle), bool)
+            return self._by_mask((node.node, node.applied), applied.astype(np.int64), source, start, end)
+        raise PreviewError(f"can't preview {kind.__name__}")
+
+    def _by_mask(self, nodes, choice, source, start, end):
+        results = []
+        for i, child in enumerate(nodes):
+            mask = choice == i
+            if mask.any():
+                index, onset, duration, values = self.query(child, start[mask], end[mask])
+                results.append((source[mask][index], onset, duration, values))
+        return _concat(results)
+
+    def sequence(self, node, qs, qe):
+        """Each step's child plays its cycle squeezed into the step's slot"""
+        if not node.steps:
+            return _empty()
+        total = float(sum(weight for _, weight in node.steps))
+        source, cycle, start, end = _split_cycles(qs, qe)
+        results = []
+        offset = 0.0
+        for child, weight in node.steps:
+            width = weight / total
+            low = cycle + offset / total
+            offset += weight
+            s = np.maximum(start, low)
+            e = np.minimum(end, low + width)
+            mask = e - s > EPSILON
+            if not mask.any():
+                continue
+            c, lo = cycle[mask], low[mask]
+            index, onset, duration, values = self.query(child, c + (s[mask] - lo) / width,
+                                                        c + (e[mask] - lo) / width)
+            results.append((source[mask][index],
+                            lo[index] + (onset - c[index]) * width,
+                            duration * width,
+                            values))
+        return _concat(results)
+
+    def alternate(self, node, qs, qe):
+        """<a b c>: one layer per cycle, each layer seeing its own consecutive cycles"""
+        count = len(node.layers)
+        if not count:
+            return _empty()
+        source, cycle, start, end = _split_cycles(qs, qe)
+        choice = np.mod(cycle, count).astype(np.int64)
+        shift = cycle - np.floor_divide(cycle - choice, count)
+        results = []
+        for i, child in enumerate(node.layers):
+            mask = choice == i
+            if mask.any():
+                index, onset, duration, values = self.query(child, start[mask] - shift[mask],
+                                                            end[mask] - shift[mask])
+                results.append((source[mask][index], onset + shift[mask][index], duration, values))
+        return _concat(results)
+
+    def factor(self, node, cycle):
+        """A speed factor per cycle (patterned factors like <2 3> take the value at the cycle start)"""
+        if type(node) is Word:
+            value = float(node.value)
+            return np.full(len(cycle), value)
+        index, onset, _, values = self.query(node, cycle, cycle + 1)
+        factor = np.full(len(cycle), math.nan)
+        order = np.lexsort((onset, index))[::-1]  # Earliest onset last, so it wins the assignment
+        factor[index[order]] = self.numbers(values[order])
+        return factor
+
+    def fast(self, node, qs, qe):
+        if type(node.factor) is Word:
+            factor = float(node.factor.value)
+            factor = factor if type(node) is Fast else (1 / factor if factor else 0.0)
+            if factor <= 0:
+                return _empty()
+            index, onset, duration, values = self.query(node.node, qs * factor, qe * factor)
+            return index, onset / factor, duration / factor, values
+        source, cycle, start, end = _split_cycles(qs, qe)
+        factor = self.factor(node.factor, cycle)
+        if type(node) is Slow:
+            with np.errstate(divide='ignore'):
+                factor = 1 / factor
+        keep = np.isfinite(factor) & (factor > 0)
+        source, start, end, factor = source[keep], start[keep], end[keep], factor[keep]
+        index, onset, duration, values = self.query(node.node, start * factor, end * factor)
+        return source[index], onset / factor[index], duration / factor[index], values
+
+    def polymeter(self, node, qs, qe):
+        """{a b c, d e}%n: every layer runs at n steps per cycle"""
+        layers = [layer for layer in node.layers if layer.steps]
+        if not layers:
+            return _empty()
+        steps = node.steps if node.steps is not None else Word(str(len(layers[0].steps)))
+        results = []
+        for layer in layers:
+            if type(steps) is Word:
+                factor = Word(repr(float(steps.value) / len(layer.steps)))
+            else:
+                raise PreviewError("can't preview a patterned polymeter step count")
+            results.append(self.query(Fast(layer, factor), qs, qe))
+        return _concat(results)
+
+    def euclid(self, node):
+        args = [node.hits, node.steps, node.rotation or Word('0')]
+        if not all(type(arg) is Word and _NUMBER.match(arg.value) for arg in args):
+            raise PreviewError("can't preview patterned euclid arguments")
+        hits, steps, rotation = (_whole(arg.value) for arg in args)
+        if steps > MAX_EVENTS:
+            raise PreviewError(f'euclid with {steps} steps is too many to preview')
+        pattern = bjorklund(abs(hits), steps)
+        if pattern:
+            rotation %= len(pattern)
+            pattern = pattern[rotation:] + pattern[:rotation]
+        if hits < 0:
+            pattern = [not hit for hit in pattern]
+        return Sequence(tuple((node.node if hit else Rest(), 1) for hit in pattern))
+
+    def rev(self, node, qs, qe):
+        """Reverse each cycle: query whole cycles, mirror, keep onsets in the arc"""
+        source, cycle, start, end = _split_cycles(qs, qe)
+        index, onset, duration, values = self.query(node.node, cycle, cycle + 1)
+        mirrored = 2 * cycle[index] + 1 - onset - duration
+        keep = (mirrored >= start[index] - EPSILON) & (mirrored < end[index] - EPSILON)
+        return source[index][keep], mirrored[keep], duration[keep], values[keep]
+
+
+def _note_number(value):
+    match = _NOTE.match(value)
+    if not match:
+        return None
+    note, modifiers, octave = match.groups()
+    number = NOTE_NAMES[note] + modifiers.count('s') + modifiers.count('#') - modifiers.count('f')
+    return number + (int(octave) - 5) * 12 if octave else number
+
+
+def _convert(control, value, scale):
+    """JSON value for one control: numbers, note names, scale degrees, s:n splitting"""
+    if control in _SOUND_PARAMS:
+        sound, _, index = value.partition(':')
+        return {'s': sound, 'n': int(index)} if index.isdigit() else {'s': value}
+    if _NUMBER.match(value):
+        number = float(value)
+        if scale:
+            degrees = SCALES[scale]
+            octave, degree = divmod(int(number), len(degrees))
+            number = degrees[degree] + 12 * octave
+        return {control: int(number) if number == int(number) else number}
+    if control in _NOTE_PARAMS:
+        number = _note_number(value)
+        if number is not None:
+            return {control: number}
+    return {control: value}
+
+
+def render(expression, start=0.0, end=1.0):
+    """Events {onset, duration, s, n, ...} with onsets in [start, end), sorted by onset"""
+    if np is None:
+        raise PreviewError('pattern preview needs NumPy (pip install numpy)')
+    if not end > start:
+        raise PreviewError('end must be after start')
+    if end - start > MAX_CYCLES:
+        raise PreviewError(f'at most {MAX_CYCLES} cycles per preview')
+    node, control, scale, controls, ignored = parse_expression(expression)
+
+    query = _Query()
+    arc_start = np.array([float(start)])
+    arc_end = np.array([float(end)])
+    _, onset, duration, values = query.query(node, arc_start, arc_end)
+    order = np.argsort(onset, kind='stable')
+    onset, duration, values = onset[order], duration[order], values[order]
+
+    columns = [(control, values, query, scale)]
+    for name, value_node, value_scale in controls:
+        # Structure comes from the left: each event takes the control value active at its onset
+        value_query = _Query()
+        window_start = np.array([math.floor(start)])
+        _, v_onset, v_duration, v_values = value_query.query(value_node, window_start, arc_end)
+        v_order = np.argsort(v_onset, kind='stable')
+        v_onset, v_end, v_values = v_onset[v_order], (v_onset + v_duration)[v_order], v_values[v_order]
+        position = np.searchsorted(v_onset, onset, side='right') - 1
+        valid = position >= 0
+        valid[valid] = onset[valid] < v_end[position[valid]]
+        columns.append((name, np.where(valid, v_values[np.maximum(position, 0)], -1), value_query, value_scale))
+
+    converted = [[_convert(name, value, value_scale) for value in value_query.values]
+                 for name, _, value_query, value_scale in columns]
+    events = []
+    onsets = np.round(onset, 6).tolist()
+    durations = np.round(duration, 6).tolist()
+    column_ids = [ids.tolist() for _, ids, _, _ in columns]
+    for i in range(len(onsets)):
+        event = {'onset': onsets[i], 'duration': durations[i]}
+        for table, ids in zip(converted, column_ids):
+            if ids[i] >= 0:
+                event.update(table[ids[i]])
+        events.append(event)
+    return {'start': start, 'end': end, 'count': len(events), 'events': events, 'ignored': ignored}
+
+
+class PatternRenderer:
+    """render() behind a bounded LRU keyed by expression and window"""
+
+    def __init__(self, cache_size=128):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def render(self, expression, start=0.0, end=1.0):
+        key = (expression, float(start), float(end))
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return result
+        result = render(expression, start, end)
+        with self._lock:
+            self.cache_misses += 1
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def info(self):
+        return {
+            'numpy': HAVE_NUMPY,
+            'cache_size': len(self._cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
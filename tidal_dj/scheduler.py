@@ -0,0 +1,214 @@
+"""
+Cycle-quantized command scheduler
+Holds commands until just before a cycle boundary (next beat, bar or N cycles)
+on the service's own tempo clock, then releases each boundary's commands as
+one batch. The release runs early by the measured delivery latency, so the
+command lands on the boundary rather than after it.
+"""
+
+import ast
+import heapq
+import itertools
+import math
+import operator
+import re
+import threading
+import time
+
+# Tidal's default tempo: 0.5625 cycles per second (135 bpm at 4 beats per cycle)
+DEFAULT_CPS = 0.5625
+BEATS_PER_CYCLE = 4
+
+QUANTIZE_WORDS = {
+    'beat': 1 / BEATS_PER_CYCLE,
+    'half': 0.5,
+    'bar': 1.0,
+    'cycle': 1.0,
+}
+
+_QUANTIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)?\s*(beat|half|bar|cycle)?s?\s*$')
+_SETCPS = re.compile(r'^\s*setcps\s+(.+?)\s*$')
+_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+
+def parse_quantize(value):
+    """Grid size in cycles: 'beat', 'bar', '2 bars', 4, '0.5' ... (ValueError if unusable)"""
+    if isinstance(value, bool):
+        raise ValueError(f'bad quantize value {value!r}')
+    if isinstance(value, (int, float)):
+        grid = float(value)
+    else:
+        match = _QUANTIZE.match(str(value).lower())
+        if not match or not any(match.groups()):
+            raise ValueError(f"bad quantize value {value!r} (use 'beat', 'bar' or a number of cycles)")
+        count, unit = match.groups()
+        grid = float(count or 1) * QUANTIZE_WORDS.get(unit, 1.0)
+    if not grid > 0 or math.isinf(grid):
+        raise ValueError(f'quantize must be a positive number of cycles, not {value!r}')
+    return grid
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return float(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_evaluate(node.operand)
+    raise ValueError('not plain arithmetic')
+
+
+def parse_setcps(command):
+    """The tempo a `setcps 0.6` / `setcps (120/60/4)` command sets, or None"""
+    match = _SETCPS.match(command)
+    if not match:
+        return None
+    try:
+        cps = _evaluate(ast.parse(match.group(1), mode='eval'))
+    except (SyntaxError, ValueError, ZeroDivisionError):
+        return None
+    return cps if cps > 0 else None
+
+
+class TempoClock:
+    """Cycle position as a function of wall time; tempo changes keep the current phase"""
+
+    def __init__(self, cps=DEFAULT_CPS):
+        self._lock = threading.Lock()
+        self.cps = cps
+        self._origin_time = time.time()
+        self._origin_cycle = 0.0
+
+    def cycle_at(self, at=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            return self._origin_cycle + (at - self._origin_time) * self.cps
+
+    def time_at(self, cycle):
+        with self._lock:
+            return self._origin_time + (cycle - self._origin_cycle) / self.cps
+
+    def set(self, cps=None, cycle=None):
+        """Change tempo and/or realign so that `cycle` is now"""
+        now = time.time()
+        with self._lock:
+            current = self._origin_cycle + (now - self._origin_time) * self.cps
+            self._origin_time = now
+            self._origin_cycle = current if cycle is None else float(cycle)
+            if cps is not None:
+                if not cps > 0:
+                    raise ValueError('cps must be positive')
+                self.cps = float(cps)
+
+    def info(self):
+        cycle = self.cycle_at()
+        return {'cps': self.cps,
+                'bpm': round(self.cps * 60 * BEATS_PER_CYCLE, 3),
+                'cycle': round(cycle, 4)}
+
+
+class CommandScheduler:
+    """Priority queue of commands keyed by target cycle, released in batches ahead of time"""
+
+    def __init__(self, clock, deliver, lead=0.05, min_lead=0.005, max_lead=1.0, margin=0.01):
+        self.clock = clock
+        self.deliver = deliver  # deliver(entries), called on the scheduler thread
+        self.lead = lead
+        self.min_lead = min_lead
+        self.max_lead = max_lead
+        self.margin = margin
+        self.latency = None
+        self.jitter = 0.0
+        self.scheduled = 0
+        self.released = 0
+        self.batches = 0
+        self.late = 0
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def observe(self, seconds):
+        """Feed a measured release-to-delivery latency; the lead tracks mean + 2x jitter"""
+        with self._cond:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.jitter += 0.2 * (abs(seconds - self.latency) - self.jitter)
+                self.latency += 0.2 * (seconds - self.latency)
+            lead = self.latency + 2 * self.jitter + self.margin
+            self.lead = min(self.max_lead, max(self.min_lead, lead))
+            self._cond.notify()
+
+    def submit(self, command, quantize, **fields):
+        """Queue command for the next `quantize` boundary we can still make; returns the entry"""
+        grid = parse_quantize(quantize)
+        with self._cond:
+            earliest = self.clock.cycle_at(time.time() + self.lead)
+            target = (math.floor(earliest / grid + 1e-9) + 1) * grid
+            entry = dict(fields, command=command, cycle=target, grid=grid, at=self.clock.time_at(target))
+            heapq.heappush(self._heap, (target, next(self._order), entry))
+            self.scheduled += 1
+            self._cond.notify()
+        return entry
+
+    def pending(self):
+        with self._cond:
+            return [dict(entry) for _, _, entry in sorted(self._heap)]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='command-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Re-evaluate release times (after a tempo change)"""
+        with self._cond:
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    target = self._heap[0][0]
+                    release_at = self.clock.time_at(target) - self.lead
+                    delay = release_at - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(min(delay, 1.0))
+                # Everything due for this boundary (and any overdue ones) goes as one batch
+                batch = []
+                while self._heap and self._heap[0][0] <= target:
+                    batch.append(heapq.heappop(self._heap)[2])
+                now = time.time()
+                for entry in batch:
+                    entry['released_at'] = now
+                    entry['at'] = self.clock.time_at(entry['cycle'])
+                    if now > entry['at']:
+                        self.late += 1
+                self.released += len(batch)
+                self.batches += 1
+            try:
+                self.deliver(batch)
+            except Exception as e:
+                print(f"   ⚠️  Scheduled delivery failed: {e}")
+
+    def info(self):
+        with self._cond:
+            return {
+                'pending': len(self._heap),
+                'next_cycle': self._heap[0][0] if self._heap else None,
+                'lead_ms': round(self.lead * 1000, 3),
+                'latency_ms': round(self.latency * 1000, 3) if self.latency is not None else None,
+                'jitter_ms': round(self.jitter * 1000, 3),
+                'scheduled': self.scheduled,
+                'released': self.released,
+                'batches': self.batches,
+                'late': self.late,
+            }
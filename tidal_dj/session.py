@@ -0,0 +1,265 @@
+"""
+Session recorder and replay
+Every accepted command goes into a compact append-only binary log with its
+monotonic time offset and cycle position. A replay plays a log back through
+the normal delivery pipeline at 1x, Nx or as fast as possible - exact
+reproduction of a set, or a realistic load for the pipeline.
+
+File: header (magic, version, wall-clock start, cps at start), then one record
+per command: varint microseconds since the previous record, cycle (f64),
+quantize grid in cycles (f32, 0 = straight away), varint length + UTF-8 command.
+"""
+
+import struct
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+MAGIC = b'TSES'
+VERSION = 1
+SESSION_SUFFIX = '.tses'
+
+_HEADER = struct.Struct('>4sBdd')  # magic, version, started (unix time), cps
+_FIELDS = struct.Struct('>df')  # cycle, grid
+
+# offset: seconds since the session started
+SessionRecord = namedtuple('SessionRecord', 'offset cycle grid command')
+
+
+def _varint(value):
+    if value < 0:
+        raise ValueError(f'varint must not be negative, got {value}')
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise IndexError('truncated varint')
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_record(delta_us, cycle, grid, command):
+    payload = command.encode('utf-8')
+    return _varint(delta_us) + _FIELDS.pack(cycle, grid or 0.0) + _varint(len(payload)) + payload
+
+
+def read_session(path):
+    """(header dict, [SessionRecord]) - a record cut short by a crash ends the list (ValueError if not a session)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f'{Path(path).name}: not a session file')
+    magic, version, started, cps = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{Path(path).name}: not a session file (or an unknown version)')
+    records = []
+    pos = _HEADER.size
+    elapsed_us = 0
+    while pos < len(data):
+        try:
+            delta_us, at = _read_varint(data, pos)
+            cycle, grid = _FIELDS.unpack_from(data, at)
+            length, at = _read_varint(data, at + _FIELDS.size)
+            if at + length > len(data):
+                break
+            command = data[at:at + length].decode('utf-8')
+        except (IndexError, struct.error, UnicodeDecodeError):
+            break
+        elapsed_us += delta_us
+        records.append(SessionRecord(elapsed_us / 1e6, cycle, grid or None, command))
+        pos = at + length
+    return {'started': started, 'cps': cps, 'bytes': len(data)}, records
+
+
+def list_sessions(directory):
+    """Session files in directory, newest first"""
+    try:
+        paths = [path for path in Path(directory).iterdir() if path.suffix == SESSION_SUFFIX]
+    except OSError:
+        return []
+    paths.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+    return [{'name': path.stem, 'bytes': path.stat().st_size, 'modified': path.stat().st_mtime}
+            for path in paths]
+
+
+class SessionRecorder:
+    """Appends accepted commands to the current session file"""
+
+    def __init__(self, directory, clock, keep=0):
+        self.directory = Path(directory)
+        self.clock = clock  # TempoClock: cycle positions and the cps in the header
+        self.keep = keep  # Session files to keep, newest first, counting the current one (0 = all)
+        self.path = None
+        self.pruned = 0
+        self.recorded = 0
+        self.bytes = 0
+        self._file = None
+        self._last = None  # monotonic time of the previous record
+        self._lock = threading.Lock()
+
+    def start(self, name=None):
+        """Close the current session (if any) and begin a new one; returns its name"""
+        name = name or time.strftime('%Y%m%d-%H%M%S')
+        if not name.replace('-', '').replace('_', '').isalnum():
+            raise ValueError(f'bad session name {name!r} (letters, digits, - and _)')
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f'{name}{SESSION_SUFFIX}'
+        if path.exists():
+            raise ValueError(f'session {name!r} already exists')
+        with self._lock:
+            self._close()
+            self._file = open(path, 'ab')
+            header = _HEADER.pack(MAGIC, VERSION, time.time(), self.clock.cps)
+            self._file.write(header)
+            self._file.flush()
+            self.path = path
+            self.recorded = 0
+            self.bytes = len(header)
+            self._last = time.monotonic()
+        self._prune(path)
+        return name
+
+    def _prune(self, current):
+        """Delete the oldest session files beyond keep (never the one being recorded)"""
+        if not self.keep:
+            return
+        old = [self.directory / f"{session['name']}{SESSION_SUFFIX}" for session in list_sessions(self.directory)]
+        old = [path for path in old if path != current][self.keep - 1:]
+        for path in old:
+            try:
+                path.unlink()
+                self.pruned += 1
+            except OSError as e:
+                print(f"   ⚠️  Could not remove old session {path.name}: {e}")
+
+    def stop(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.path = None
+
+    def record(self, commands, grid=None):
+        """Append commands accepted together (one timestamp, the current cycle)"""
+        cycle = self.clock.cycle_at()
+        with self._lock:
+            if self._file is None:
+                return
+            # Read under the lock: a timestamp taken before it could be older than _last
+            now = time.monotonic()
+            data = b''
+            for command in commands:
+                data += encode_record(int((now - self._last) * 1e6), cycle, grid, command)
+                self._last = now
+            try:
+                self._file.write(data)
+                self._file.flush()  # Page cache is enough: a crash loses at most a partial record
+            except OSError as e:
+                print(f"   ⚠️  Session recording stopped: {e}")
+                self._close()
+                return
+            self.recorded += len(commands)
+            self.bytes += len(data)
+
+    def info(self):
+        with self._lock:
+            return {'recording': self._file is not None,
+                    'session': self.path.stem if self.path else None,
+                    'commands': self.recorded,
+                    'bytes': self.bytes,
+                    'keep': self.keep,
+                    'pruned': self.pruned}
+
+
+class SessionReplay:
+    """Plays records back through submit(self, record) at `speed` times the original pace (0 = no waiting)"""
+
+    def __init__(self, name, records, submit, speed=1.0, lateness=None):
+        self.name = name
+        self.records = records
+        self.submit = submit  # submit(replay, record) -> True once it's in the pipeline
+        self.speed = speed
+        self.lateness = lateness  # Histogram of how far behind schedule each command went in
+        self.sent = 0
+        self.failed = 0
+        self.max_late = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self.state = 'pending'
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self.state = 'running'
+            self._thread = threading.Thread(target=self._run, name=f'replay:{self.name}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def stopping(self):
+        return self._stopped.is_set()
+
+    def _run(self):
+        self.started_at = time.monotonic()
+        first = self.records[0].offset if self.records else 0.0  # No waiting out the quiet before it
+        for record in self.records:
+            if self.speed:
+                due = self.started_at + (record.offset - first) / self.speed
+                if self._stopped.wait(max(0.0, due - time.monotonic())):
+                    break
+                late = time.monotonic() - due
+                self.max_late = max(self.max_late, late)
+                if self.lateness is not None:
+                    self.lateness.record(max(0.0, late))
+            elif self._stopped.is_set():
+                break
+            try:
+                ok = self.submit(self, record)
+            except Exception as e:
+                print(f"   ⚠️  Replaying {record.command!r} failed: {e}")
+                ok = False
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+        self.finished_at = time.monotonic()
+        self.state = 'stopped' if self._stopped.is_set() else 'done'
+
+    def info(self):
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            'session': self.name,
+            'state': self.state,
+            'speed': self.speed or 'max',
+            'commands': len(self.records),
+            'sent': self.sent,
+            'failed': self.failed,
+            'elapsed_seconds': round(elapsed, 3),
+            'original_seconds': round(self.records[-1].offset - self.records[0].offset, 3) if self.records else 0.0,
+            'rate': round(self.sent / elapsed, 1) if elapsed > 0 else None,
+            'max_late_ms': round(self.max_late * 1000, 3),
+        }
@@ -0,0 +1,164 @@
+"""
+.tidal set files as an index of blocks
+A block is a run of non-blank lines - the unit Tidal editors evaluate. Each
+one is keyed by what it drives (d1, hush, once, setcps ...) and hashed, so a
+reload only has to send the blocks that actually changed.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from tidal_dj.watcher import make_notifier
+
+SET_SUFFIX = '.tidal'
+
+# key: 'd1', 'hush', 'let bass' ... ('d1#2' for the second d1 block); line: 1-based
+Block = namedtuple('Block', 'key line text hash')
+
+_CHANNEL = re.compile(r'^(d\d+)(?![\w\'])')
+_LET = re.compile(r"^let\s+([a-z_][\w']*)")
+_WORD = re.compile(r"^([A-Za-z_][\w']*)")
+
+
+def block_key(text):
+    """What a block drives: its channel, `let` name or first word"""
+    for pattern, prefix in ((_CHANNEL, ''), (_LET, 'let ')):
+        match = pattern.match(text)
+        if match:
+            return prefix + match.group(1)
+    match = _WORD.match(text)
+    return match.group(1) if match else text.split()[0]
+
+
+def _finish(lines, first_line, blocks, seen):
+    text = '\n'.join(lines)
+    key = block_key(text)
+    seen[key] = seen.get(key, 0) + 1
+    if seen[key] > 1:
+        key = f'{key}#{seen[key]}'
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+    blocks.append(Block(key, first_line, text, digest))
+
+
+def parse_set(source):
+    """Blocks of a .tidal file in order; comment lines and `{- -}` comments don't count"""
+    blocks = []
+    seen = {}
+    lines = []
+    first_line = None
+    in_comment = False
+    for number, raw in enumerate(source.splitlines(), 1):
+        line = raw.rstrip()
+        stripped = line.strip()
+        if in_comment:
+            in_comment = '-}' not in stripped
+            continue
+        if stripped.startswith('{-'):
+            in_comment = '-}' not in stripped[2:]
+            continue
+        if stripped.startswith('--'):
+            continue
+        if not stripped:
+            if lines:
+                _finish(lines, first_line, blocks, seen)
+                lines = []
+            continue
+        if not lines:
+            first_line = number
+        lines.append(line)
+    if lines:
+        _finish(lines, first_line, blocks, seen)
+    return blocks
+
+
+def changed_blocks(previous, blocks):
+    """Blocks whose key is new or whose hash differs from previous ({key: hash})"""
+    return [block for block in blocks if previous.get(block.key) != block.hash]
+
+
+class SetLoader:
+    """parse_set per file, cached on (mtime, size) in a small LRU"""
+
+    def __init__(self, cache_size=32):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # path -> ((mtime_ns, size), blocks)
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def load(self, path):
+        """Blocks of the file at path (OSError if it can't be read)"""
+        path = str(path)
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == signature:
+                self._cache.move_to_end(path)
+                self.cache_hits += 1
+                return cached[1]
+        with open(path, encoding='utf-8') as f:
+            blocks = parse_set(f.read())
+        with self._lock:
+            self.cache_misses += 1
+            self._cache[path] = (signature, blocks)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return blocks
+
+    def info(self):
+        with self._lock:
+            return {
+                'cached': len(self._cache),
+                'cache_size': self.cache_size,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+            }
+
+
+class SetWatcher:
+    """Calls on_change(path) after a set file is saved (in place or by rename)"""
+
+    def __init__(self, path, on_change, settle=0.05):
+        self.path = Path(path)
+        self.on_change = on_change
+        self.settle = settle  # Editors write in several steps; wait for the last one
+        self.changes = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'set-watcher:{self.path.name}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        notifier = make_notifier(self.path.parent, names=[self.path.name])
+        try:
+            while not self._stopped.is_set():
+                if not notifier.wait(timeout=1.0):
+                    continue
+                while notifier.wait(timeout=self.settle):
+                    pass
+                if self._stopped.is_set() or not self.path.exists():
+                    continue
+                self.changes += 1
+                try:
+                    self.on_change(self.path)
+                except Exception as e:
+                    print(f"   ⚠️  Reloading {self.path.name} failed: {e}")
+        finally:
+            notifier.close()
+
+    def info(self):
+        return {'watching': self._thread is not None and not self._stopped.is_set(),
+                'changes': self.changes}
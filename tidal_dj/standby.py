@@ -0,0 +1,159 @@
+"""
+Hot-standby GHCi
+A second GHCi that has already loaded BootTidal waits in the background. When
+the live one crashes, stalls or is restarted, the spare takes over and gets
+the last-known state of every channel replayed into it, instead of the set
+going silent while a fresh GHCi boots.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from tidal_dj.coalesce import command_key
+from tidal_dj.sets import block_key
+
+_CHANNEL = re.compile(r'^d\d+$')
+_HUSH = re.compile(r'^\s*hush\s*$')
+
+
+def state_key(command):
+    """What part of GHCi's state a command sets, or None if it's a one-off (once, hush, ...)"""
+    key = command_key(command)
+    if key is not None:
+        return key
+    # Multi-line blocks: only channels and definitions are worth replaying
+    name = block_key(command.strip())
+    if _CHANNEL.match(name):
+        return ('channel', name)
+    if name.startswith('let '):
+        return ('let', name[4:])
+    return None
+
+
+class ChannelState:
+    """Last command per channel/tempo/definition - what a fresh GHCi needs to sound the same"""
+
+    def __init__(self):
+        self._state = OrderedDict()  # key -> command, oldest first
+        self._previous = {}  # key -> the command it replaced, for discard()
+        self._lock = threading.Lock()
+
+    def note(self, command):
+        """Follow a command GHCi has been sent"""
+        with self._lock:
+            if _HUSH.match(command):
+                for key in [key for key in self._state if key[0] == 'channel']:
+                    del self._state[key]
+                    self._previous.pop(key, None)
+                return
+            key = state_key(command)
+            if key is not None:
+                self._previous[key] = self._state.pop(key, None)
+                self._state[key] = command
+
+    def discard(self, command):
+        """GHCi rejected command: the channel keeps what it had before (replaying an error would break a batch)"""
+        key = state_key(command)
+        with self._lock:
+            if key is None or self._state.get(key) != command:
+                return
+            previous = self._previous.pop(key, None)
+            if previous is None:
+                del self._state[key]
+            else:
+                self._state[key] = previous
+
+    def holds(self, command):
+        """command is still what its channel/tempo/definition is set to"""
+        key = state_key(command)
+        with self._lock:
+            return key is not None and self._state.get(key) == command
+
+    def replay(self):
+        """Commands that rebuild the state: definitions first, then the rest in the order they were set"""
+        with self._lock:
+            items = list(self._state.items())
+        return ([command for key, command in items if key[0] == 'let'] +
+                [command for key, command in items if key[0] != 'let'])
+
+    def info(self):
+        with self._lock:
+            return {'keys': [key[1] if key[0] != 'let' else f'let {key[1]}' for key in self._state]}
+
+
+class GhciStandby:
+    """Keeps one booted spare session from factory() ready to take over"""
+
+    def __init__(self, factory, boot_timeout=60.0):
+        self.factory = factory  # () -> unstarted GhciSession
+        self.boot_timeout = boot_timeout
+        self.spare = None
+        self.boots = 0
+        self.boot_failures = 0
+        self.swaps = 0
+        self._booting = None  # Session being booted, so stop() can kill it
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def prepare(self):
+        """Start booting a spare in the background unless one is ready or on its way"""
+        with self._lock:
+            self._closed = False
+            if self._booting is not None or (self.spare is not None and self.spare.is_ready()):
+                return
+            self._booting = session = self.factory()
+        threading.Thread(target=self._boot, args=(session,), name='ghci-standby', daemon=True).start()
+
+    def _boot(self, session):
+        try:
+            session.start(self.boot_timeout)
+        except OSError as e:
+            print(f"   ⚠️  Standby GHCi failed to start: {e}")
+        with self._lock:
+            self._booting = None
+            if self._closed or not session.is_ready():
+                ready = False
+            else:
+                ready = True
+                self.spare = session
+                self.boots += 1
+        if not ready:
+            if not self._closed:
+                self.boot_failures += 1
+                print("   ⚠️  Standby GHCi didn't come up")
+            session.stop()
+
+    def take(self):
+        """Hand over the ready spare (None if there isn't one) and start booting the next"""
+        with self._lock:
+            spare, self.spare = self.spare, None
+        if spare is not None and not spare.is_ready():
+            spare.stop()
+            spare = None
+        if spare is not None:
+            self.swaps += 1
+        self.prepare()
+        return spare
+
+    def stop(self):
+        """Shut the spare down (and any boot in progress); prepare() brings it back"""
+        with self._lock:
+            self._closed = True
+            sessions = [session for session in (self.spare, self._booting) if session is not None]
+            self.spare = None
+        for session in sessions:
+            session.stop()
+
+    def info(self):
+        with self._lock:
+            spare = self.spare
+            state = 'ready' if spare is not None and spare.is_ready() else 'booting' if self._booting else 'none'
+        return {
+            'state': state,
+            'pid': spare.process.pid if state == 'ready' else None,
+            'boot_seconds': spare.info()['startup_seconds'] if state == 'ready' else None,
+            'boots': self.boots,
+            'boot_failures': self.boot_failures,
+            'swaps': self.swaps,
+        }
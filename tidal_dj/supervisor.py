@@ -0,0 +1,326 @@
+"""
+Process supervisor for the components the service launches
+Each child runs in its own process group, so stopping it takes down its
+whole tree and nothing else. A background loop reaps exits, runs cheap
+health checks and restarts failures with exponential backoff, giving up
+on a component that keeps crashing. Child output is drained into a
+bounded ring (and a log file) so a chatty child never blocks on its pipe.
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from tidal_dj.output import OutputCollector, OutputRing
+
+
+class Child:
+    """One supervised component: how to launch it and how to tell it's healthy"""
+
+    def __init__(self, name, spawn, healthy=None, stop=None, grace=10.0, restart=True, log=True, takeover=None,
+                 output_lines=500):
+        self.name = name
+        self.spawn = spawn  # spawn(stdout) -> Popen started with start_new_session=True
+        self.log = log  # False: the child handles its own output (spawn gets DEVNULL)
+        self.output = OutputRing(output_lines)  # Recent stdout/stderr lines, across restarts
+        self.takeover = takeover  # takeover() -> Popen of a warm replacement, or None to restart cold
+        self.healthy = healthy  # Cheap probe, only asked once the child has had `grace` seconds
+        self.stop = stop  # Custom stop(); default is SIGTERM then SIGKILL to the process group
+        self.grace = grace
+        self.restart = restart
+        self.process = None
+        self.wanted = False
+        self.state = 'stopped'
+        self.started_at = None
+        self.restarts = 0
+        self.takeovers = 0
+        self.failures = deque()  # monotonic times of recent unplanned exits
+        self.last_exit = None
+        self.health_failures = 0
+        self.last_check = 0.0
+        self.next_start = None
+
+
+class Supervisor:
+    """Owns child processes by PID/process group; restarts them when they die or stop answering"""
+
+    def __init__(self, log_dir=None, interval=0.2, health_interval=2.0, unhealthy_after=3,
+                 backoff=1.0, max_backoff=30.0, max_restarts=5, restart_window=60.0):
+        self.log_dir = Path(log_dir) if log_dir else None
+        self.interval = interval
+        self.health_interval = health_interval
+        self.unhealthy_after = unhealthy_after  # Consecutive failed checks before a restart
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts  # More unplanned exits than this within restart_window = crash loop
+        self.restart_window = restart_window
+        self.children = {}
+        self.listeners = []  # listener(info) on every state change
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, child):
+        self.children[child.name] = child
+        return child
+
+    def owns(self, name):
+        """True if name is ours and its process is alive"""
+        child = self.children.get(name)
+        return child is not None and child.process is not None and child.process.poll() is None
+
+    def start(self, name):
+        """Launch a component (clears a crash loop); 'started', 'already_running' or 'error: ...'"""
+        child = self.children[name]
+        with self._lock:
+            child.wanted = True
+            child.failures.clear()
+            if child.state == 'starting' or self.owns(name):
+                return 'already_running'
+        return self._spawn(child)
+
+    def stop(self, name, timeout=3.0):
+        """Stop a component and its process tree; it won't be restarted"""
+        child = self.children[name]
+        with self._lock:
+            child.wanted = False
+            process = child.process
+            if process is None or process.poll() is not None:
+                child.state = 'stopped'
+                return 'not_running'
+            child.state = 'stopping'
+        if child.stop:
+            child.stop()
+        else:
+            self._terminate(process, timeout)
+        with self._lock:
+            self._record_exit(child, 'stopped')
+            child.state = 'stopped'
+        self._notify(child)
+        return 'stopped'
+
+    def restart(self, name, timeout=3.0):
+        """Planned restart: hand over to the child's warm replacement if it has one, else stop and start"""
+        child = self.children[name]
+        with self._lock:
+            swap = child.takeover is not None and child.state == 'running' and self.owns(name)
+            if swap:
+                child.state = 'stopping'  # Keeps the monitor loop off it during the swap
+        if swap:
+            if self._take_over(child, 'restarted'):
+                return 'swapped'
+            with self._lock:
+                child.state = 'running'
+        self.stop(name, timeout)
+        return self.start(name)
+
+    def _take_over(self, child, reason):
+        """Swap in child.takeover(); False (nothing changed) if it had no replacement ready"""
+        try:
+            process = child.takeover()
+        except Exception as e:
+            print(f"   ⚠️  {child.name} takeover failed: {e}")
+            process = None
+        if process is None:
+            return False
+        with self._lock:
+            self._record_exit(child, reason)
+            child.last_exit['takeover'] = True
+            child.process = process
+            child.started_at = time.monotonic()
+            child.health_failures = 0
+            child.next_start = None
+            child.state = 'running'
+            child.restarts += 1
+            child.takeovers += 1
+        self._notify(child)
+        return True
+
+    @staticmethod
+    def _terminate(process, timeout):
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+            try:
+                process.wait(timeout)
+                return
+            except subprocess.TimeoutExpired:
+                continue
+
+    def _log_path(self, child):
+        return self.log_dir / f'{child.name}.log' if self.log_dir and child.log else None
+
+    def _spawn(self, child):
+        with self._lock:
+            child.state = 'starting'
+        try:
+            if self.log_dir is not None:
+                self.log_dir.mkdir(parents=True, exist_ok=True)
+            process = child.spawn(subprocess.PIPE if child.log else subprocess.DEVNULL)
+        except Exception as e:
+            # A missing binary or directory won't fix itself - don't retry it
+            with self._lock:
+                child.last_exit = {'code': None, 'signal': None, 'at': time.time(), 'uptime_seconds': None,
+                                   'reason': f'spawn failed: {e}'}
+                child.state = 'failed'
+                child.wanted = False
+            self._notify(child)
+            return f'error: {e}'
+        if child.log and process.stdout is not None:
+            OutputCollector(process.stdout, child.output, self._log_path(child), name=child.name).start()
+        with self._lock:
+            restarted = child.started_at is not None
+            child.process = process
+            child.started_at = time.monotonic()
+            child.health_failures = 0
+            child.state = 'running'
+            if restarted:
+                child.restarts += 1
+        self._notify(child)
+        return 'started'
+
+    def _record_exit(self, child, reason):
+        code = child.process.poll() if child.process else None
+        child.last_exit = {
+            'code': code if code is not None and code >= 0 else None,
+            'signal': -code if code is not None and code < 0 else None,
+            'at': time.time(),
+            'uptime_seconds': round(time.monotonic() - child.started_at, 3) if child.started_at else None,
+            'reason': reason,
+        }
+
+    def _note_failure(self, child):
+        now = time.monotonic()
+        child.failures.append(now)
+        while child.failures and now - child.failures[0] > self.restart_window:
+            child.failures.popleft()
+        return now
+
+    def _schedule_restart(self, child):
+        """After an unplanned exit: back off and restart, or give up on a crash loop"""
+        now = self._note_failure(child)
+        if not child.restart or not child.wanted:
+            child.state = 'exited'
+        elif len(child.failures) > self.max_restarts:
+            child.state = 'crash_loop'
+            child.wanted = False
+            print(f"   ❌ {child.name} crashed {len(child.failures)} times in {self.restart_window:g}s - giving up")
+        else:
+            delay = min(self.max_backoff, self.backoff * 2 ** (len(child.failures) - 1))
+            child.state = 'backoff'
+            child.next_start = now + delay
+            if child.takeover is None:
+                print(f"   🔁 {child.name} {child.last_exit['reason']} - restarting in {delay:g}s")
+
+    def start_monitoring(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='supervisor', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            for child in list(self.children.values()):
+                try:
+                    self._check(child)
+                except Exception as e:
+                    print(f"   ⚠️  Supervising {child.name} failed: {e}")
+
+    def _check(self, child):
+        now = time.monotonic()
+        with self._lock:
+            if not child.wanted or child.state in ('starting', 'stopping'):
+                return
+            if child.state == 'backoff':
+                if now < child.next_start:
+                    return
+                child.state = 'starting'
+                respawn = True
+            elif child.process is not None and child.process.poll() is not None:
+                # poll() reaps the child, so no zombies are left behind
+                self._record_exit(child, 'exited')
+                self._schedule_restart(child)
+                respawn = False
+            else:
+                respawn = None
+        if respawn:
+            threading.Thread(target=self._spawn, args=(child,), name=f'restart-{child.name}', daemon=True).start()
+            return
+        if respawn is False:
+            self._after_failure(child)
+            return
+        if not child.healthy or now - child.started_at < child.grace or now - child.last_check < self.health_interval:
+            return
+        child.last_check = now
+        try:
+            ok = bool(child.healthy())
+        except Exception:
+            ok = False
+        with self._lock:
+            child.health_failures = 0 if ok else child.health_failures + 1
+            if child.health_failures < self.unhealthy_after or child.state != 'running':
+                return
+            child.state = 'stopping'
+            process = child.process
+        print(f"   ⚠️  {child.name} failed {child.health_failures} health checks - restarting")
+        if child.takeover is not None and self._take_over(child, 'unhealthy'):
+            with self._lock:
+                self._note_failure(child)  # The takeover retires the stuck process itself
+            return
+        if child.stop:
+            child.stop()
+        else:
+            self._terminate(process, 3.0)
+        with self._lock:
+            self._record_exit(child, 'unhealthy')
+            self._schedule_restart(child)
+        self._after_failure(child)
+
+    def _after_failure(self, child):
+        """A warm replacement skips the backoff; without one the restart waits its turn"""
+        if child.state == 'backoff' and child.takeover is not None:
+            with self._lock:
+                child.state = 'stopping'
+            if self._take_over(child, child.last_exit['reason']):
+                return
+            with self._lock:
+                child.state = 'backoff'
+            print(f"   🔁 {child.name} {child.last_exit['reason']} - no standby ready, restarting in "
+                  f"{child.next_start - time.monotonic():.3g}s")
+        self._notify(child)
+
+    def _notify(self, child):
+        info = self.child_info(child)
+        for listener in self.listeners:
+            try:
+                listener(info)
+            except Exception:
+                pass
+
+    def child_info(self, child):
+        now = time.monotonic()
+        running = child.state == 'running' and child.process is not None and child.process.poll() is None
+        return {
+            'name': child.name,
+            'state': child.state,
+            'pid': child.process.pid if running else None,
+            'uptime_seconds': round(now - child.started_at, 3) if running else None,
+            'restarts': child.restarts,
+            'takeovers': child.takeovers,
+            'recent_failures': len(child.failures),
+            'last_exit': child.last_exit,
+            'health_failures': child.health_failures,
+            'next_restart_in': (round(max(0.0, child.next_start - now), 3)
+                                if child.state == 'backoff' else None),
+            'log': str(self._log_path(child)) if self._log_path(child) else None,
+            'output': child.output.info() if child.log else None,
+        }
+
+    def info(self):
+        return {name: self.child_info(child) for name, child in self.children.items()}
@@ -0,0 +1,312 @@
+"""
+OSC tap between Tidal and SuperDirt
+A UDP proxy: Tidal sends to the tap's port, the tap forwards each packet to
+SuperDirt straight away and only then decodes it. Each bundle's timetag is
+compared with its arrival time, which separates the causes of a sloppy set:
+late bundles and jitter come from GHCi scheduling or the network, while
+on-time bundles that still sound late point at SuperDirt itself.
+
+Every sender (each GHCi) gets its own upstream socket, so SuperDirt's replies
+(e.g. to Tidal's /dirt/handshake) go back to the right one.
+"""
+
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from tidal_dj.osc import decode_packet
+
+# Linux: the kernel reports datagrams it dropped on a full receive buffer
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+# Large enough for the biggest datagram a sender can hand us
+MAX_PACKET = 65536
+# Receive buffer the tap asks for; a burst that overflows it is counted as dropped
+RECEIVE_BUFFER = 1 << 20
+
+
+class _Sender:
+    """One client of the tap (a GHCi): its upstream socket and jitter state"""
+
+    def __init__(self, address, sock):
+        self.address = address
+        self.sock = sock
+        self.packets = 0
+        self.last_headroom = None
+        self.jitter = 0.0  # RFC 3550-style smoothed jitter (seconds)
+
+
+class OscTap:
+    """Forwards OSC from listen port to SuperDirt and keeps rolling timing stats"""
+
+    def __init__(self, listen_host, listen_port, upstream_host='127.0.0.1', upstream_port=57120,
+                 window=10, max_senders=64, lateness=None, headroom=None, jitter=None):
+        self.listen = (listen_host, listen_port)
+        self.upstream = (upstream_host, upstream_port)
+        self.window = window  # Seconds the per-orbit event rates are averaged over
+        self.max_senders = max_senders
+        # Histograms (metrics.Histogram): how late late bundles were, how early the rest, jitter
+        self.lateness = lateness
+        self.headroom = headroom
+        self.jitter = jitter
+        self.packets = 0
+        self.bytes = 0
+        self.bundles = 0
+        self.messages = 0
+        self.events = 0
+        self.late = 0
+        self.dropped = 0  # Kernel receive-buffer overflows + forwards that failed
+        self.overflows = 0
+        self.forward_errors = 0
+        self.malformed = 0
+        self.max_late = 0.0
+        self.started_at = None
+        self._orbit_events = {}  # orbit -> /dirt/play events since start
+        self._seconds = deque(maxlen=window + 1)  # (second, {orbit: events}) for the rolling rates
+        self._senders = OrderedDict()  # client address -> _Sender, least recently seen first
+        self._upstream = {}  # upstream socket -> _Sender
+        self._lock = threading.Lock()
+        self._sock = None
+        self._selector = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._overflow_base = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Bind the listen port and start forwarding (OSError if it's taken)"""
+        if self.running:
+            return self
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+            if SO_RXQ_OVFL is not None:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                except OSError:
+                    pass
+            sock.bind(self.listen)
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self._sock = sock
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ)
+        self._stopped.clear()
+        self._overflow_base = 0
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='osc-tap', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                for key, _ in self._selector.select(timeout=0.5):
+                    if key.fileobj is self._sock:
+                        self._drain_clients()
+                    else:
+                        self._drain_upstream(key.fileobj)
+        finally:
+            with self._lock:
+                for sender in self._senders.values():
+                    sender.sock.close()
+                self._senders.clear()
+                self._upstream.clear()
+            self._selector.close()
+            self._sock.close()
+
+    def _drain_clients(self):
+        while True:
+            try:
+                if SO_RXQ_OVFL is not None:
+                    data, ancillary, _, address = self._sock.recvmsg(MAX_PACKET, socket.CMSG_SPACE(4))
+                else:
+                    data, address = self._sock.recvfrom(MAX_PACKET)
+                    ancillary = ()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            arrived = time.time()
+            sender = self._sender(address)
+            try:
+                sender.sock.send(data)  # Forward first: decoding never delays SuperDirt
+            except OSError:
+                # Includes ECONNREFUSED from an earlier send when nothing listens upstream
+                with self._lock:
+                    self.forward_errors += 1
+                    self.dropped += 1
+            for level, kind, value in ancillary:
+                if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(value) >= 4:
+                    self._note_overflows(struct.unpack('=I', value[:4])[0])
+            self._observe(sender, data, arrived)
+
+    def _drain_upstream(self, sock):
+        sender = self._upstream.get(sock)
+        while True:
+            try:
+                data = sock.recv(MAX_PACKET)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionRefusedError:
+                # An earlier forward found nothing listening at SuperDirt's port
+                with self._lock:
+                    self.forward_errors += 1
+                    self.dropped += 1
+                continue
+            except OSError:
+                return
+            if sender is not None:
+                try:
+                    self._sock.sendto(data, sender.address)
+                except OSError:
+                    pass
+
+    def _sender(self, address):
+        sender = self._senders.get(address)
+        if sender is not None:
+            with self._lock:
+                self._senders.move_to_end(address)
+            return sender
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(self.upstream)
+        sock.setblocking(False)
+        sender = _Sender(address, sock)
+        self._selector.register(sock, selectors.EVENT_READ)
+        with self._lock:
+            self._senders[address] = sender
+            self._upstream[sock] = sender
+            if len(self._senders) > self.max_senders:
+                _, oldest = self._senders.popitem(last=False)
+                self._upstream.pop(oldest.sock, None)
+                self._selector.unregister(oldest.sock)
+                oldest.sock.close()
+        return sender
+
+    def _note_overflows(self, total):
+        # The kernel's count is cumulative for the socket
+        with self._lock:
+            if total > self._overflow_base:
+                self.dropped += total - self._overflow_base
+                self.overflows += total - self._overflow_base
+                self._overflow_base = total
+
+    def _observe(self, sender, data, arrived):
+        try:
+            messages = list(decode_packet(data))
+        except ValueError:
+            with self._lock:
+                self.packets += 1
+                self.bytes += len(data)
+                self.malformed += 1
+            return
+        orbits = {}
+        for _, address, args in messages:
+            if address == '/dirt/play':
+                orbit = _orbit(args)
+                orbits[orbit] = orbits.get(orbit, 0) + 1
+        due = messages[0][0] if messages else None
+        headroom = due - arrived if due is not None else None
+        second = int(arrived)
+        with self._lock:
+            self.packets += 1
+            self.bytes += len(data)
+            self.messages += len(messages)
+            sender.packets += 1
+            if orbits:
+                self.events += sum(orbits.values())
+                if not self._seconds or self._seconds[-1][0] != second:
+                    self._seconds.append((second, {}))
+                counts = self._seconds[-1][1]
+                for orbit, count in orbits.items():
+                    counts[orbit] = counts.get(orbit, 0) + count
+                    self._orbit_events[orbit] = self._orbit_events.get(orbit, 0) + count
+            if headroom is None:
+                return
+            self.bundles += 1
+            if headroom < 0:
+                self.late += 1
+                self.max_late = max(self.max_late, -headroom)
+            if sender.last_headroom is not None:
+                # Change in headroom from this sender's previous bundle (RFC 3550's D)
+                swing = abs(headroom - sender.last_headroom)
+                sender.jitter += (swing - sender.jitter) / 16
+            else:
+                swing = None
+            sender.last_headroom = headroom
+        if headroom < 0:
+            if self.lateness is not None:
+                self.lateness.record(-headroom)
+        elif self.headroom is not None:
+            self.headroom.record(headroom)
+        if swing is not None and self.jitter is not None:
+            self.jitter.record(swing)
+
+    def rates(self):
+        """Events per second per orbit over the last `window` seconds"""
+        now = int(time.time())
+        with self._lock:
+            seconds = list(self._seconds)
+        totals = {}
+        for second, counts in seconds:
+            if now - self.window <= second < now:
+                for orbit, count in counts.items():
+                    totals[orbit] = totals.get(orbit, 0) + count
+        return {orbit: round(count / self.window, 2) for orbit, count in sorted(totals.items())}
+
+    def info(self):
+        rates = self.rates()
+        with self._lock:
+            orbits = {str(orbit): {'events': count, 'rate': rates.get(orbit, 0.0)}
+                      for orbit, count in sorted(self._orbit_events.items())}
+            senders = [{'address': f'{sender.address[0]}:{sender.address[1]}',
+                        'packets': sender.packets,
+                        'jitter_ms': round(sender.jitter * 1000, 3)}
+                       for sender in self._senders.values()]
+            info = {
+                'running': self.running,
+                'listen': f'{self.listen[0]}:{self.listen[1]}',
+                'upstream': f'{self.upstream[0]}:{self.upstream[1]}',
+                'packets': self.packets,
+                'bytes': self.bytes,
+                'bundles': self.bundles,
+                'messages': self.messages,
+                'events': self.events,
+                'late': self.late,
+                'max_late_ms': round(self.max_late * 1000, 3),
+                'dropped': self.dropped,
+                'overflows': self.overflows,
+                'forward_errors': self.forward_errors,
+                'malformed': self.malformed,
+                'orbits': orbits,
+                'senders': senders,
+            }
+        for name, histogram in (('lateness', self.lateness), ('headroom', self.headroom), ('jitter', self.jitter)):
+            if histogram is not None:
+                info[name] = histogram.summary()
+        return info
+
+
+def _orbit(args):
+    """Orbit of a /dirt/play event (key/value args; 0 when it doesn't say)"""
+    for i in range(0, len(args) - 1, 2):
+        if args[i] == 'orbit':
+            try:
+                return int(args[i + 1])
+            except (TypeError, ValueError):
+                return 0
+    return 0
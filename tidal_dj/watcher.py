@@ -0,0 +1,225 @@
+"""
+Event-driven file watching for the command monitor
+inotify on Linux (via ctypes, no extra packages), stat polling everywhere else
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+# inotify event masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1  # Missing on macOS
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def _wanted(name, names, suffix):
+    if names is not None and name not in names:
+        return False
+    return suffix is None or name.endswith(suffix)
+
+
+class InotifyNotifier:
+    """Wakes when files in a directory are written, created, moved or deleted"""
+
+    kind = 'inotify'
+
+    def __init__(self, directory, names=None, suffix=None):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError('inotify not available')
+        self.names = set(names) if names else None
+        self.suffix = suffix
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # Watch the directory, not the file, so rotation and re-creation are seen
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), WATCH_MASK)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+
+    def wait(self, timeout=None):
+        """Block until a relevant event (True) or timeout (False)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self._drain():
+                return True
+
+    def _drain(self):
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length]
+                name = name.rstrip(b'\0').decode('utf-8', errors='ignore')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW or _wanted(name, self.names, self.suffix):
+                    relevant = True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class PollingNotifier:
+    """Fallback: compares (inode, size, mtime) of the watched files every interval"""
+
+    kind = 'polling'
+
+    def __init__(self, directory, names=None, interval=0.2, suffix=None):
+        self.directory = Path(directory)
+        self.names = set(names) if names else None
+        self.suffix = suffix
+        self.interval = interval
+        self._last = self._signature()
+
+    def _signature(self):
+        signature = {}
+        try:
+            entries = os.scandir(self.directory)
+        except OSError:
+            return signature
+        with entries:
+            for entry in entries:
+                if not _wanted(entry.name, self.names, self.suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                signature[entry.name] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        return signature
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._signature()
+            if current != self._last:
+                self._last = current
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+def make_notifier(directory, names=None, poll_interval=0.2, suffix=None):
+    """inotify when the platform has it, otherwise stat polling"""
+    try:
+        return InotifyNotifier(directory, names, suffix)
+    except OSError:
+        return PollingNotifier(directory, names, poll_interval, suffix)
+
+
+class FileTailer:
+    """Reads only the new complete lines of an append-only file
+
+    Handles truncation (size drops below our position), rotation (the path
+    now points at a different inode) and partial trailing lines.
+    """
+
+    def __init__(self, path, from_end=True):
+        self.path = Path(path)
+        self.file = None
+        self.inode = None
+        self.position = 0
+        self.partial = b''
+        self._open(from_end)
+
+    def _open(self, from_end=False):
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return False
+        st = os.fstat(f.fileno())
+        self.file = f
+        self.inode = (st.st_dev, st.st_ino)
+        self.position = st.st_size if from_end else 0
+        self.partial = b''
+        return True
+
+    def _read_available(self):
+        self.file.seek(self.position)
+        data = self.file.read()
+        self.position += len(data)
+        return data
+
+    def read_lines(self):
+        """Return the complete lines written since the last call"""
+        chunks = []
+        if self.file is None and not self._open():
+            return []
+
+        try:
+            st = os.stat(self.path)
+            current = (st.st_dev, st.st_ino)
+        except OSError:
+            current = None  # Deleted; finish what's left in the old file
+
+        if os.fstat(self.file.fileno()).st_size < self.position:
+            # Truncated in place - start over from the top
+            self.position = 0
+            self.partial = b''
+        chunks.append(self._read_available())
+
+        if current is not None and current != self.inode:
+            # Rotated: the old file is drained, switch to the new one from the start
+            leftover = self.partial + b''.join(chunks)
+            self.file.close()
+            self.file = None
+            chunks = [self._read_available()] if self._open() else []
+            if leftover and not leftover.endswith(b'\n'):
+                # The old file ended mid-line; the writer is gone, so keep what we have
+                leftover += b'\n'
+            self.partial = b''
+            chunks.insert(0, leftover)
+
+        data = self.partial + b''.join(chunks)
+        if not data:
+            return []
+        *lines, self.partial = data.split(b'\n')
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None